@@ -0,0 +1,87 @@
+"""
+How much a bot saves by asking the server for only the messages it
+handles (see BOT_MESSAGE_NARROWS in zulip_bots.lib) rather than every
+message in the realm.
+
+The realm is a zulip.testing.FakeServer holding BATCH_SIZE messages,
+RELEVANT_PER_THOUSAND of every thousand of which are private messages
+to the bot or mention it.  Each benchmark fetches and filters those
+messages' events as a bot's event loop does: from a single queue for
+all messages, or from a queue for each of the bot's narrows.  The
+size of the events is recorded in the benchmark's extra_info.
+"""
+
+import json
+from typing import Any, Dict, Iterator, List
+
+import pytest
+from zulip_bots.lib import BOT_MESSAGE_NARROWS
+
+from zulip.testing import FakeServer
+
+BATCH_SIZE = 1000
+RELEVANT_PER_THOUSAND = 20
+
+
+@pytest.fixture(scope="module")
+def server() -> Iterator[FakeServer]:
+    with FakeServer() as server:
+        server.add_user("iago@example.com", "Iago")
+        yield server
+
+
+def send_messages(server: FakeServer) -> None:
+    content = "Some typical message content. " * 10
+    for i in range(BATCH_SIZE):
+        message: Dict[str, Any] = {
+            "type": "stream",
+            "to": "general",
+            "topic": f"topic {i % 50}",
+            "content": content,
+        }
+        relevant = i // (1000 // RELEVANT_PER_THOUSAND)
+        if i % (1000 // RELEVANT_PER_THOUSAND) == 0:
+            # Alternate between mentions, private messages, and private
+            # messages that mention the bot, which match both narrows.
+            if relevant % 3:
+                message = {"type": "private", "to": [server.email], "content": content}
+            if relevant % 3 != 1:
+                message["content"] = "@**Test Bot** " + content
+        server.send_message(message, sender="iago@example.com")
+
+
+@pytest.mark.parametrize("narrowed", [False, True], ids=["all_messages", "narrowed"])
+def bench_bot_event_batch(benchmark: Any, server: FakeServer, narrowed: bool) -> None:
+    client = server.make_client()
+    narrows = BOT_MESSAGE_NARROWS if narrowed else [[]]
+    queue_ids = [client.register(["message"], narrow)["queue_id"] for narrow in narrows]
+    send_messages(server)
+
+    def handle_events() -> List[Dict[str, Any]]:
+        handled = []
+        for i, queue_id in enumerate(queue_ids):
+            # With last_event_id=-1, the events stay in the queue for
+            # the next round.
+            events = client.get_events(queue_id=queue_id, last_event_id=-1, dont_block=True)
+            for event in events["events"]:
+                message = event["message"]
+                if narrowed:
+                    # As in run_message_handler_for_bot.
+                    relevant = i == 0 or message["type"] != "private"
+                else:
+                    relevant = message["type"] == "private" or "mentioned" in event["flags"]
+                if relevant:
+                    handled.append(message)
+        return handled
+
+    try:
+        handled = benchmark(handle_events)
+        benchmark.extra_info["event_bytes"] = sum(
+            len(json.dumps(client.get_events(queue_id=queue_id, last_event_id=-1)))
+            for queue_id in queue_ids
+        )
+    finally:
+        for queue_id in queue_ids:
+            client.deregister(queue_id)
+        del server.messages[:]
+    assert len(handled) == RELEVANT_PER_THOUSAND * BATCH_SIZE // 1000
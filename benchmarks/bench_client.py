@@ -0,0 +1,154 @@
+"""
+End-to-end costs of zulip.Client's hot paths, against a
+zulip.testing.FakeServer on localhost:
+
+- bench_session_request and bench_do_api_query: one request with a
+  bare requests.Session, and through do_api_query; the difference is
+  the client's per-call overhead.
+- bench_call_endpoint: a POST with request parameters of growing size,
+  i.e. the cost of marshalling and sending them.
+- bench_call_on_each_event: handling EVENT_COUNT message events, in
+  get_events responses of a given batch size.  Events per second are
+  recorded in extra_info.
+- bench_send_messages: sending SEND_COUNT messages one at a time, and
+  with send_messages, to a server that takes SERVER_LATENCY per request.
+- bench_register: a register response for a large realm, with each
+  of zulip's JSON codecs.
+
+The server runs in the same process, so its share of each request's
+cost is included; it is the same from commit to commit, which is what
+makes the results comparable (see the README for saving and comparing
+runs).
+"""
+
+from typing import Any, Dict, Iterator
+
+import pytest
+from bench_json import CODECS, USER_COUNT, codec_id, make_message, make_stream, make_user
+
+import zulip
+from zulip.testing import FakeServer
+
+EVENT_COUNT = 2000
+SEND_COUNT = 50
+SERVER_LATENCY = 0.002
+
+
+@pytest.fixture(scope="module")
+def server() -> Iterator[FakeServer]:
+    with FakeServer() as server:
+        yield server
+
+
+@pytest.fixture
+def client(server: FakeServer) -> zulip.Client:
+    server.latency = 0.0
+    return server.make_client()
+
+
+class StopBenchmark(Exception):
+    pass
+
+
+def bench_session_request(benchmark: Any, server: FakeServer) -> None:
+    import requests
+
+    session = requests.Session()
+    session.auth = (server.email, server.api_key)
+    url = server.url + "/api/v1/users/me"
+    response = benchmark(session.get, url)
+    assert response.json()["result"] == "success"
+
+
+def bench_do_api_query(benchmark: Any, client: zulip.Client) -> None:
+    result = benchmark(client.do_api_query, {}, "/api/v1/users/me", method="GET")
+    assert result["result"] == "success"
+
+
+@pytest.mark.parametrize("message_count", [1, 100, 10000])
+def bench_call_endpoint(benchmark: Any, client: zulip.Client, message_count: int) -> None:
+    request = {"messages": list(range(message_count)), "op": "add", "flag": "read"}
+    # There are no such messages, which keeps the server's share small.
+    result = benchmark(client.call_endpoint, url="messages/flags", request=request)
+    assert result["msg"] == "Invalid message(s)"
+
+
+@pytest.mark.parametrize("batch_size", [1, 100, 1000])
+def bench_call_on_each_event(
+    benchmark: Any, server: FakeServer, client: zulip.Client, batch_size: int
+) -> None:
+    events = [
+        {"type": "message", "message": make_message(i), "flags": []} for i in range(EVENT_COUNT)
+    ]
+    queue_id = None
+
+    def push_batch(start: int) -> None:
+        for event in events[start : start + batch_size]:
+            server.push_event(event, queue_id)
+
+    def on_register(response: Dict[str, Any]) -> None:
+        nonlocal queue_id
+        queue_id = response["queue_id"]
+        push_batch(0)
+
+    def handle_events() -> int:
+        handled = 0
+
+        def callback(event: Dict[str, Any]) -> None:
+            nonlocal handled
+            handled += 1
+            if handled == EVENT_COUNT:
+                raise StopBenchmark()
+            if handled % batch_size == 0:
+                push_batch(handled)
+
+        try:
+            client.call_on_each_event(callback, ["message"], on_register=on_register)
+        except StopBenchmark:
+            pass
+        assert queue_id is not None
+        client.deregister(queue_id)
+        return handled
+
+    handled = benchmark.pedantic(handle_events, rounds=3)
+    assert handled == EVENT_COUNT
+    # There are no stats with --benchmark-disable.
+    if benchmark.enabled:
+        benchmark.extra_info["events_per_second"] = EVENT_COUNT / benchmark.stats.stats.mean
+
+
+@pytest.mark.parametrize("max_in_flight", [1, 8])
+def bench_send_messages(
+    benchmark: Any, server: FakeServer, client: zulip.Client, max_in_flight: int
+) -> None:
+    server.latency = SERVER_LATENCY
+    messages = [
+        {"type": "stream", "to": "bench", "topic": "sends", "content": f"message {i}"}
+        for i in range(SEND_COUNT)
+    ]
+    if max_in_flight == 1:
+        results = benchmark(lambda: [client.send_message(message) for message in messages])
+    else:
+        results = benchmark(client.send_messages, messages, max_in_flight=max_in_flight)
+    assert [result["result"] for result in results] == ["success"] * SEND_COUNT
+    del server.messages[:]
+
+
+@pytest.mark.parametrize("codec_class", CODECS, ids=codec_id)
+def bench_register(
+    benchmark: Any, server: FakeServer, client: zulip.Client, codec_class: Any
+) -> None:
+    streams = [make_stream(i) for i in range(1, 501)]
+    server.register_state = {
+        "realm_users": [make_user(i) for i in range(1, USER_COUNT + 1)],
+        "streams": streams,
+        "subscriptions": streams[:50],
+    }
+    zulip.set_json_codec(codec_class())
+    try:
+        result = benchmark(client.register, ["message"])
+    finally:
+        zulip.set_json_codec(None)
+        server.register_state = {}
+        server.queues.clear()
+    assert len(result["realm_users"]) == USER_COUNT
@@ -0,0 +1,152 @@
+"""
+JSON decoding of large API responses, and encoding of request
+parameters, with each of zulip's JSON codecs (see zulip.get_json_codec).
+
+The payloads are shaped like real responses: a register response for
+a realm of USER_COUNT users and STREAM_COUNT streams, and a
+get_messages page of MESSAGE_COUNT messages.  Their sizes are recorded
+in each benchmark's extra_info.
+"""
+
+import json
+from typing import Any, Dict
+
+import pytest
+
+import zulip
+
+USER_COUNT = 5000
+STREAM_COUNT = 500
+MESSAGE_COUNT = 1000
+
+CODECS = [zulip.JSONCodec]
+try:
+    import orjson  # noqa: F401
+
+    CODECS.append(zulip.OrjsonCodec)
+except ImportError:
+    pass
+
+
+def make_user(user_id: int) -> Dict[str, Any]:
+    return {
+        "user_id": user_id,
+        "email": f"user{user_id}@example.com",
+        "delivery_email": None,
+        "full_name": f"User Number {user_id}",
+        "date_joined": "2023-01-01T00:00:00.000000+00:00",
+        "timezone": "Europe/Berlin",
+        "avatar_url": f"https://secure.gravatar.com/avatar/{user_id:032x}?d=identicon&version=1",
+        "avatar_version": 1,
+        "is_active": True,
+        "is_admin": False,
+        "is_owner": False,
+        "is_guest": False,
+        "is_billing_admin": False,
+        "is_bot": False,
+        "role": 400,
+        "profile_data": {"1": {"value": "Engineering", "rendered_value": None}},
+    }
+
+
+def make_stream(stream_id: int) -> Dict[str, Any]:
+    return {
+        "stream_id": stream_id,
+        "name": f"stream {stream_id}",
+        "description": "A stream about things " * 3,
+        "rendered_description": "<p>" + "A stream about things " * 3 + "</p>",
+        "date_created": 1672531200,
+        "invite_only": False,
+        "is_web_public": False,
+        "stream_post_policy": 1,
+        "history_public_to_subscribers": True,
+        "first_message_id": 1000 + stream_id,
+        "message_retention_days": None,
+        "is_announcement_only": False,
+        "can_remove_subscribers_group": 12,
+        "subscribers": list(range(1, USER_COUNT, 17)),
+    }
+
+
+def make_message(message_id: int) -> Dict[str, Any]:
+    return {
+        "id": message_id,
+        "sender_id": message_id % USER_COUNT,
+        "sender_email": f"user{message_id % USER_COUNT}@example.com",
+        "sender_full_name": f"User Number {message_id % USER_COUNT}",
+        "sender_realm_str": "zulip",
+        "avatar_url": None,
+        "client": "website",
+        "content": "<p>" + "Some typical message content, with unicode é☃. " * 8 + "</p>",
+        "content_type": "text/html",
+        "is_me_message": False,
+        "reactions": [{"emoji_name": "+1", "emoji_code": "1f44d", "user_id": 9}],
+        "recipient_id": 20,
+        "submessages": [],
+        "timestamp": 1672531200 + message_id,
+        "topic_links": [],
+        "type": "stream",
+        "stream_id": 3,
+        "display_recipient": "general",
+        "subject": f"topic {message_id % 50}",
+        "flags": ["read"],
+    }
+
+
+def make_register_response() -> bytes:
+    users = [make_user(i) for i in range(1, USER_COUNT + 1)]
+    streams = [make_stream(i) for i in range(1, STREAM_COUNT + 1)]
+    response = {
+        "result": "success",
+        "msg": "",
+        "queue_id": "1:1",
+        "last_event_id": -1,
+        "realm_users": users,
+        "streams": streams,
+        "subscriptions": streams[:50],
+    }
+    return json.dumps(response).encode()
+
+
+def make_messages_response() -> bytes:
+    messages = [make_message(i) for i in range(10000, 10000 + MESSAGE_COUNT)]
+    response = {"result": "success", "msg": "", "found_newest": True, "messages": messages}
+    return json.dumps(response).encode()
+
+
+def codec_id(codec_class: Any) -> str:
+    return codec_class.name
+
+
+@pytest.mark.parametrize("codec_class", CODECS, ids=codec_id)
+def bench_decode_register(benchmark: Any, codec_class: Any) -> None:
+    payload = make_register_response()
+    benchmark.extra_info["response_bytes"] = len(payload)
+    result = benchmark(codec_class().loads, payload)
+    assert len(result["realm_users"]) == USER_COUNT
+
+
+@pytest.mark.parametrize("codec_class", CODECS, ids=codec_id)
+def bench_decode_messages(benchmark: Any, codec_class: Any) -> None:
+    payload = make_messages_response()
+    benchmark.extra_info["response_bytes"] = len(payload)
+    result = benchmark(codec_class().loads, payload)
+    assert len(result["messages"]) == MESSAGE_COUNT
+
+
+@pytest.mark.parametrize("codec_class", CODECS, ids=codec_id)
+def bench_marshal_request(benchmark: Any, codec_class: Any) -> None:
+    # E.g. a bulk update_message_flags, or a register with a narrow.
+    request: Dict[str, Any] = {
+        "messages": list(range(100000, 105000)),
+        "op": "add",
+        "flag": "read",
+        "narrow": [["stream", "general"], ["topic", "topic 1"]],
+        "event_types": ["message", "update_message", "reaction"],
+    }
+    zulip.set_json_codec(codec_class())
+    try:
+        marshalled = benchmark(zulip.marshal_request, request)
+    finally:
+        zulip.set_json_codec(None)
+    assert json.loads(marshalled["messages"]) == request["messages"]
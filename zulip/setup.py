@@ -69,5 +69,9 @@ setup(
         "click",
         "typing_extensions>=3.7",
     ],
+    extras_require={
+        "async": ["aiohttp>=3.7"],
+        "orjson": ["orjson>=3.0"],
+    },
     packages=find_packages(exclude=["tests"]),
 )
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+from typing import Any, Dict, Iterator, List, Optional, Union
+from unittest import TestCase
+from unittest.mock import patch
+
+import zulip
+from zulip.archive import MessageArchive
+from zulip.testing import FakeServer
+
+
+def stream_message(message_id: int, topic: str = "lunch", stream_id: int = 1) -> Dict[str, Any]:
+    return {
+        "id": message_id,
+        "type": "stream",
+        "stream_id": stream_id,
+        "display_recipient": f"stream {stream_id}",
+        "subject": topic,
+        "sender_id": 10 + message_id % 2,
+        "timestamp": 1600000000 + message_id,
+        "content": f"message {message_id}",
+        "flags": [],
+    }
+
+
+class TestMessageArchive(TestCase):
+    def setUp(self) -> None:
+        self.client = zulip.Client(
+            email="bot@example.com", api_key="key", site="https://chat.example.com"
+        )
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, "archive.sqlite3")
+        self.archive = self.open_archive()
+        self.server_messages = [stream_message(i) for i in range(1, 8)]
+
+    def open_archive(self, narrow: Optional[List[List[str]]] = None) -> MessageArchive:
+        archive = MessageArchive(self.client, self.path, narrow)
+        self.addCleanup(archive.close)
+        return archive
+
+    def fake_iter_messages(
+        self, narrow: List[List[str]], anchor: Union[int, str], **kwargs: Any
+    ) -> Iterator[Dict[str, Any]]:
+        self.assertEqual(kwargs["direction"], "newer")
+        for message in self.server_messages:
+            if anchor == "oldest" or message["id"] >= anchor:
+                yield message
+
+    def sync(self, archive: MessageArchive, **kwargs: Any) -> int:
+        with patch.object(self.client, "iter_messages", side_effect=self.fake_iter_messages):
+            return archive.sync(**kwargs)
+
+    def archived(self, column: str = "id") -> List[Any]:
+        query = f"SELECT {column} FROM messages ORDER BY id"
+        return [row[0] for row in self.archive.connection.execute(query)]
+
+    def test_sync_is_incremental(self) -> None:
+        self.assertEqual(self.sync(self.archive, batch_size=3), 7)
+        self.assertEqual(self.archived(), list(range(1, 8)))
+        self.assertEqual(self.archive.newest_message_id(), 7)
+
+        self.server_messages.append(stream_message(9))
+        self.assertEqual(self.sync(self.archive), 1)
+        self.assertEqual(self.archived(), [1, 2, 3, 4, 5, 6, 7, 9])
+
+    def test_interrupted_sync_resumes(self) -> None:
+        def fail_after_five(*args: Any, **kwargs: Any) -> Iterator[Dict[str, Any]]:
+            for message in self.server_messages[:5]:
+                yield message
+            raise zulip.ZulipError("connection lost")
+
+        with patch.object(self.client, "iter_messages", side_effect=fail_after_five):
+            with self.assertRaises(zulip.ZulipError):
+                self.archive.sync(batch_size=2)
+        # The completed batches were committed.
+        self.assertEqual(self.open_archive().newest_message_id(), 4)
+        self.assertEqual(self.sync(self.open_archive()), 3)
+        self.assertEqual(self.archived(), list(range(1, 8)))
+
+    def test_narrows_have_separate_cursors(self) -> None:
+        self.sync(self.archive)
+        other = self.open_archive([["stream", "stream 2"]])
+        self.assertIsNone(other.newest_message_id())
+
+    def test_message_events(self) -> None:
+        self.sync(self.archive)
+        self.archive.apply_event(
+            {"type": "message", "message": stream_message(8), "flags": ["mentioned"]}
+        )
+        self.assertEqual(self.archive.newest_message_id(), 8)
+        self.assertIn('"mentioned"', self.archived("message")[-1])
+
+        self.archive.apply_event(
+            {"type": "update_message", "message_id": 2, "content": "edited", "edit_timestamp": 5}
+        )
+        self.archive.apply_event({"type": "delete_message", "message_ids": [3, 4]})
+        self.archive.apply_event({"type": "delete_message", "message_id": 5})
+        self.assertEqual(self.archived(), [1, 2, 6, 7, 8])
+        self.assertEqual(self.archived("content")[:2], ["message 1", "edited"])
+
+    def test_topic_and_stream_move(self) -> None:
+        self.server_messages.append(stream_message(8, stream_id=2))
+        self.sync(self.archive)
+        self.archive.apply_event(
+            {
+                "type": "update_message",
+                "message_id": 6,
+                "message_ids": [6, 7],
+                "subject": "dinner",
+                "new_stream_id": 2,
+            }
+        )
+        rows = self.archive.connection.execute(
+            "SELECT id, message FROM messages WHERE stream_id = 2 AND topic = 'DINNER' ORDER BY id"
+        ).fetchall()
+        self.assertEqual([row[0] for row in rows], [6, 7])
+        self.assertIn('"display_recipient": "stream 2"', rows[0][1])
+        self.assertEqual(self.archived("content")[5], "message 6")
+
+    def test_indexes(self) -> None:
+        indexes = {
+            row[0]
+            for row in self.archive.connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'messages'"
+            )
+        }
+        self.assertTrue(
+            {"messages_stream_topic", "messages_sender", "messages_timestamp"} <= indexes
+        )
+
+
+class StopFollowing(Exception):
+    pass
+
+
+class TestFollow(TestCase):
+    def test_messages_sent_while_registering_are_archived(self) -> None:
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        server = FakeServer()
+        server.start()
+        self.addCleanup(server.stop)
+        client = server.make_client()
+        archive = MessageArchive(client, os.path.join(tmpdir.name, "archive.sqlite3"))
+        self.addCleanup(archive.close)
+
+        def send(content: str) -> int:
+            return server.send_message({"type": "stream", "to": "devel", "content": content})
+
+        send("before")
+        register = client.register
+
+        def register_later(*args: Any, **kwargs: Any) -> Dict[str, Any]:
+            # After an initial sync would have run, before the queue exists.
+            send("while registering")
+            return register(*args, **kwargs)
+
+        def stop(response: Dict[str, Any]) -> None:
+            raise StopFollowing()
+
+        with patch.object(client, "register", side_effect=register_later):
+            with self.assertRaises(StopFollowing):
+                archive.follow(on_register=stop)
+        self.assertEqual(archive.newest_message_id(), 2)
+
+    def test_dispatch_options_are_rejected(self) -> None:
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        client = zulip.Client(
+            email="bot@example.com", api_key="key", site="https://chat.example.com"
+        )
+        archive = MessageArchive(client, os.path.join(tmpdir.name, "archive.sqlite3"))
+        self.addCleanup(archive.close)
+        options: List[Dict[str, Any]] = [{"dispatch_workers": 4}, {"compact_events": True}]
+        for kwargs in options:
+            with patch.object(client, "call_on_each_event") as call_on_each_event:
+                with self.assertRaisesRegex(TypeError, next(iter(kwargs))):
+                    archive.follow(**kwargs)
+            call_on_each_event.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
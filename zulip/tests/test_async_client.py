@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import threading
+import unittest
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+from unittest import TestCase
+from unittest.mock import patch
+
+import zulip
+
+try:
+    import aiohttp  # noqa: F401
+
+    have_aiohttp = True
+except ImportError:
+    have_aiohttp = False
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    requests: List[Tuple[str, str, Dict[str, Any]]] = []
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+    def respond(self, method: str) -> None:
+        parsed = urllib.parse.urlparse(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode() if length else parsed.query
+        params = dict(urllib.parse.parse_qsl(body or parsed.query))
+        self.requests.append((method, parsed.path, params))
+
+        result: Dict[str, Any]
+        if parsed.path == "/api/v1/server_settings":
+            result = {"result": "success", "msg": "", "zulip_version": "6.0"}
+            result["zulip_feature_level"] = 150
+        elif parsed.path == "/api/v1/get_stream_id":
+            result = {"result": "success", "msg": "", "stream_id": 7}
+        elif parsed.path == "/api/v1/streams/7/members":
+            result = {"result": "success", "msg": "", "subscribers": [1, 2]}
+        else:
+            result = {"result": "success", "msg": "", "id": len(self.requests)}
+
+        payload = json.dumps(result).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self) -> None:
+        self.respond("GET")
+
+    def do_POST(self) -> None:
+        self.respond("POST")
+
+    def do_PATCH(self) -> None:
+        self.respond("PATCH")
+
+
+@unittest.skipIf(not have_aiohttp, "aiohttp is not installed")
+class TestAsyncClient(TestCase):
+    def setUp(self) -> None:
+        StubHandler.requests = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.site = "http://127.0.0.1:%d" % (self.server.server_address[1],)
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_client(self) -> zulip.AsyncClient:
+        return zulip.AsyncClient(email="bot@example.com", api_key="key", site=self.site)
+
+    def test_concurrent_send_message(self) -> None:
+        async def run() -> List[Dict[str, Any]]:
+            async with self.make_client() as client:
+                return await asyncio.gather(
+                    *(
+                        client.send_message({"type": "private", "to": [9], "content": str(i)})
+                        for i in range(20)
+                    )
+                )
+
+        results = asyncio.run(run())
+        self.assertEqual([r["result"] for r in results], ["success"] * 20)
+        self.assertEqual(
+            sorted(int(params["content"]) for _, _, params in StubHandler.requests), list(range(20))
+        )
+        # No server settings handshake is needed to send messages.
+        self.assertNotIn("/api/v1/server_settings", [path for _, path, _ in StubHandler.requests])
+
+    def test_composite_endpoints(self) -> None:
+        async def run() -> Tuple[Dict[str, Any], Dict[str, Any], int]:
+            async with self.make_client() as client:
+                subscribers = await client.get_subscribers(stream="devel")
+                updated = await client.update_user_by_id(8, full_name="New Name")
+                return subscribers, updated, client.feature_level
+
+        subscribers, updated, feature_level = asyncio.run(run())
+        self.assertEqual(subscribers["subscribers"], [1, 2])
+        self.assertEqual(updated["result"], "success")
+        self.assertEqual(feature_level, 150)
+        self.assertEqual(
+            [(method, path) for method, path, _ in StubHandler.requests],
+            [
+                ("GET", "/api/v1/get_stream_id"),
+                ("GET", "/api/v1/streams/7/members"),
+                ("GET", "/api/v1/server_settings"),
+                ("PATCH", "/api/v1/users/8"),
+            ],
+        )
+
+
+class TestAsyncCallOnEachEvent(TestCase):
+    def test_rejects_sync_only_options(self) -> None:
+        client = zulip.AsyncClient(
+            email="bot@example.com", api_key="key", site="https://chat.example.com"
+        )
+        all_options: List[Dict[str, Any]] = [
+            {"dispatch_workers": 4},
+            {"resume_missed_messages": True},
+        ]
+        for options in all_options:
+            [option] = options
+            with self.subTest(option=option), patch.object(client, "register") as register:
+                with self.assertRaisesRegex(TypeError, option):
+                    asyncio.run(client.call_on_each_event(print, **options))
+                register.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import unittest
+from typing import Any, List
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import zulip
+
+
+class TestRandomExponentialBackoff(TestCase):
+    def delays(self, backoff: zulip.RandomExponentialBackoff, count: int) -> List[float]:
+        with patch("logging.Logger.warning"):
+            return [backoff.fail_without_sleeping() for _ in range(count)]
+
+    def test_delays_grow_up_to_the_cap(self) -> None:
+        delays = self.delays(zulip.RandomExponentialBackoff(delay_cap=15), 10)
+        self.assertTrue(1 <= delays[0] <= 2)
+        self.assertTrue(6 <= delays[6] <= 12)
+        self.assertEqual(delays[-1], 15)
+
+    def test_clients_failing_together_spread_out(self) -> None:
+        first_delays = {self.delays(zulip.RandomExponentialBackoff(), 1)[0] for _ in range(50)}
+        self.assertGreater(len(first_delays), 40)
+
+    def test_time_limit(self) -> None:
+        with patch("time.monotonic", return_value=1000.0):
+            backoff = zulip.RandomExponentialBackoff(time_limit=5)
+        with patch("time.monotonic", return_value=1004.0):
+            self.assertTrue(backoff.keep_going())
+            self.assertLessEqual(self.delays(backoff, 3), [1.0, 1.0, 1.0])
+        with patch("time.monotonic", return_value=1005.0):
+            self.assertFalse(backoff.keep_going())
+
+
+class TestRequestRetries(TestCase):
+    def make_client(self, **kwargs: Any) -> zulip.Client:
+        client = zulip.Client(
+            email="bot@example.com", api_key="key", site="https://chat.example.com", **kwargs
+        )
+        client.ensure_session()
+        client.has_connected = True
+        return client
+
+    def server_error(self) -> MagicMock:
+        return MagicMock(status_code=502, headers={}, content=b"Bad gateway")
+
+    def test_server_errors_are_retried_with_backoff(self) -> None:
+        client = self.make_client(max_retries=3)
+        with patch.object(
+            client.session, "request", return_value=self.server_error()
+        ) as request, patch("time.sleep") as sleep, patch("logging.Logger.warning"):
+            result = client.get_profile()
+        self.assertEqual(result["result"], "http-error")
+        self.assertEqual(request.call_count, 4)
+        self.assertEqual(sleep.call_count, 3)
+
+    def test_retries_are_only_logged_as_warnings_when_verbose(self) -> None:
+        for verbose, level in [(False, "DEBUG"), (True, "WARNING")]:
+            client = self.make_client(max_retries=1, verbose=verbose)
+            with patch.object(client.session, "request", return_value=self.server_error()), patch(
+                "time.sleep"
+            ), patch("sys.stdout"), self.assertLogs("zulip", "DEBUG") as logs:
+                client.get_profile()
+            self.assertEqual([record.levelname for record in logs.records], [level])
+
+    def test_retries_stop_at_the_time_limit(self) -> None:
+        client = self.make_client(retry_time_limit=2.5)
+        clock = [1000.0]
+
+        def sleep(seconds: float) -> None:
+            clock[0] += seconds
+
+        with patch.object(
+            client.session, "request", return_value=self.server_error()
+        ) as request, patch("time.sleep", side_effect=sleep), patch(
+            "time.monotonic", side_effect=lambda: clock[0]
+        ), patch(
+            "logging.Logger.warning"
+        ):
+            client.get_profile()
+        self.assertEqual(clock[0], 1002.5)
+        self.assertLess(request.call_count, 10)
+        for _, kwargs in request.call_args_list:
+            self.assertLessEqual(kwargs["timeout"], 2.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import asyncio
+import unittest
+from typing import Any, Dict, Iterator, List
+from unittest import TestCase
+from unittest.mock import patch
+
+import zulip
+
+
+def update_message_flags(request: Dict[str, Any]) -> Dict[str, Any]:
+    if 1500 in request["messages"]:
+        return {"result": "error", "msg": "Invalid message(s)"}
+    # Say every other message already had the flag.
+    return {"result": "success", "msg": "", "messages": request["messages"][::2]}
+
+
+class TestBulkFlagUpdates(TestCase):
+    def setUp(self) -> None:
+        self.client = zulip.Client(
+            email="bot@example.com", api_key="key", site="https://chat.example.com"
+        )
+
+    def test_by_message_ids(self) -> None:
+        progress: List[int] = []
+        with patch.object(
+            self.client, "update_message_flags", side_effect=update_message_flags
+        ) as update:
+            result = self.client.update_message_flags_in_bulk(
+                "add",
+                "starred",
+                messages=iter(range(1, 3501)),
+                batch_size=1000,
+                max_in_flight=2,
+                progress=progress.append,
+            )
+        self.assertEqual(update.call_count, 4)
+        self.assertEqual(
+            sorted(len(call[0][0]["messages"]) for call in update.call_args_list),
+            [500, 1000, 1000, 1000],
+        )
+        self.assertEqual(update.call_args[0][0]["flag"], "starred")
+        self.assertEqual(result["result"], "error")
+        self.assertEqual(result["msg"], "Invalid message(s)")
+        self.assertEqual(result["processed_count"], 2500)
+        self.assertEqual(result["updated_count"], 1250)
+        self.assertEqual(result["failed_messages"], list(range(1001, 2001)))
+        self.assertEqual(len(progress), 4)
+        self.assertEqual(progress[-1], 2500)
+
+    def test_narrow_on_current_server(self) -> None:
+        self.client._server_settings = {"zulip_feature_level": 155}
+        responses = [
+            {
+                "result": "success",
+                "msg": "",
+                "processed_count": 1000,
+                "updated_count": 900,
+                "first_processed_id": 1,
+                "last_processed_id": 1000,
+                "found_oldest": True,
+                "found_newest": False,
+            },
+            {
+                "result": "success",
+                "msg": "",
+                "processed_count": 20,
+                "updated_count": 20,
+                "first_processed_id": 1001,
+                "last_processed_id": 1020,
+                "found_oldest": False,
+                "found_newest": True,
+            },
+        ]
+        with patch.object(self.client, "call_endpoint", side_effect=responses) as call_endpoint:
+            result = self.client.mark_narrow_as_read([["stream", "logs"]])
+        self.assertEqual(
+            [call[1]["request"]["anchor"] for call in call_endpoint.call_args_list],
+            ["oldest", 1000],
+        )
+        self.assertEqual(
+            call_endpoint.call_args_list[1][1],
+            {
+                "url": "messages/flags/narrow",
+                "request": {
+                    "op": "add",
+                    "flag": "read",
+                    "narrow": [["stream", "logs"]],
+                    "anchor": 1000,
+                    "include_anchor": False,
+                    "num_before": 0,
+                    "num_after": 1000,
+                },
+            },
+        )
+        self.assertEqual(
+            result,
+            {
+                "result": "success",
+                "msg": "",
+                "processed_count": 1020,
+                "updated_count": 920,
+                "failed_messages": [],
+            },
+        )
+
+    def test_narrow_on_old_server(self) -> None:
+        self.client._server_settings = {"zulip_feature_level": 100}
+
+        def iter_messages(*args: Any, **kwargs: Any) -> Iterator[Dict[str, Any]]:
+            self.assertEqual(args[0], [["is", "unread"]])
+            self.assertEqual((kwargs["anchor"], kwargs["direction"]), ("oldest", "newer"))
+            for message_id in range(1, 6):
+                yield {"id": message_id}
+
+        with patch.object(self.client, "iter_messages", side_effect=iter_messages), patch.object(
+            self.client, "update_message_flags", side_effect=update_message_flags
+        ) as update:
+            result = self.client.mark_narrow_as_read([["is", "unread"]], batch_size=2)
+        self.assertEqual(
+            sorted(call[0][0]["messages"] for call in update.call_args_list), [[1, 2], [3, 4], [5]]
+        )
+        self.assertEqual((result["result"], result["processed_count"]), ("success", 5))
+
+    def test_messages_or_narrow(self) -> None:
+        with self.assertRaises(TypeError):
+            self.client.update_message_flags_in_bulk("add", "read")
+
+
+class TestAsyncBulkFlagUpdates(TestCase):
+    def test_by_message_ids(self) -> None:
+        client = zulip.AsyncClient(
+            email="bot@example.com", api_key="key", site="https://chat.example.com"
+        )
+
+        async def call_endpoint(url: str, request: Dict[str, Any]) -> Dict[str, Any]:
+            self.assertEqual(url, "messages/flags")
+            return update_message_flags(request)
+
+        async def run() -> Dict[str, Any]:
+            with patch.object(client, "call_endpoint", side_effect=call_endpoint):
+                return await client.update_message_flags_in_bulk(
+                    "remove", "read", messages=range(1, 1201), batch_size=500
+                )
+
+        result = asyncio.run(run())
+        self.assertEqual(result["result"], "success")
+        self.assertEqual((result["processed_count"], result["updated_count"]), (1200, 600))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from typing import Any, Dict, List, Type
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import zulip
+
+
+class StopPolling(BaseException):
+    pass
+
+
+def stream_message_event(event_id: int, topic: str) -> Dict[str, Any]:
+    return {
+        "id": event_id,
+        "type": "message",
+        "flags": [],
+        "message": {"id": 100 + event_id, "type": "stream", "stream_id": 1, "subject": topic},
+    }
+
+
+class CallOnEachEventTestCase(TestCase):
+    def setUp(self) -> None:
+        self.client = zulip.Client(
+            email="bot@example.com", api_key="key", site="https://chat.example.com"
+        )
+
+    def run_event_loop(
+        self,
+        batches: List[List[Dict[str, Any]]],
+        expected_exception: Type[BaseException] = StopPolling,
+        **kwargs: Any,
+    ) -> None:
+        """Runs call_on_each_event over `batches` of events, then stops it."""
+        responses: List[Any] = [{"result": "success", "events": batch} for batch in batches]
+        responses.append(StopPolling())
+        register_response = {"result": "success", "queue_id": "1:1", "last_event_id": -1}
+        with patch.object(self.client, "register", return_value=register_response):
+            with patch.object(self.client, "get_events", side_effect=responses):
+                with self.assertRaises(expected_exception):
+                    self.client.call_on_each_event(self.handle_event, **kwargs)
+
+    def handle_event(self, event: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+
+class TestConcurrentDispatch(CallOnEachEventTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.lock = threading.Lock()
+        self.handled: List[Dict[str, Any]] = []
+        self.running = 0
+        self.max_running = 0
+
+    def handle_event(self, event: Dict[str, Any]) -> None:
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.005)
+        with self.lock:
+            self.running -= 1
+            self.handled.append(event)
+
+    def test_per_topic_order_is_preserved(self) -> None:
+        topics = ["alpha", "beta", "gamma", "delta"]
+        batches = [
+            [stream_message_event(batch * 8 + i, topics[i % 4]) for i in range(8)]
+            for batch in range(3)
+        ]
+        self.run_event_loop(batches, dispatch_workers=4)
+
+        self.assertEqual(len(self.handled), 24)
+        self.assertGreater(self.max_running, 1)
+        for topic in topics:
+            ids = [e["id"] for e in self.handled if e["message"]["subject"] == topic]
+            self.assertEqual(ids, sorted(ids))
+
+    def test_edits_follow_their_message(self) -> None:
+        def handle_event(event: Dict[str, Any]) -> None:
+            if event["type"] == "message":
+                time.sleep(0.05)
+            with self.lock:
+                self.handled.append(event)
+
+        self.handle_event = handle_event  # type: ignore[method-assign] # Replace the handler for this test
+        # A content-only edit has no topic to derive a key from.
+        edit = {"id": 2, "type": "update_message", "stream_id": 1, "message_id": 101}
+        edit["message_ids"] = [101]
+        delete = {"id": 3, "type": "delete_message", "stream_id": 1, "message_ids": [101]}
+        batches = [[stream_message_event(1, "alpha")], [edit, delete]]
+        self.run_event_loop(batches, dispatch_workers=4)
+        self.assertEqual([e["id"] for e in self.handled], [1, 2, 3])
+
+    def test_pending_events_are_bounded(self) -> None:
+        batches = [[stream_message_event(i, f"topic {i}") for i in range(20)]]
+        self.run_event_loop(batches, dispatch_workers=8, max_pending_events=3)
+        self.assertEqual(len(self.handled), 20)
+        self.assertLessEqual(self.max_running, 3)
+
+    def test_callback_error_is_raised(self) -> None:
+        def fail(event: Dict[str, Any]) -> None:
+            raise ValueError("boom")
+
+        self.handle_event = fail  # type: ignore[method-assign] # Replace the handler for this test
+        batches = [[stream_message_event(1, "alpha")], [stream_message_event(2, "alpha")]]
+        with patch("logging.Logger.exception"):
+            self.run_event_loop(batches, ValueError, dispatch_workers=2)
+
+
+class TestResumeMissedMessages(CallOnEachEventTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.handled: List[Dict[str, Any]] = []
+
+    def handle_event(self, event: Dict[str, Any]) -> None:
+        self.handled.append(event)
+
+    def message_event(self, event_id: int, message_id: int) -> Dict[str, Any]:
+        return {"id": event_id, "type": "message", "flags": [], "message": {"id": message_id}}
+
+    def run_with_queue_expiry(self, **kwargs: Any) -> MagicMock:
+        registers = [
+            {"result": "success", "queue_id": "1:1", "last_event_id": -1, "max_message_id": 10},
+            {"result": "success", "queue_id": "1:2", "last_event_id": -1, "max_message_id": 14},
+        ]
+        events: List[Any] = [
+            {"result": "success", "events": [self.message_event(0, 11)]},
+            {"result": "error", "code": "BAD_EVENT_QUEUE_ID", "msg": "Bad event queue id: 1:1"},
+            # The new queue repeats 14, which was sent while registering.
+            {"result": "success", "events": [self.message_event(0, 14), self.message_event(1, 15)]},
+            StopPolling(),
+        ]
+        missed = {
+            "result": "success",
+            "found_newest": False,
+            "messages": [{"id": 12, "flags": ["read"]}, {"id": 13, "flags": []}, {"id": 14}],
+        }
+        with patch.object(self.client, "register", side_effect=registers), patch.object(
+            self.client, "get_events", side_effect=events
+        ), patch.object(self.client, "get_messages", return_value=missed) as get_messages:
+            with patch("time.sleep"), self.assertRaises(StopPolling):
+                self.client.call_on_each_event(self.handle_event, ["message"], **kwargs)
+        return get_messages
+
+    def test_missed_messages_are_backfilled(self) -> None:
+        get_messages = self.run_with_queue_expiry(resume_missed_messages=True)
+        get_messages.assert_called_once_with(
+            {
+                "anchor": 12,
+                "num_before": 0,
+                "num_after": 1000,
+                "narrow": [],
+                "apply_markdown": False,
+                "client_gravatar": False,
+            }
+        )
+        self.assertEqual([e["message"]["id"] for e in self.handled], [11, 12, 13, 14, 15])
+        self.assertEqual(self.handled[1]["flags"], ["read"])
+        self.assertNotIn("flags", self.handled[1]["message"])
+
+    def test_missed_messages_are_lost_by_default(self) -> None:
+        get_messages = self.run_with_queue_expiry()
+        get_messages.assert_not_called()
+        self.assertEqual([e["message"]["id"] for e in self.handled], [11, 14, 15])
+
+
+class TestCheckpoint(CallOnEachEventTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.handled: List[Dict[str, Any]] = []
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.checkpoint_file = os.path.join(tmpdir.name, "queue.json")
+
+    def handle_event(self, event: Dict[str, Any]) -> None:
+        self.handled.append(event)
+
+    def read_checkpoint(self) -> Dict[str, Any]:
+        with open(self.checkpoint_file) as f:
+            return json.load(f)
+
+    def test_checkpoint_is_saved_after_each_batch(self) -> None:
+        batches = [[stream_message_event(0, "a"), stream_message_event(1, "a")]]
+        self.run_event_loop(batches, checkpoint_file=self.checkpoint_file)
+        checkpoint = self.read_checkpoint()
+        self.assertEqual((checkpoint["queue_id"], checkpoint["last_event_id"]), ("1:1", 1))
+
+    def test_saved_queue_is_reused(self) -> None:
+        batches = [[stream_message_event(0, "a"), stream_message_event(1, "a")]]
+        self.run_event_loop(batches, checkpoint_file=self.checkpoint_file)
+
+        events = [{"result": "success", "events": [stream_message_event(2, "a")]}, StopPolling()]
+        with patch.object(self.client, "register") as register, patch.object(
+            self.client, "get_events", side_effect=events
+        ) as get_events:
+            with self.assertRaises(StopPolling):
+                self.client.call_on_each_event(
+                    self.handle_event, checkpoint_file=self.checkpoint_file
+                )
+        register.assert_not_called()
+        get_events.assert_any_call(queue_id="1:1", last_event_id=1)
+        self.assertEqual(self.read_checkpoint()["last_event_id"], 2)
+
+    def test_on_register_gets_a_new_queue(self) -> None:
+        self.run_event_loop([[stream_message_event(0, "a")]], checkpoint_file=self.checkpoint_file)
+
+        register_response = {"result": "success", "queue_id": "1:2", "last_event_id": -1}
+        on_register = MagicMock()
+        with patch.object(self.client, "register", return_value=register_response), patch.object(
+            self.client, "get_events", side_effect=StopPolling
+        ) as get_events:
+            with self.assertRaises(StopPolling):
+                self.client.call_on_each_event(
+                    self.handle_event,
+                    checkpoint_file=self.checkpoint_file,
+                    on_register=on_register,
+                )
+        on_register.assert_called_once_with(register_response)
+        get_events.assert_called_once_with(queue_id="1:2", last_event_id=-1)
+        self.assertEqual(self.read_checkpoint()["queue_id"], "1:2")
+
+    def test_rejected_queue_is_replaced(self) -> None:
+        self.run_event_loop([[stream_message_event(0, "a")]], checkpoint_file=self.checkpoint_file)
+
+        events = [
+            {"result": "error", "code": "BAD_EVENT_QUEUE_ID", "msg": "Bad event queue id: 1:1"},
+            StopPolling(),
+        ]
+        register_response = {"result": "success", "queue_id": "1:2", "last_event_id": -1}
+        with patch.object(self.client, "register", return_value=register_response), patch.object(
+            self.client, "get_events", side_effect=events
+        ) as get_events:
+            with patch("time.sleep"), self.assertRaises(StopPolling):
+                self.client.call_on_each_event(
+                    self.handle_event, checkpoint_file=self.checkpoint_file
+                )
+        self.assertEqual(get_events.call_args_list[-1][1], {"queue_id": "1:2", "last_event_id": -1})
+        self.assertEqual(self.read_checkpoint()["queue_id"], "1:2")
+
+    def test_checkpoint_for_other_events_is_ignored(self) -> None:
+        self.run_event_loop([[stream_message_event(0, "a")]], checkpoint_file=self.checkpoint_file)
+        with patch.object(self.client, "register", side_effect=StopPolling) as register:
+            with self.assertRaises(StopPolling):
+                self.client.call_on_each_event(
+                    self.handle_event, ["reaction"], checkpoint_file=self.checkpoint_file
+                )
+        register.assert_called_once()
+
+
+class TestEventDispatchKey(TestCase):
+    def test_keys(self) -> None:
+        self.assertEqual(
+            zulip.event_dispatch_key(stream_message_event(1, "Alpha")), ("stream", 1, "alpha")
+        )
+        private_message = {
+            "type": "message",
+            "message": {"type": "private", "display_recipient": [{"id": 9}, {"id": 3}]},
+        }
+        self.assertEqual(zulip.event_dispatch_key(private_message), ("private", (3, 9)))
+        edit = {"type": "update_message", "stream_id": 1, "orig_subject": "alpha", "subject": "b"}
+        self.assertEqual(zulip.event_dispatch_key(edit), ("stream", 1, "alpha"))
+        self.assertIsNone(zulip.event_dispatch_key({"type": "reaction", "message_id": 5}))
+
+
+if __name__ == "__main__":
+    unittest.main()
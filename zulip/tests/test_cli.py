@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from typing import Any, Dict, List
+from unittest import TestCase
+from unittest.mock import patch
+
+from click.testing import CliRunner
+
+import zulip
+from zulip.cli import cli
+from zulip.testing import FakeServer
+
+# The directory to import zulip from in a subprocess.
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(zulip.__file__)))
+
+
+def stream_message(i: int) -> Dict[str, Any]:
+    return {"type": "stream", "to": "builds", "topic": "ci", "content": f"Build {i} passed"}
+
+
+class TestSendBulk(TestCase):
+    def setUp(self) -> None:
+        self.server = FakeServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        patcher = patch("zulip.cli.get_client", return_value=self.server.make_client())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.checkpoint = os.path.join(self.tmpdir.name, "checkpoint.json")
+        self.failures = os.path.join(self.tmpdir.name, "failures.jsonl")
+
+    def send_bulk(self, lines: List[str], *args: str) -> int:
+        result = CliRunner().invoke(
+            cli,
+            ["send-bulk", "--checkpoint", self.checkpoint, "--failures", self.failures, *args],
+            input="".join(line + "\n" for line in lines),
+        )
+        if result.exception is not None and not isinstance(result.exception, SystemExit):
+            raise result.exception
+        return result.exit_code
+
+    def test_send_bulk(self) -> None:
+        lines = [json.dumps(stream_message(i)) for i in range(20)]
+        self.assertEqual(self.send_bulk(lines, "--workers", "4"), 0)
+        self.assertEqual(
+            sorted(m["content"] for m in self.server.messages),
+            sorted(f"Build {i} passed" for i in range(20)),
+        )
+        self.assertEqual(self.server.request_counts["POST messages"], 20)
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f), {"lines_done": 20, "also_done": []})
+        self.assertFalse(os.path.exists(self.failures))
+
+    def test_failures(self) -> None:
+        lines = [
+            json.dumps(stream_message(0)),
+            "{not json",
+            "",
+            json.dumps({"type": "private", "to": ["nobody@example.com"], "content": "hi"}),
+            json.dumps(stream_message(4)),
+        ]
+        self.assertEqual(self.send_bulk(lines), 1)
+        self.assertEqual(len(self.server.messages), 2)
+        with open(self.failures) as f:
+            failures = [json.loads(line) for line in f]
+        failures.sort(key=lambda failure: failure["line"])
+        self.assertEqual([failure["line"] for failure in failures], [2, 4])
+        self.assertEqual(failures[0]["message"], "{not json")
+        self.assertTrue(failures[0]["response"]["msg"].startswith("Invalid JSON"))
+        self.assertEqual(failures[1]["message"]["to"], ["nobody@example.com"])
+        self.assertEqual(failures[1]["response"]["msg"], "Invalid email 'nobody@example.com'")
+        # Failed messages aren't retried by a rerun.
+        self.assertEqual(self.send_bulk(lines), 0)
+        self.assertEqual(len(self.server.messages), 2)
+
+    def test_resume(self) -> None:
+        with open(self.checkpoint, "w") as f:
+            json.dump({"lines_done": 2, "also_done": [3]}, f)
+        lines = [json.dumps(stream_message(i)) for i in range(5)]
+        self.assertEqual(self.send_bulk(lines), 0)
+        self.assertEqual(
+            sorted(m["content"] for m in self.server.messages), ["Build 2 passed", "Build 4 passed"]
+        )
+
+
+class TestExport(TestCase):
+    def setUp(self) -> None:
+        self.server = FakeServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.server.add_user("iago@example.com", "Iago")
+        patcher = patch("zulip.cli.get_client", return_value=self.server.make_client())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.output = os.path.join(self.tmpdir.name, "devel.jsonl")
+        self.checkpoint = os.path.join(self.tmpdir.name, "checkpoint.json")
+        for i in range(25):
+            self.send(i)
+
+    def send(self, i: int) -> None:
+        stream = "devel" if i % 5 else "design"
+        message = {"type": "stream", "to": stream, "topic": "t", "content": f"**{i}**"}
+        self.server.send_message(message, sender="iago@example.com")
+
+    def export(self, *args: str) -> List[Dict[str, Any]]:
+        result = CliRunner().invoke(
+            cli,
+            [
+                "export",
+                "--narrow",
+                '[["stream", "devel"]]',
+                "--output",
+                self.output,
+                "--checkpoint",
+                self.checkpoint,
+                "--batch-size",
+                "4",
+                *args,
+            ],
+        )
+        if result.exception is not None:
+            raise result.exception
+        with open(self.output) as f:
+            return [json.loads(line) for line in f]
+
+    def test_export(self) -> None:
+        messages = self.export("--fields", "sender_email,content")
+        self.assertEqual(len(messages), 20)
+        self.assertEqual(messages[0], {"sender_email": "iago@example.com", "content": "**1**"})
+        self.assertEqual(messages[-1]["content"], "**24**")
+        self.assertEqual(self.server.request_counts["GET messages"], 5)
+
+    def test_resume(self) -> None:
+        self.export()
+        with open(self.checkpoint) as f:
+            checkpoint = json.load(f)
+        self.assertEqual((checkpoint["last_message_id"], checkpoint["exported"]), (25, 20))
+        # Output written after the last checkpoint is discarded.
+        with open(self.output, "a") as f:
+            f.write('{"id": 26, "content": "unsaved"}\n')
+        for i in range(25, 30):
+            self.send(i)
+        messages = self.export()
+        self.assertEqual([m["id"] for m in messages], [i for i in range(1, 31) if (i - 1) % 5])
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f)["exported"], 24)
+
+    def test_stdout_is_only_messages(self) -> None:
+        # In a process of its own, so that logging writes to the real
+        # stdout and stderr.
+        script = f"""
+import zulip
+import zulip.cli
+
+client = zulip.Client(
+    email={self.server.email!r},
+    api_key={self.server.api_key!r},
+    site={self.server.url!r},
+    retry_delay_cap=0.01,
+)
+zulip.cli.get_client = lambda: client
+zulip.cli.cli(["export", "--narrow", '[["stream", "devel"]]', "--batch-size", "4"])
+"""
+        self.server.fail_next(2, status=502, endpoint="GET messages")
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=self.tmpdir.name,
+            env=dict(os.environ, PYTHONPATH=PACKAGE_DIR),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            timeout=30,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(self.server.request_counts["GET messages"], 7)
+        messages = [json.loads(line) for line in result.stdout.splitlines()]
+        self.assertEqual(len(messages), 20)
+        self.assertIn("Exported 20 messages", result.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import copy
+import pickle
+import unittest
+from typing import Any, Dict, List
+from unittest import TestCase
+from unittest.mock import patch
+
+import zulip
+from zulip.events import Event, Message
+
+
+def message_event() -> Dict[str, Any]:
+    return {
+        "id": 3,
+        "type": "message",
+        "flags": ["mentioned"],
+        "message": {
+            "id": 42,
+            "type": "private",
+            "sender_email": "iago@example.com",
+            "content": "Hello ☃",
+            "display_recipient": [{"id": 9, "email": "bot@example.com"}],
+            "reactions": [],
+            "is_mirror_dummy": False,
+        },
+    }
+
+
+class TestCompactEvents(TestCase):
+    def test_dict_compatible(self) -> None:
+        event = Event(message_event())
+        self.assertEqual(event, message_event())
+        self.assertEqual(event.to_dict(), message_event())
+        self.assertEqual(len(event["message"]), 7)
+        self.assertEqual(event.message.display_recipient, [{"id": 9, "email": "bot@example.com"}])
+        self.assertEqual(event["message"].get("is_mirror_dummy"), False)
+        self.assertIsNone(event.get("op"))
+        with self.assertRaises(KeyError):
+            event["message"]["subject"]
+        with self.assertRaises(AttributeError):
+            event.message.subject
+
+        event["message"]["content"] = "edited"
+        event["message"]["full_content"] = "@**Bot** edited"
+        del event["message"]["reactions"]
+        self.assertEqual(event.message.content, "edited")
+        self.assertNotIn("reactions", event.message)
+        self.assertEqual(list(event.message)[-1], "full_content")
+
+    def test_heavy_fields_are_decoded_lazily(self) -> None:
+        message = Message(message_event()["message"])
+        self.assertIsNotNone(message._encoded)
+        self.assertEqual(message["sender_email"], "iago@example.com")
+        self.assertIsNotNone(message._encoded)
+        self.assertEqual(message["content"], "Hello ☃")
+        self.assertIsNone(message._encoded)
+
+    def test_no_instance_dict(self) -> None:
+        event = Event(message_event())
+        for obj in (event, event.message):
+            with self.assertRaises(AttributeError):
+                obj.__dict__
+
+    def test_repeated_strings_are_shared(self) -> None:
+        first = Message({"sender_email": "".join(["iago", "@example.com"])})
+        second = Message({"sender_email": "".join(["iago@", "example.com"])})
+        self.assertIs(first.sender_email, second.sender_email)
+
+    def test_copy_and_pickle(self) -> None:
+        event = Event(message_event())
+        self.assertEqual(copy.deepcopy(event), message_event())
+        self.assertEqual(pickle.loads(pickle.dumps(event)), message_event())
+
+
+class TestCallOnEachEventCompact(TestCase):
+    def test_compact_events(self) -> None:
+        client = zulip.Client(
+            email="bot@example.com", api_key="key", site="https://chat.example.com"
+        )
+        handled: List[Any] = []
+        register_response = {"result": "success", "queue_id": "1:1", "last_event_id": -1}
+        events = [{"result": "success", "events": [message_event()]}, KeyboardInterrupt()]
+        with patch.object(client, "register", return_value=register_response), patch.object(
+            client, "get_events", side_effect=events
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                client.call_on_each_message(handled.append, compact_events=True)
+        [message] = handled
+        self.assertIsInstance(message, Message)
+        self.assertEqual(message, message_event()["message"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import io
+import threading
+import time
+import unittest
+from typing import Any, Dict, List
+from unittest import TestCase
+
+import zulip
+from zulip.testing import FakeServer
+
+
+class TestFakeServer(TestCase):
+    def setUp(self) -> None:
+        self.server = FakeServer(heartbeat_interval=0.2)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.server.add_user("iago@example.com", "Iago")
+        self.client = self.server.make_client()
+
+    def test_profile_and_server_settings(self) -> None:
+        profile = self.client.get_profile()
+        self.assertEqual((profile["email"], profile["is_bot"]), ("bot@example.com", True))
+        self.assertEqual(self.client.feature_level, 185)
+
+        client = zulip.Client(email="bot@example.com", api_key="wrong", site=self.server.url)
+        result = client.get_profile()
+        self.assertEqual((result["result"], result["code"]), ("error", "UNAUTHORIZED"))
+
+    def test_send_and_get_messages(self) -> None:
+        for i in range(5):
+            self.client.send_message(
+                {"type": "stream", "to": "devel", "topic": "ci", "content": f"build {i}"}
+            )
+        self.client.send_message({"type": "private", "to": ["iago@example.com"], "content": "psst"})
+        result = self.client.get_messages(
+            {"anchor": 3, "num_before": 1, "num_after": 1, "narrow": [["stream", "devel"]]}
+        )
+        self.assertEqual([m["id"] for m in result["messages"]], [2, 3, 4])
+        self.assertEqual(result["messages"][0]["content"], "<p>build 1</p>")
+        self.assertEqual(
+            (result["found_anchor"], result["found_oldest"], result["found_newest"]),
+            (True, False, False),
+        )
+        messages = list(self.client.iter_messages([["is", "dm"]], apply_markdown=False))
+        self.assertEqual([m["content"] for m in messages], ["psst"])
+        self.assertEqual(
+            [r["email"] for r in messages[0]["display_recipient"]],
+            ["bot@example.com", "iago@example.com"],
+        )
+
+        result = self.client.send_message({"type": "stream", "to": "devel", "content": " "})
+        self.assertEqual(result["msg"], "Message must not be empty")
+
+    def test_events(self) -> None:
+        queue = self.client.register(["message"], narrow=[["stream", "devel"]])
+        self.server.send_message(
+            {"type": "stream", "to": "design", "topic": "x", "content": "elsewhere"},
+            sender="iago@example.com",
+        )
+        received: List[Dict[str, Any]] = []
+
+        def poll() -> None:
+            received.extend(
+                self.client.get_events(queue_id=queue["queue_id"], last_event_id=-1)["events"]
+            )
+
+        poller = threading.Thread(target=poll)
+        poller.start()
+        time.sleep(0.05)
+        self.server.send_message(
+            {"type": "stream", "to": "devel", "topic": "x", "content": "@**Test Bot** hi"},
+            sender="iago@example.com",
+        )
+        poller.join()
+        [event] = received
+        self.assertEqual(event["message"]["sender_email"], "iago@example.com")
+        self.assertEqual(event["flags"], ["mentioned"])
+
+        # With nothing to send, the server sends a heartbeat.
+        events = self.client.get_events(queue_id=queue["queue_id"], last_event_id=event["id"])
+        self.assertEqual([e["type"] for e in events["events"]], ["heartbeat"])
+
+        self.client.deregister(queue["queue_id"])
+        result = self.client.get_events(queue_id=queue["queue_id"], last_event_id=-1)
+        self.assertEqual(result["code"], "BAD_EVENT_QUEUE_ID")
+
+    def test_edit_delete_and_flags(self) -> None:
+        queue = self.client.register(["update_message", "delete_message"])
+        message_id = self.server.send_message(
+            {"type": "stream", "to": "devel", "topic": "x", "content": "hi"}
+        )
+        self.client.update_message({"message_id": message_id, "topic": "y", "content": "hey"})
+        self.client.delete_message(message_id)
+        events = self.client.get_events(queue_id=queue["queue_id"], last_event_id=-1)["events"]
+        self.assertEqual([e["type"] for e in events], ["update_message", "delete_message"])
+        self.assertEqual((events[0]["orig_subject"], events[0]["subject"]), ("x", "y"))
+        self.assertEqual(self.server.messages, [])
+
+        for i in range(25):
+            self.server.send_message(
+                {"type": "stream", "to": "devel", "topic": "x", "content": str(i)},
+                sender="iago@example.com",
+            )
+        result = self.client.mark_narrow_as_read([["stream", "devel"]], batch_size=10)
+        self.assertEqual((result["processed_count"], result["updated_count"]), (25, 25))
+        self.assertEqual(self.server.request_counts["POST messages/flags/narrow"], 3)
+        self.assertEqual(
+            self.client.get_messages(
+                {
+                    "anchor": "first_unread",
+                    "num_before": 0,
+                    "num_after": 1,
+                    "narrow": [["is", "unread"]],
+                }
+            )["messages"],
+            [],
+        )
+
+    def test_uploads_and_storage(self) -> None:
+        upload = io.BytesIO(b"\x89PNG")
+        upload.name = "chart.png"
+        result = self.client.upload_file(upload)
+        self.assertEqual(self.server.uploads[result["uri"]], b"\x89PNG")
+
+        self.client.update_storage({"storage": {"count": "1", "name": "x"}})
+        self.assertEqual(self.client.get_storage({"keys": ["count"]})["storage"], {"count": "1"})
+        self.client.call_endpoint("bot_storage", method="DELETE", request={"keys": ["count"]})
+        self.assertEqual(self.client.get_storage()["storage"], {"name": "x"})
+        result = self.client.get_storage({"keys": ["count"]})
+        self.assertEqual(result["msg"], "Key does not exist: count")
+
+    def test_fault_injection(self) -> None:
+        client = self.server.make_client(retry_on_errors=False)
+        self.server.fail_next(1, status=400, endpoint="POST messages")
+        self.assertEqual(client.get_profile()["result"], "success")
+        result = client.send_message({"type": "stream", "to": "devel", "content": "hi"})
+        self.assertEqual(result["msg"], "Injected failure")
+        self.assertEqual(self.server.messages, [])
+
+        self.server.latency = lambda endpoint: 0.1 if endpoint == "GET users/me" else 0
+        start = time.monotonic()
+        client.get_profile()
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from typing import Any, Dict
+from unittest import TestCase
+
+import zulip
+
+# The directory to import zulip from in a subprocess.
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(zulip.__file__)))
+
+# Modules that `import zulip` must not pull in; they are only needed
+# once a client actually talks to the server (or parses arguments).
+LAZY_MODULES = [
+    "aiohttp",
+    "argparse",
+    "asyncio",
+    "concurrent.futures",
+    "configparser",
+    "distro",
+    "optparse",
+    "requests",
+]
+
+# Generous enough to pass on a cold, bytecode-less import on slow CI
+# machines; override with ZULIP_IMPORT_TIME_BUDGET_MS to tighten it.
+IMPORT_TIME_BUDGET_MS = float(os.environ.get("ZULIP_IMPORT_TIME_BUDGET_MS", 150))
+
+
+def run_python(*args: str, **kwargs: Any) -> "subprocess.CompletedProcess[str]":
+    # From a directory of its own, so that e.g. the repository root's
+    # zulip/ directory isn't imported as a namespace package instead.
+    with tempfile.TemporaryDirectory() as tmpdir:
+        return subprocess.run(
+            [sys.executable, *args],
+            cwd=tmpdir,
+            env=dict(os.environ, PYTHONPATH=PACKAGE_DIR),
+            universal_newlines=True,
+            check=True,
+            **kwargs,
+        )
+
+
+def import_times_us(module: str) -> Dict[str, int]:
+    """Returns the cumulative import time of each module, as reported by `-X importtime`."""
+    proc = run_python("-X", "importtime", "-c", f"import {module}", stderr=subprocess.PIPE)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative_us)
+    return times
+
+
+class TestImportTime(TestCase):
+    def test_heavy_modules_are_imported_lazily(self) -> None:
+        code = "import sys, zulip; print(zulip.Client.__name__, *sorted(sys.modules))"
+        output = run_python("-c", code, stdout=subprocess.PIPE).stdout.split()
+        # The real package was imported, not a namespace package.
+        self.assertEqual(output[0], "Client")
+        imported = set(output[1:])
+        self.assertEqual([module for module in LAZY_MODULES if module in imported], [])
+
+    def test_import_time_budget(self) -> None:
+        # Take the best of a few runs to smooth out scheduling noise.
+        best_ms = min(import_times_us("zulip")["zulip"] for _ in range(3)) / 1000
+        self.assertLess(
+            best_ms,
+            IMPORT_TIME_BUDGET_MS,
+            f"`import zulip` took {best_ms:.1f}ms; budget is {IMPORT_TIME_BUDGET_MS}ms",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
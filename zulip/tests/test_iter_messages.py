@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import asyncio
+import threading
+import unittest
+from typing import Any, Dict, List
+from unittest import TestCase
+from unittest.mock import patch
+
+import zulip
+
+MESSAGE_IDS = list(range(1, 26))
+
+
+def fake_get_messages(message_filters: Dict[str, Any]) -> Dict[str, Any]:
+    """Pages through MESSAGE_IDS the way the server does."""
+    anchor = message_filters["anchor"]
+    if anchor == "newest":
+        anchor = MESSAGE_IDS[-1]
+    elif anchor == "oldest":
+        anchor = MESSAGE_IDS[0]
+    before = [i for i in MESSAGE_IDS if i < anchor][-message_filters["num_before"] :]
+    if message_filters["num_before"] == 0:
+        before = []
+    after = [i for i in MESSAGE_IDS if i > anchor][: message_filters["num_after"]]
+    ids = before + [i for i in MESSAGE_IDS if i == anchor] + after
+    return {
+        "result": "success",
+        "msg": "",
+        "messages": [{"id": i} for i in ids],
+        "found_oldest": MESSAGE_IDS[0] in ids,
+        "found_newest": MESSAGE_IDS[-1] in ids,
+    }
+
+
+class TestIterMessages(TestCase):
+    def setUp(self) -> None:
+        self.client = zulip.Client(
+            email="bot@example.com", api_key="key", site="https://chat.example.com"
+        )
+
+    def test_older(self) -> None:
+        with patch.object(self.client, "get_messages", side_effect=fake_get_messages) as get:
+            ids = [m["id"] for m in self.client.iter_messages(batch_size=10)]
+        self.assertEqual(ids, MESSAGE_IDS[::-1])
+        self.assertEqual([call[0][0]["anchor"] for call in get.call_args_list], ["newest", 14, 3])
+        self.assertEqual(get.call_args_list[0][0][0]["num_before"], 10)
+
+    def test_newer_from_anchor(self) -> None:
+        with patch.object(self.client, "get_messages", side_effect=fake_get_messages) as get:
+            messages = self.client.iter_messages(
+                [["stream", "devel"]], anchor=5, batch_size=10, direction="newer", prefetch=False
+            )
+            self.assertEqual([m["id"] for m in messages], MESSAGE_IDS[4:])
+        self.assertEqual(
+            get.call_args_list[0][0][0],
+            {"anchor": 5, "num_before": 0, "num_after": 10, "narrow": [["stream", "devel"]]},
+        )
+        self.assertEqual(get.call_count, 2)
+
+    def test_next_page_is_prefetched(self) -> None:
+        fetched_second_page = threading.Event()
+
+        def get_messages(message_filters: Dict[str, Any]) -> Dict[str, Any]:
+            if message_filters["anchor"] != "oldest":
+                fetched_second_page.set()
+            return fake_get_messages(message_filters)
+
+        with patch.object(self.client, "get_messages", side_effect=get_messages):
+            messages = self.client.iter_messages(batch_size=20, direction="newer")
+            self.assertEqual(next(messages)["id"], 1)
+            # The second page is on its way before the first is consumed.
+            self.assertTrue(fetched_second_page.wait(5))
+            self.assertEqual(len(list(messages)), 24)
+
+    def test_errors_are_raised(self) -> None:
+        error = {"result": "error", "msg": "Invalid narrow", "code": "BAD_NARROW"}
+        with patch.object(self.client, "get_messages", return_value=error):
+            with self.assertRaisesRegex(zulip.ZulipError, "Invalid narrow"):
+                list(self.client.iter_messages([["bogus", "x"]]))
+
+
+class TestAsyncIterMessages(TestCase):
+    def test_async_iteration(self) -> None:
+        client = zulip.AsyncClient(
+            email="bot@example.com", api_key="key", site="https://chat.example.com"
+        )
+
+        async def get_messages(message_filters: Dict[str, Any]) -> Dict[str, Any]:
+            return fake_get_messages(message_filters)
+
+        async def collect() -> List[int]:
+            return [m["id"] async for m in client.iter_messages(batch_size=7)]
+
+        with patch.object(client, "get_messages", side_effect=get_messages):
+            self.assertEqual(asyncio.run(collect()), MESSAGE_IDS[::-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
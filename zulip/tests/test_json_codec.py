@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+import sys
+import unittest
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import zulip
+
+try:
+    import orjson  # noqa: F401
+
+    have_orjson = True
+except ImportError:
+    have_orjson = False
+
+
+class TestJSONCodec(TestCase):
+    def setUp(self) -> None:
+        self.addCleanup(zulip.set_json_codec, None)
+        zulip.set_json_codec(None)
+
+    def test_stdlib_fallback(self) -> None:
+        with patch.dict(sys.modules, {"orjson": None}):
+            codec = zulip.get_json_codec()
+        self.assertEqual(codec.name, "json")
+        self.assertEqual(codec.loads(codec.dumps({"a": [1, None]})), {"a": [1, None]})
+
+    @unittest.skipIf(not have_orjson, "orjson is not installed")
+    def test_orjson_is_preferred(self) -> None:
+        codec = zulip.get_json_codec()
+        self.assertEqual(codec.name, "orjson")
+        self.assertEqual(codec.loads(b'{"a": "\\u00e9"}'), {"a": "é"})
+        self.assertEqual(codec.loads(codec.dumps({"a": [1, True]})), {"a": [1, True]})
+        # What orjson can't encode or decode is left to json.
+        self.assertEqual(codec.dumps({1: 2**70}), '{"1": %d}' % (2**70,))
+        self.assertEqual(codec.loads(b'{"a": Infinity}'), {"a": float("inf")})
+        with self.assertRaises(ValueError):
+            codec.loads(b'{"a": ')
+
+    def test_client_uses_codec(self) -> None:
+        codec = MagicMock(wraps=zulip.JSONCodec())
+        zulip.set_json_codec(codec)
+        self.assertEqual(zulip.marshal_request({"to": [9], "type": "private"})["to"], "[9]")
+
+        client = zulip.Client(
+            email="bot@example.com", api_key="key", site="https://chat.example.com"
+        )
+        client.ensure_session()
+        assert client.session is not None
+        res = MagicMock(status_code=200, headers={}, content=b'{"result": "success", "msg": ""}')
+        with patch.object(client.session, "request", return_value=res):
+            self.assertEqual(client.get_profile()["result"], "success")
+        codec.loads.assert_called_once_with(res.content)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import unittest
+from typing import List
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import zulip
+from zulip.metrics import MetricsCollector
+
+
+def response(status_code: int, content: bytes) -> MagicMock:
+    return MagicMock(status_code=status_code, headers={}, content=content)
+
+
+class TestMetricsHook(TestCase):
+    def setUp(self) -> None:
+        self.recorded: List[zulip.RequestMetrics] = []
+        self.client = zulip.Client(
+            email="bot@example.com",
+            api_key="key",
+            site="https://chat.example.com",
+            metrics_hook=self.recorded.append,
+        )
+        self.client.ensure_session()
+        self.client.has_connected = True
+
+    def test_request_metrics(self) -> None:
+        responses = [response(502, b"Bad gateway"), response(200, b'{"result": "success"}')]
+        assert self.client.session is not None
+        with patch.object(self.client.session, "request", side_effect=responses), patch(
+            "time.sleep"
+        ), patch("logging.Logger.warning"):
+            self.client.update_message({"message_id": 42, "content": "edited"})
+
+        [metrics] = self.recorded
+        self.assertEqual(metrics.method, "PATCH")
+        self.assertEqual(metrics.endpoint, "messages/{id}")
+        self.assertEqual(metrics.status_code, 200)
+        self.assertEqual(metrics.retries, 1)
+        self.assertEqual(metrics.request_bytes, len("message_id=42&content=edited&dont_block=true"))
+        self.assertEqual(metrics.response_bytes, len(b'{"result": "success"}'))
+        self.assertFalse(metrics.longpolling)
+
+    def test_failed_requests_are_recorded(self) -> None:
+        assert self.client.session is not None
+        self.client.retry_on_errors = False
+        with patch.object(self.client.session, "request", side_effect=OSError("unreachable")):
+            with self.assertRaises(OSError):
+                self.client.get_stream_id("devel")
+        [metrics] = self.recorded
+        self.assertEqual((metrics.endpoint, metrics.status_code), ("get_stream_id", None))
+
+    def test_hook_errors_do_not_break_requests(self) -> None:
+        self.client.metrics_hook = MagicMock(side_effect=ValueError)
+        assert self.client.session is not None
+        with patch.object(
+            self.client.session,
+            "request",
+            return_value=response(200, b'{"result": "success", "msg": ""}'),
+        ):
+            with patch("logging.Logger.exception") as log_exception:
+                self.assertEqual(self.client.get_profile()["result"], "success")
+        log_exception.assert_called_once()
+
+
+class TestMetricsCollector(TestCase):
+    def test_prometheus_text(self) -> None:
+        collector = MetricsCollector(latency_buckets=[0.1, 1])
+        for duration, status in [(0.05, 200), (0.5, 200), (2.0, None)]:
+            collector(
+                zulip.RequestMetrics(
+                    method="GET",
+                    endpoint="users/{id}",
+                    status_code=status,
+                    duration=duration,
+                    retries=0 if status else 3,
+                    request_bytes=10,
+                    response_bytes=100 if status else 0,
+                    longpolling=False,
+                )
+            )
+        text = collector.prometheus_text()
+        labels = 'method="GET",endpoint="users/{id}"'
+        for line in [
+            "# TYPE zulip_client_requests_total counter",
+            f'zulip_client_requests_total{{{labels},status="200"}} 2',
+            f'zulip_client_requests_total{{{labels},status="none"}} 1',
+            "# TYPE zulip_client_request_duration_seconds histogram",
+            f'zulip_client_request_duration_seconds_bucket{{{labels},le="0.1"}} 1',
+            f'zulip_client_request_duration_seconds_bucket{{{labels},le="1.0"}} 2',
+            f'zulip_client_request_duration_seconds_bucket{{{labels},le="+Inf"}} 3',
+            f"zulip_client_request_duration_seconds_sum{{{labels}}} 2.55",
+            f"zulip_client_request_duration_seconds_count{{{labels}}} 3",
+            f"zulip_client_request_retries_total{{{labels}}} 3",
+            f"zulip_client_request_bytes_total{{{labels}}} 30",
+            f"zulip_client_response_bytes_total{{{labels}}} 200",
+        ]:
+            self.assertIn(line + "\n", text)
+
+
+class TestEndpointLabel(TestCase):
+    def test_ids_and_query_strings_are_removed(self) -> None:
+        self.assertEqual(
+            zulip._endpoint_pattern("v1/messages/12/reactions"), "messages/{id}/reactions"
+        )
+        self.assertEqual(zulip._endpoint_pattern("v1/get_stream_id?stream=devel"), "get_stream_id")
+
+    def test_emails_and_emoji_names_are_removed(self) -> None:
+        for url, pattern in [
+            ("v1/users/iago@zulip.com/presence", "users/{email}/presence"),
+            ("v1/users/iago%40zulip.com", "users/{email}"),
+            ("v1/realm/emoji/party_parrot", "realm/emoji/{emoji_name}"),
+            ("v1/realm/emoji", "realm/emoji"),
+            ("v1/users/me/alert_words", "users/me/alert_words"),
+        ]:
+            self.assertEqual(zulip._endpoint_pattern(url), pattern)
+
+
+if __name__ == "__main__":
+    unittest.main()
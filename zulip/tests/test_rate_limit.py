@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import unittest
+from typing import Any, Dict, List
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import zulip
+from zulip.testing import FakeServer
+
+try:
+    import aiohttp  # noqa: F401
+
+    have_aiohttp = True
+except ImportError:
+    have_aiohttp = False
+
+
+def response(status_code: int, json_result: Dict[str, Any], **headers: str) -> MagicMock:
+    return MagicMock(
+        status_code=status_code, headers=headers, content=json.dumps(json_result).encode()
+    )
+
+
+def rate_limit_headers(remaining: int, reset: float) -> Dict[str, str]:
+    return {
+        "X-RateLimit-Limit": "3",
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Reset": str(reset),
+    }
+
+
+class TestRateLimit(TestCase):
+    def setUp(self) -> None:
+        self.client = zulip.Client(
+            email="bot@example.com", api_key="key", site="https://chat.example.com"
+        )
+        self.client.ensure_session()
+        self.now = 1000.0
+        self.sleeps: List[float] = []
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def run_requests(self, responses: List[MagicMock], count: int) -> List[Dict[str, Any]]:
+        assert self.client.session is not None
+        with patch.object(self.client.session, "request", side_effect=responses), patch(
+            "time.time", side_effect=lambda: self.now
+        ), patch("time.sleep", side_effect=self.sleep):
+            return [self.client.get_profile() for _ in range(count)]
+
+    def test_requests_are_paced_once_the_limit_is_used_up(self) -> None:
+        success = {"result": "success", "msg": ""}
+        responses = [
+            response(200, success, **rate_limit_headers(1, reset=1010)),
+            response(200, success, **rate_limit_headers(0, reset=1010)),
+            response(200, success, **rate_limit_headers(2, reset=1020)),
+        ]
+        results = self.run_requests(responses, 3)
+        self.assertEqual([r["result"] for r in results], ["success"] * 3)
+        # The third request waited for the limit to reset instead of
+        # being rejected.
+        self.assertEqual(self.sleeps, [10])
+
+    def test_rate_limited_requests_are_retried(self) -> None:
+        error = {"result": "error", "code": "RATE_LIMIT_HIT", "retry-after": 2.5}
+        responses = [
+            response(429, error, **rate_limit_headers(0, reset=1002.5)),
+            response(200, {"result": "success", "msg": ""}),
+        ]
+        results = self.run_requests(responses, 1)
+        self.assertEqual(results[0]["result"], "success")
+        self.assertEqual(self.sleeps, [2.5])
+
+    def test_rate_limit_errors_without_retries(self) -> None:
+        self.client.retry_on_errors = False
+        error = {"result": "error", "code": "RATE_LIMIT_HIT", "retry-after": 2.5}
+        results = self.run_requests([response(429, error, **{"Retry-After": "2.5"})], 1)
+        self.assertEqual(results[0]["code"], "RATE_LIMIT_HIT")
+        self.assertEqual(self.sleeps, [])
+
+    def test_in_flight_requests_count_against_the_limit(self) -> None:
+        limiter = zulip._RateLimiter()
+        with patch("time.time", return_value=1000.0):
+            self.assertEqual(limiter.reserve(), 0)
+            self.assertEqual(limiter.reserve(), 0)
+            # The first response reports one request left, but the
+            # second request is still in flight and will use it.
+            limiter.finish(rate_limit_headers(1, reset=1005))
+            self.assertEqual(limiter.reserve(), 5)
+
+
+class TestAlwaysRateLimited(TestCase):
+    def setUp(self) -> None:
+        self.server = FakeServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        # Every request is rejected, with a retry-after of 0.
+        self.server.fail_next(100, status=429)
+
+    def test_retries_are_limited(self) -> None:
+        client = self.server.make_client(max_retries=3)
+        result = client.get_profile()
+        self.assertEqual(result["code"], "RATE_LIMIT_HIT")
+        self.assertEqual(self.server.request_counts["GET users/me"], 4)
+
+    @unittest.skipIf(not have_aiohttp, "aiohttp is not installed")
+    def test_async_retries_are_limited(self) -> None:
+        async def run() -> Dict[str, Any]:
+            async with zulip.AsyncClient(
+                email=self.server.email,
+                api_key=self.server.api_key,
+                site=self.server.url,
+                max_retries=3,
+            ) as client:
+                return await client.call_endpoint("users/me", method="GET")
+
+        result = asyncio.run(run())
+        self.assertEqual(result["code"], "RATE_LIMIT_HIT")
+        self.assertEqual(self.server.request_counts["GET users/me"], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import unittest
+from typing import Any, Dict, List
+from unittest import TestCase
+from unittest.mock import patch
+
+import zulip
+from zulip.realm_state import RealmState
+
+
+def register_response() -> Dict[str, Any]:
+    return {
+        "result": "success",
+        "queue_id": "1:1",
+        "last_event_id": -1,
+        "user_id": 1,
+        "realm_users": [
+            {"user_id": 1, "email": "Iago@example.com", "full_name": "Iago", "is_active": True},
+            {"user_id": 2, "email": "hamlet@example.com", "full_name": "Hamlet"},
+        ],
+        "realm_non_active_users": [
+            {"user_id": 3, "email": "ghost@example.com", "full_name": "Ghost"},
+        ],
+        "streams": [
+            {"stream_id": 10, "name": "Devel", "description": ""},
+            {"stream_id": 11, "name": "social", "description": ""},
+        ],
+        "subscriptions": [
+            {"stream_id": 10, "name": "Devel", "color": "#fff", "subscribers": [1, 2]},
+        ],
+        "never_subscribed": [
+            {"stream_id": 11, "name": "social", "subscribers": [2]},
+            {"stream_id": 12, "name": "private", "subscribers": [1]},
+        ],
+    }
+
+
+class TestRealmState(TestCase):
+    def setUp(self) -> None:
+        self.state = RealmState()
+        self.state.apply_register(register_response())
+
+    def test_seeded_from_register(self) -> None:
+        self.assertEqual(self.state.user_id("iago@example.com"), 1)
+        self.assertEqual(self.state.user_id("ghost@example.com"), 3)
+        self.assertIsNone(self.state.user_id("nobody@example.com"))
+        self.assertEqual(self.state.stream_id("devel"), 10)
+        self.assertEqual(self.state.stream_id("private"), 12)
+        self.assertEqual(self.state.subscribers(10), {1, 2})
+        self.assertEqual(self.state.subscribers(11), {2})
+        self.assertTrue(self.state.is_subscribed(10))
+        self.assertFalse(self.state.is_subscribed(11))
+        self.assertNotIn("color", self.state.streams[10])
+        self.assertNotIn("subscribers", self.state.subscriptions[10])
+
+    def test_user_events(self) -> None:
+        events: List[Dict[str, Any]] = [
+            {
+                "type": "realm_user",
+                "op": "add",
+                "person": {"user_id": 4, "email": "new@example.com", "full_name": "New"},
+            },
+            {
+                "type": "realm_user",
+                "op": "update",
+                "person": {"user_id": 1, "new_email": "iago@zulip.com"},
+            },
+            {"type": "realm_user", "op": "update", "person": {"user_id": 2, "full_name": "H"}},
+            {
+                "type": "realm_user",
+                "op": "update",
+                "person": {"user_id": 2, "custom_profile_field": {"id": 5, "value": "x"}},
+            },
+        ]
+        for event in events:
+            self.state.apply_event(event)
+        self.assertEqual(self.state.user_id("new@example.com"), 4)
+        self.assertIsNone(self.state.user_id("iago@example.com"))
+        self.assertEqual(self.state.user_id("iago@zulip.com"), 1)
+        hamlet = self.state.user(2)
+        assert hamlet is not None
+        self.assertEqual(hamlet["full_name"], "H")
+        self.assertEqual(hamlet["profile_data"], {"5": {"value": "x"}})
+
+    def test_stream_events(self) -> None:
+        events: List[Dict[str, Any]] = [
+            {"type": "stream", "op": "create", "streams": [{"stream_id": 13, "name": "new"}]},
+            {"type": "stream", "op": "update", "stream_id": 10, "property": "name", "value": "dev"},
+            {"type": "stream", "op": "delete", "streams": [{"stream_id": 11, "name": "social"}]},
+        ]
+        for event in events:
+            self.state.apply_event(event)
+        self.assertEqual(self.state.stream_id("new"), 13)
+        self.assertIsNone(self.state.stream_id("devel"))
+        self.assertEqual(self.state.stream_id("dev"), 10)
+        self.assertEqual(self.state.subscriptions[10]["name"], "dev")
+        self.assertIsNone(self.state.stream_id("social"))
+        self.assertEqual(self.state.subscribers(11), set())
+
+    def test_subscription_events(self) -> None:
+        events: List[Dict[str, Any]] = [
+            {
+                "type": "subscription",
+                "op": "add",
+                "subscriptions": [{"stream_id": 11, "name": "social", "subscribers": [2, 9]}],
+            },
+            {"type": "subscription", "op": "remove", "subscriptions": [{"stream_id": 10}]},
+            {"type": "subscription", "op": "peer_add", "stream_ids": [10, 12], "user_ids": [7]},
+            {"type": "subscription", "op": "peer_remove", "stream_ids": [10], "user_ids": [1]},
+            # As sent by servers before Zulip 4.0.
+            {"type": "subscription", "op": "peer_add", "subscriptions": ["social"], "user_id": 8},
+        ]
+        for event in events:
+            self.state.apply_event(event)
+        self.assertTrue(self.state.is_subscribed(11))
+        self.assertFalse(self.state.is_subscribed(10))
+        self.assertEqual(self.state.subscribers(10), {2, 7})
+        self.assertEqual(self.state.subscribers(11), {2, 8, 9})
+        self.assertEqual(self.state.subscribers(12), {1, 7})
+
+    def test_unsubscribing_removes_own_user_from_subscribers(self) -> None:
+        # No peer_remove event is sent to the user who unsubscribed.
+        self.state.apply_event(
+            {"type": "subscription", "op": "remove", "subscriptions": [{"stream_id": 10}]}
+        )
+        self.assertFalse(self.state.is_subscribed(10))
+        self.assertEqual(self.state.subscribers(10), {2})
+
+    def test_seeded_again_when_the_queue_is_replaced(self) -> None:
+        client = zulip.Client(
+            email="bot@example.com", api_key="key", site="https://chat.example.com"
+        )
+        state = RealmState()
+        renamed = register_response()
+        renamed["streams"][0]["name"] = "renamed"
+        responses: List[Any] = [
+            {"result": "error", "code": "BAD_EVENT_QUEUE_ID", "msg": "Bad event queue id: 1:1"},
+            KeyboardInterrupt(),
+        ]
+        with patch.object(
+            client, "register", side_effect=[register_response(), renamed]
+        ), patch.object(client, "get_events", side_effect=responses), patch("time.sleep"):
+            with self.assertRaises(KeyboardInterrupt):
+                client.call_on_each_event(
+                    state.apply_event, state.event_types, on_register=state.apply_register
+                )
+        self.assertEqual(state.stream_id("renamed"), 10)
+        self.assertIsNone(state.stream_id("devel"))
+
+
+if __name__ == "__main__":
+    unittest.main()
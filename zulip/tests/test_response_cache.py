@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import unittest
+from typing import Any, Dict
+from unittest import TestCase
+from unittest.mock import patch
+
+import zulip
+
+
+class TestResponseCache(TestCase):
+    def setUp(self) -> None:
+        self.client = zulip.Client(
+            email="bot@example.com",
+            api_key="key",
+            site="https://chat.example.com",
+            response_cache=zulip.ResponseCache(max_entries=2),
+        )
+        self.calls = 0
+
+    def fake_do_api_query(self, request: Dict[str, Any], url: str, **kwargs: Any) -> Dict[str, Any]:
+        self.calls += 1
+        return {"result": "success", "msg": "", "stream_id": self.calls, "url": url}
+
+    def test_get_responses_are_cached(self) -> None:
+        with patch.object(self.client, "do_api_query", side_effect=self.fake_do_api_query):
+            first = self.client.get_stream_id("devel")
+            first["stream_id"] = "modified by the caller"
+            self.assertEqual(self.client.get_stream_id("devel")["stream_id"], 1)
+            self.assertEqual(self.client.get_stream_id("other")["stream_id"], 2)
+        self.assertEqual(self.calls, 2)
+
+    def test_endpoints_without_ttl_are_not_cached(self) -> None:
+        with patch.object(self.client, "do_api_query", side_effect=self.fake_do_api_query):
+            self.client.get_messages({"anchor": "newest"})
+            self.client.get_messages({"anchor": "newest"})
+        self.assertEqual(self.calls, 2)
+
+    def test_entries_expire(self) -> None:
+        with patch.object(self.client, "do_api_query", side_effect=self.fake_do_api_query):
+            with patch("time.monotonic", return_value=1000.0):
+                self.client.get_stream_id("devel")
+            with patch("time.monotonic", return_value=1000.0 + 299):
+                self.client.get_stream_id("devel")
+            with patch("time.monotonic", return_value=1000.0 + 301):
+                self.client.get_stream_id("devel")
+        self.assertEqual(self.calls, 2)
+
+    def test_least_recently_used_entries_are_evicted(self) -> None:
+        with patch.object(self.client, "do_api_query", side_effect=self.fake_do_api_query):
+            self.client.get_stream_id("a")
+            self.client.get_stream_id("b")
+            self.client.get_stream_id("a")
+            self.client.get_stream_id("c")  # Evicts "b"
+            self.client.get_stream_id("a")
+            self.assertEqual(self.calls, 3)
+            self.client.get_stream_id("b")
+        self.assertEqual(self.calls, 4)
+
+    def test_changes_invalidate_related_entries(self) -> None:
+        with patch.object(self.client, "do_api_query", side_effect=self.fake_do_api_query):
+            self.client.get_stream_id("devel")
+            self.client.get_profile()
+            self.client.update_stream({"stream_id": 1, "new_name": "development"})
+            self.client.get_stream_id("devel")
+            self.client.get_profile()
+        # The stream ID was fetched again; the profile was not.
+        self.assertEqual(self.calls, 4)
+
+    def test_explicit_invalidation(self) -> None:
+        with patch.object(self.client, "do_api_query", side_effect=self.fake_do_api_query):
+            self.client.get_profile()
+            assert self.client.response_cache is not None
+            self.client.response_cache.invalidate()
+            self.client.get_profile()
+        self.assertEqual(self.calls, 2)
+
+    def test_cache_is_opt_in(self) -> None:
+        client = zulip.Client(
+            email="bot@example.com", api_key="key", site="https://chat.example.com"
+        )
+        self.assertIsNone(client.response_cache)
+        client = zulip.Client(
+            email="bot@example.com",
+            api_key="key",
+            site="https://chat.example.com",
+            response_cache=True,
+        )
+        self.assertIsInstance(client.response_cache, zulip.ResponseCache)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+import unittest
+from typing import Any, Dict, Iterator
+from unittest import TestCase
+from unittest.mock import patch
+
+import zulip
+
+
+class TestSendMessages(TestCase):
+    def setUp(self) -> None:
+        self.client = zulip.Client(
+            email="bot@example.com", api_key="key", site="https://chat.example.com"
+        )
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_seen_in_flight = 0
+
+    def fake_send_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        with self.lock:
+            self.in_flight += 1
+            self.max_seen_in_flight = max(self.max_seen_in_flight, self.in_flight)
+        # Later messages finish first, to check that ordering is restored.
+        time.sleep(0.001 * (20 - message["n"]))
+        with self.lock:
+            self.in_flight -= 1
+        return {"result": "success", "msg": "", "id": 100 + message["n"]}
+
+    def test_results_in_input_order(self) -> None:
+        messages = [{"n": n} for n in range(20)]
+        with patch.object(self.client, "send_message", side_effect=self.fake_send_message):
+            results = self.client.send_messages(messages, max_in_flight=4)
+        self.assertEqual([r["id"] for r in results], [100 + n for n in range(20)])
+        self.assertLessEqual(self.max_seen_in_flight, 4)
+        self.assertGreater(self.max_seen_in_flight, 1)
+
+    def test_input_is_consumed_lazily(self) -> None:
+        produced = []
+
+        def messages() -> Iterator[Dict[str, Any]]:
+            for n in range(10):
+                produced.append(n)
+                yield {"n": n}
+
+        with patch.object(self.client, "send_message", side_effect=self.fake_send_message):
+            results = self.client.iter_send_messages(messages(), max_in_flight=2)
+            next(results)
+            self.assertLess(len(produced), 10)
+            self.assertEqual(len(list(results)), 9)
+
+    def test_connection_pool_grows_with_concurrency(self) -> None:
+        self.client.ensure_connection_pool_size(32)
+        assert self.client.session is not None
+        adapter = self.client.session.get_adapter("https://chat.example.com/api/v1/messages")
+        self.assertEqual(adapter._pool_maxsize, 32)  # type: ignore[attr-defined] # private to requests
+
+
+if __name__ == "__main__":
+    unittest.main()
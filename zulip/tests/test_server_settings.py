@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import time
+import unittest
+from typing import Any
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import zulip
+
+SERVER_SETTINGS = {
+    "result": "success",
+    "msg": "",
+    "zulip_version": "6.0",
+    "zulip_feature_level": 150,
+}
+
+
+class TestServerSettings(TestCase):
+    def make_client(self, **kwargs: Any) -> zulip.Client:
+        return zulip.Client(
+            email="bot@example.com", api_key="key", site="https://chat.example.com", **kwargs
+        )
+
+    @patch.object(zulip.Client, "get_server_settings", return_value=SERVER_SETTINGS)
+    def test_fetched_lazily_and_once(self, mock_get_server_settings: MagicMock) -> None:
+        client = self.make_client()
+        mock_get_server_settings.assert_not_called()
+
+        self.assertEqual(client.feature_level, 150)
+        self.assertEqual(client.zulip_version, "6.0")
+        mock_get_server_settings.assert_called_once_with()
+
+    @patch.object(zulip.Client, "get_server_settings", return_value=SERVER_SETTINGS)
+    def test_disk_cache(self, mock_get_server_settings: MagicMock) -> None:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            self.assertEqual(self.make_client(server_settings_cache=cache_dir).feature_level, 150)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            # A second process for the same site is served from the cache...
+            self.assertEqual(self.make_client(server_settings_cache=cache_dir).feature_level, 150)
+            self.assertEqual(mock_get_server_settings.call_count, 1)
+
+            # ...but a different site is not.
+            other = zulip.Client(
+                email="bot@example.com",
+                api_key="key",
+                site="https://other.example.com",
+                server_settings_cache=cache_dir,
+            )
+            self.assertEqual(other.zulip_version, "6.0")
+            self.assertEqual(mock_get_server_settings.call_count, 2)
+
+            # Entries older than the TTL are refreshed.
+            with patch("time.time", return_value=time.time() + 7200):
+                client = self.make_client(server_settings_cache=cache_dir)
+                self.assertEqual(client.zulip_version, "6.0")
+            self.assertEqual(mock_get_server_settings.call_count, 3)
+
+    @patch.object(zulip.Client, "get_server_settings", return_value=SERVER_SETTINGS)
+    def test_corrupt_cache_is_ignored(self, mock_get_server_settings: MagicMock) -> None:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            client = self.make_client(server_settings_cache=cache_dir)
+            cache_path = client._server_settings_cache_path()
+            assert cache_path is not None
+            with open(cache_path, "w") as f:
+                f.write("{not json")
+            self.assertEqual(client.feature_level, 150)
+            mock_get_server_settings.assert_called_once_with()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+import asyncio
+import threading
+import time
+import unittest
+from typing import Any, Dict, List
+from unittest import TestCase
+from unittest.mock import patch
+
+import zulip
+
+
+class TestSingleFlight(TestCase):
+    def setUp(self) -> None:
+        self.client = zulip.Client(
+            email="bot@example.com",
+            api_key="key",
+            site="https://chat.example.com",
+            coalesce_requests=True,
+        )
+        self.release = threading.Event()
+        self.calls: List[Dict[str, Any]] = []
+
+    def do_api_query(self, request: Dict[str, Any], url: str, **kwargs: Any) -> Dict[str, Any]:
+        self.calls.append(request)
+        self.release.wait()
+        if "missing" in url:
+            raise zulip.ZulipError("boom")
+        return {"result": "success", "msg": "", "stream_id": 7}
+
+    def run_concurrently(self, count: int, stream: str = "devel") -> List[Any]:
+        results: List[Any] = [None] * count
+
+        def get(i: int) -> None:
+            try:
+                results[i] = self.client.get_stream_id(stream)
+            except zulip.ZulipError as e:
+                results[i] = e
+
+        with patch.object(self.client, "do_api_query", side_effect=self.do_api_query):
+            threads = [threading.Thread(target=get, args=(i,)) for i in range(count)]
+            for thread in threads:
+                thread.start()
+            self.wait_for_waiters(count - 1)
+            self.release.set()
+            for thread in threads:
+                thread.join()
+        return results
+
+    def wait_for_waiters(self, count: int) -> None:
+        assert self.client._single_flight is not None
+        for _ in range(500):
+            in_flight = list(self.client._single_flight.in_flight.values())
+            if in_flight and in_flight[0].waiters == count:
+                return
+            time.sleep(0.001)
+        self.fail("callers did not join the request")
+
+    def test_identical_gets_share_one_request(self) -> None:
+        results = self.run_concurrently(5)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual([r["stream_id"] for r in results], [7] * 5)
+        # Each caller gets its own copy.
+        self.assertEqual(len({id(r) for r in results}), 5)
+        self.assertEqual(self.client._single_flight.in_flight, {})  # type: ignore[union-attr]
+
+    def test_errors_are_shared(self) -> None:
+        results = self.run_concurrently(3, stream="missing")
+        self.assertEqual(len(self.calls), 1)
+        for result in results:
+            self.assertIsInstance(result, zulip.ZulipError)
+
+    def test_later_requests_are_not_coalesced(self) -> None:
+        self.release.set()
+        with patch.object(self.client, "do_api_query", side_effect=self.do_api_query):
+            self.client.get_stream_id("devel")
+            self.client.get_stream_id("devel")
+            self.client.get_stream_id("design")
+        self.assertEqual(len(self.calls), 3)
+
+    def test_other_methods_are_not_coalesced(self) -> None:
+        self.release.set()
+        with patch.object(self.client, "do_api_query", side_effect=self.do_api_query):
+            with patch.object(self.client._single_flight, "do") as do:
+                self.client.update_stream({"stream_id": 7, "description": "x"})
+                self.client.get_events(queue_id="1:1", last_event_id=-1)
+        do.assert_not_called()
+
+    def test_requests_after_a_write_are_not_coalesced(self) -> None:
+        client = zulip.Client(
+            email="bot@example.com",
+            api_key="key",
+            site="https://chat.example.com",
+            response_cache=True,
+            coalesce_requests=True,
+        )
+        gates = [threading.Event(), threading.Event()]
+        results: List[Dict[str, Any]] = []
+
+        def do_api_query(
+            request: Dict[str, Any], url: str, method: str = "POST", **kwargs: Any
+        ) -> Dict[str, Any]:
+            if method != "GET":
+                return {"result": "success", "msg": ""}
+            index = len(self.calls)
+            self.calls.append(request)
+            gates[index].wait(5)
+            return {"result": "success", "msg": "", "stream_id": index + 1}
+
+        def get() -> None:
+            results.append(client.get_stream_id("devel"))
+
+        def wait_for_calls(count: int) -> None:
+            for _ in range(500):
+                if len(self.calls) == count:
+                    return
+                time.sleep(0.001)
+            self.fail("the request was not made")
+
+        with patch.object(client, "do_api_query", side_effect=do_api_query):
+            before = threading.Thread(target=get)
+            before.start()
+            wait_for_calls(1)
+            client.update_stream({"stream_id": 7, "description": "x"})
+            after = threading.Thread(target=get)
+            after.start()
+            # The request made after the write doesn't join the one in flight.
+            wait_for_calls(2)
+            gates[1].set()
+            after.join()
+            gates[0].set()
+            before.join()
+            self.assertEqual([r["stream_id"] for r in results], [2, 1])
+            # The response of the request made before the write isn't cached.
+            self.assertEqual(client.get_stream_id("devel")["stream_id"], 2)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_disabled_by_default(self) -> None:
+        client = zulip.Client(
+            email="bot@example.com", api_key="key", site="https://chat.example.com"
+        )
+        self.assertIsNone(client._single_flight)
+
+
+class TestAsyncSingleFlight(TestCase):
+    def test_identical_gets_share_one_request(self) -> None:
+        client = zulip.AsyncClient(
+            email="bot@example.com",
+            api_key="key",
+            site="https://chat.example.com",
+            coalesce_requests=True,
+        )
+        calls: List[Dict[str, Any]] = []
+
+        async def do_api_query(request: Dict[str, Any], url: str, **kwargs: Any) -> Dict[str, Any]:
+            calls.append(request)
+            await asyncio.sleep(0.01)
+            return {"result": "success", "msg": "", "stream_id": 7}
+
+        async def run() -> List[Dict[str, Any]]:
+            with patch.object(client, "do_api_query", side_effect=do_api_query):
+                return await asyncio.gather(
+                    *(client.get_stream_id("devel") for _ in range(4)),
+                    client.get_stream_id("design"),
+                )
+
+        results = asyncio.run(run())
+        self.assertEqual(len(calls), 2)
+        self.assertEqual([r["stream_id"] for r in results], [7] * 5)
+        self.assertEqual(len({id(r) for r in results}), 5)
+        self.assertEqual(client._in_flight_requests, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
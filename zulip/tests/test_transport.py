@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import unittest
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import zulip
+
+
+class TestTransport(TestCase):
+    def setUp(self) -> None:
+        self.transport = zulip.Transport(pool_size=4)
+        self.addCleanup(self.transport.close)
+
+    def make_client(self, email: str, site: str = "https://chat.example.com") -> zulip.Client:
+        client = zulip.Client(email=email, api_key="key", site=site, transport=self.transport)
+        client.has_connected = True
+        return client
+
+    def test_clients_share_one_session(self) -> None:
+        first = self.make_client("first-bot@example.com")
+        second = self.make_client("second-bot@example.com", site="https://other.example.com")
+        first.ensure_session()
+        second.ensure_session()
+        self.assertIs(first.session, second.session)
+
+        adapter = self.transport.session.get_adapter("https://chat.example.com")
+        self.assertEqual(adapter._pool_maxsize, 4)  # type: ignore[attr-defined]
+        self.assertTrue(adapter._pool_block)  # type: ignore[attr-defined]
+        # Growing the pool is up to the transport.
+        first.ensure_connection_pool_size(100)
+        self.assertIs(self.transport.session.get_adapter("https://chat.example.com"), adapter)
+
+    def test_credentials_are_sent_per_request(self) -> None:
+        clients = [self.make_client(f"bot{i}@example.com") for i in range(2)]
+        res = MagicMock(status_code=200, headers={}, content=b'{"result": "success", "msg": ""}')
+        with patch.object(self.transport.session, "request", return_value=res) as request:
+            for client in clients:
+                client.get_profile()
+        auths = [call[1]["auth"] for call in request.call_args_list]
+        self.assertEqual(
+            [auth.username for auth in auths], ["bot0@example.com", "bot1@example.com"]
+        )
+        self.assertIn("User-agent", request.call_args[1]["headers"])
+        self.assertIsNone(self.transport.session.auth)
+
+    def test_cookies_are_not_shared(self) -> None:
+        policy = self.transport.session.cookies.get_policy()
+        self.assertEqual(policy.allowed_domains(), ())  # type: ignore[attr-defined]
+
+
+if __name__ == "__main__":
+    unittest.main()
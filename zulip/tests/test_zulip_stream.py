@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from typing import Any, Dict, List
+from unittest import TestCase
+from unittest.mock import patch
+
+import zulip
+from zulip.testing import FakeServer
+
+# The directory to import zulip from in a subprocess.
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(zulip.__file__)))
+
+
+class TestZulipStream(TestCase):
+    def make_stream(self, **kwargs: Any) -> zulip.ZulipStream:
+        stream = zulip.ZulipStream(
+            type="stream",
+            to="logs",
+            subject="cron",
+            email="bot@example.com",
+            api_key="key",
+            site="https://chat.example.com",
+            **kwargs,
+        )
+        self.sent: List[Dict[str, Any]] = []
+        self.sent_event = threading.Event()
+
+        def send_message(message: Dict[str, Any]) -> Dict[str, Any]:
+            self.sent.append(message)
+            self.sent_event.set()
+            return {"result": "success", "msg": "", "id": len(self.sent)}
+
+        patcher = patch.object(stream.client, "send_message", side_effect=send_message)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(stream.close)
+        return stream
+
+    def test_writes_are_coalesced(self) -> None:
+        stream = self.make_stream(flush_interval=None)
+        for i in range(100):
+            print(f"line {i}", file=stream)
+        self.assertEqual(self.sent, [])
+        stream.flush()
+        [message] = self.sent
+        self.assertEqual(message["to"], "logs")
+        self.assertEqual(message["subject"], "cron")
+        self.assertEqual(message["content"].splitlines(), [f"line {i}" for i in range(100)])
+        stream.flush()
+        self.assertEqual(len(self.sent), 1)
+
+    def test_buffer_size(self) -> None:
+        stream = self.make_stream(flush_interval=None, buffer_size=20)
+        stream.write("0123456789\n")
+        self.assertEqual(self.sent, [])
+        stream.write("0123456789\n")
+        self.assertEqual([m["content"] for m in self.sent], ["0123456789\n0123456789\n"])
+
+    def test_long_output_is_split_at_line_breaks(self) -> None:
+        stream = self.make_stream(flush_interval=None, max_message_length=25)
+        stream.write("first line\nsecond line\nthird line\n" + "x" * 30 + "\n\n")
+        stream.flush()
+        self.assertEqual(
+            [m["content"] for m in self.sent],
+            ["first line\nsecond line\n", "third line\n", "x" * 25, "xxxxx\n\n"],
+        )
+
+    def test_background_flush(self) -> None:
+        stream = self.make_stream(flush_interval=0.2)
+        logger = logging.getLogger("test_background_flush")
+        logger.propagate = False
+        logger.addHandler(zulip.ZulipStreamHandler(stream))
+        self.addCleanup(logger.handlers.clear)
+        logger.warning("disk almost full")
+        logger.warning("disk full")
+        self.assertTrue(self.sent_event.wait(5))
+        self.assertEqual(self.sent[0]["content"], "disk almost full\ndisk full\n")
+
+    def test_flush_sends_right_away(self) -> None:
+        stream = self.make_stream(flush_interval=60)
+        stream.write("almost done\n")
+        stream.flush()
+        self.assertEqual([m["content"] for m in self.sent], ["almost done\n"])
+
+    def test_close_flushes(self) -> None:
+        stream = self.make_stream(flush_interval=60)
+        stream.write("bye\n")
+        self.assertEqual(self.sent, [])
+        stream.close()
+        self.assertEqual([m["content"] for m in self.sent], ["bye\n"])
+        self.assertIsNotNone(stream._flusher)
+        self.assertFalse(stream._flusher.is_alive())  # type: ignore[union-attr]
+        with self.assertRaises(ValueError):
+            stream.write("more")
+
+    def test_send_errors_are_logged(self) -> None:
+        stream = self.make_stream(flush_interval=None)
+        stream.write("output")
+        with patch.object(
+            stream.client, "send_message", return_value={"result": "error", "msg": "No such stream"}
+        ), self.assertLogs("zulip", "WARNING") as logs:
+            stream.flush()
+        self.assertIn("No such stream", logs.output[0])
+
+
+class TestZulipStreamAtExit(TestCase):
+    def test_unsent_output_is_sent_at_exit(self) -> None:
+        with FakeServer() as server:
+            script = f"""
+import zulip
+stream = zulip.ZulipStream(
+    type="stream",
+    to="logs",
+    subject="cron",
+    flush_interval=60,
+    email={server.email!r},
+    api_key={server.api_key!r},
+    site={server.url!r},
+)
+print("done", file=stream)
+"""
+            with tempfile.TemporaryDirectory() as tmpdir:
+                subprocess.run(
+                    [sys.executable, "-c", script],
+                    cwd=tmpdir,
+                    env=dict(os.environ, PYTHONPATH=PACKAGE_DIR),
+                    check=True,
+                    timeout=30,
+                )
+            self.assertEqual([m["content"] for m in server.messages], ["done\n"])
+
+
+if __name__ == "__main__":
+    unittest.main()
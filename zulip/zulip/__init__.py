@@ -1,33 +1,57 @@
-import argparse
+import atexit
+import base64
+import collections
+import functools
 import json
 import logging
-import optparse
 import os
-import platform
 import random
 import sys
+import threading
 import time
 import traceback
 import types
 import urllib.parse
-from configparser import ConfigParser
+import weakref
 from typing import (
     IO,
+    TYPE_CHECKING,
     Any,
+    AsyncIterator,
+    Awaitable,
     Callable,
+    Deque,
     Dict,
+    Hashable,
     Iterable,
+    Iterator,
     List,
     Mapping,
+    NamedTuple,
     Optional,
     Sequence,
+    Set,
     Tuple,
+    TypeVar,
     Union,
 )
 
-import distro
-import requests
-from typing_extensions import Literal
+# `import zulip` sits on the startup path of short-lived scripts like
+# zulip-send and the VCS hooks, so heavier dependencies (requests,
+# distro, argparse, asyncio, ...) are imported where they are used.
+if sys.version_info >= (3, 8):
+    from typing import Literal
+else:
+    from typing_extensions import Literal
+
+if TYPE_CHECKING:
+    import argparse
+    import asyncio
+    import optparse
+    from concurrent.futures import Future
+
+    import aiohttp
+    import requests
 
 __version__ = "0.8.2"
 
@@ -36,9 +60,6 @@ assert sys.version_info >= (3, 6)
 
 logger = logging.getLogger(__name__)
 
-# In newer versions, the 'json' attribute is a function, not a property
-requests_json_is_function = callable(requests.Response.json)
-
 API_VERSTRING = "v1/"
 
 # An optional parameter to `move_topic` and `update_message` actions
@@ -74,12 +95,79 @@ MessageFlag = Literal[
 ]
 
 
+class JSONCodec:
+    """
+    Encodes request parameters to, and decodes responses from, JSON.
+    This one uses the standard library's json module; see set_json_codec.
+    """
+
+    name = "json"
+
+    def dumps(self, obj: Any) -> str:
+        return json.dumps(obj)
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(JSONCodec):
+    """A JSONCodec using orjson, which is several times faster on large payloads."""
+
+    name = "orjson"
+
+    def __init__(self) -> None:
+        import orjson
+
+        self.orjson = orjson
+
+    def dumps(self, obj: Any) -> str:
+        try:
+            return self.orjson.dumps(obj).decode()
+        except TypeError:
+            # orjson rejects a few things json accepts, like integer
+            # dict keys and integers wider than 64 bits.
+            return json.dumps(obj)
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        try:
+            return self.orjson.loads(data)
+        except self.orjson.JSONDecodeError:
+            # Likewise NaN and Infinity, which json writes by default.
+            # (Integers wider than 64 bits are decoded as floats.)
+            return json.loads(data)
+
+
+_json_codec = None  # type: Optional[JSONCodec]
+
+
+def get_json_codec() -> JSONCodec:
+    """
+    The JSONCodec used by zulip, zulip_bots and zulip_botserver: an
+    OrjsonCodec if orjson is installed, a JSONCodec otherwise, unless
+    set_json_codec has chosen another.
+    """
+    global _json_codec
+    if _json_codec is None:
+        try:
+            _json_codec = OrjsonCodec()
+        except ImportError:
+            _json_codec = JSONCodec()
+    return _json_codec
+
+
+def set_json_codec(codec: Optional[JSONCodec]) -> None:
+    """Chooses the JSONCodec to use; None restores the default."""
+    global _json_codec
+    _json_codec = codec
+
+
 class CountingBackoff:
     def __init__(
         self,
         maximum_retries: int = 10,
         timeout_success_equivalent: Optional[float] = None,
         delay_cap: float = 90.0,
+        time_limit: Optional[float] = None,
     ) -> None:
         """Sets up a retry-backoff object.  Example usage:
         backoff = zulip.CountingBackoff()
@@ -95,17 +183,31 @@ class CountingBackoff:
         threshold in seconds before the next keep_going/fail, above
         which the last run is treated like it was a success.
 
+        time_limit, if set, is a budget in seconds for the whole
+        operation: once that long has passed since the backoff object
+        was created, keep_going returns False, and delays never sleep
+        past it.
+
         """
         self.number_of_retries = 0
         self.maximum_retries = maximum_retries
         self.timeout_success_equivalent = timeout_success_equivalent
         self.last_attempt_time = 0.0
         self.delay_cap = delay_cap
+        self.deadline = None if time_limit is None else time.monotonic() + time_limit
 
     def keep_going(self) -> bool:
         self._check_success_timeout()
+        if self.time_remaining() == 0:
+            return False
         return self.number_of_retries < self.maximum_retries
 
+    def time_remaining(self) -> Optional[float]:
+        """Seconds left before the time_limit expires, or None if there is no limit."""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+
     def succeed(self) -> None:
         self.number_of_retries = 0
         self.last_attempt_time = time.time()
@@ -125,29 +227,74 @@ class CountingBackoff:
 
 
 class RandomExponentialBackoff(CountingBackoff):
+    def __init__(self, *args: Any, log_level: int = logging.WARNING, **kwargs: Any) -> None:
+        """Takes CountingBackoff's arguments, and the level at which to
+        log each delay."""
+        super().__init__(*args, **kwargs)
+        self.log_level = log_level
+
     def fail(self) -> None:
+        time.sleep(self.fail_without_sleeping())
+
+    def fail_without_sleeping(self) -> float:
+        """Like fail(), but returns the delay instead of sleeping for it,
+        for callers that need to wait some other way (e.g. in asyncio)."""
         super().fail()
         # Exponential growth with ratio sqrt(2); compute random delay
-        # between x and 2x where x is growing exponentially
+        # between x and 2x where x is growing exponentially.  The
+        # delay is not rounded, so that many clients failing at the
+        # same moment (e.g. during a server restart) spread out their
+        # retries rather than retrying in lockstep.
         delay_scale = int(2 ** (self.number_of_retries / 2.0 - 1)) + 1
-        delay = min(delay_scale + random.randint(1, delay_scale), self.delay_cap)
-        message = f"Sleeping for {delay}s [max {delay_scale * 2}] before retrying."
+        delay = min(random.uniform(delay_scale, delay_scale * 2), self.delay_cap)
+        time_remaining = self.time_remaining()
+        if time_remaining is not None:
+            delay = min(delay, time_remaining)
+        message = f"Sleeping for {delay:.1f}s [max {delay_scale * 2}] before retrying."
         try:
-            logger.warning(message)
+            logger.log(self.log_level, message)
         except NameError:
             print(message)
-        time.sleep(delay)
+        return delay
 
 
 def _default_client() -> str:
     return "ZulipPython/" + __version__
 
 
+@functools.lru_cache(maxsize=None)
+def _get_platform_version() -> Tuple[str, str]:
+    # Looking up the OS version reads files like /etc/os-release, so
+    # do it at most once per process rather than once per session.
+    import platform
+
+    vendor = ""
+    vendor_version = ""
+    try:
+        vendor = platform.system()
+        vendor_version = platform.release()
+    except OSError:
+        # If the calling process is handling SIGCHLD, platform.system() can
+        # fail with an IOError.  See http://bugs.python.org/issue9127
+        pass
+
+    if vendor == "Linux":
+        import distro
+
+        vendor, vendor_version = distro.name(), distro.version()
+    elif vendor == "Windows":
+        vendor_version = platform.win32_ver()[1]
+    elif vendor == "Darwin":
+        vendor_version = platform.mac_ver()[0]
+    return vendor, vendor_version
+
+
 def add_default_arguments(
-    parser: argparse.ArgumentParser,
+    parser: "argparse.ArgumentParser",
     patch_error_handling: bool = True,
     allow_provisioning: bool = False,
-) -> argparse.ArgumentParser:
+) -> "argparse.ArgumentParser":
+    import argparse
 
     if patch_error_handling:
 
@@ -221,7 +368,11 @@ def add_default_arguments(
 # except for the fact that is uses the deprecated `optparse` module.
 # We still keep it for legacy support of out-of-tree bots and integrations
 # depending on it.
-def generate_option_group(parser: optparse.OptionParser, prefix: str = "") -> optparse.OptionGroup:
+def generate_option_group(
+    parser: "optparse.OptionParser", prefix: str = ""
+) -> "optparse.OptionGroup":
+    import optparse
+
     logging.warning(
         """zulip.generate_option_group is based on optparse, which
                     is now deprecated. We recommend migrating to argparse and
@@ -355,6 +506,626 @@ def validate_boolean_field(field: Optional[str]) -> Union[bool, None]:
         return None
 
 
+def marshal_request(orig_request: Mapping[str, Any]) -> Dict[str, str]:
+    # The API expects every non-string parameter to be JSON-encoded.
+    dumps = get_json_codec().dumps
+    request = {}
+    for (key, val) in orig_request.items():
+        if isinstance(val, str):
+            request[key] = val
+        else:
+            request[key] = dumps(val)
+    return request
+
+
+def _message_page_request(
+    narrow: List[Any],
+    anchor: Union[int, str],
+    batch_size: int,
+    direction: str,
+    request: Mapping[str, Any],
+) -> Dict[str, Any]:
+    # The get_messages request for one page of Client.iter_messages.
+    message_filters = dict(request)
+    message_filters.update(
+        anchor=anchor,
+        num_before=batch_size if direction == "older" else 0,
+        num_after=batch_size if direction == "newer" else 0,
+        narrow=narrow,
+    )
+    return message_filters
+
+
+def _next_message_anchor(page: Dict[str, Any], direction: str) -> Optional[int]:
+    # Where the page of Client.iter_messages after `page` starts, or
+    # None if `page` reached the end of the history.
+    if page["result"] != "success":
+        raise ZulipError("Error fetching messages: {}".format(page.get("msg")))
+    messages = page["messages"]
+    if direction == "older":
+        if page.get("found_oldest") or not messages:
+            return None
+        return messages[0]["id"] - 1
+    if page.get("found_newest") or not messages:
+        return None
+    return messages[-1]["id"] + 1
+
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def _map_with_bounded_concurrency(
+    func: Callable[[T], R], items: Iterable[T], max_in_flight: int
+) -> Iterator[Tuple[int, R]]:
+    # Yields (index, func(item)) pairs as they complete, pulling from
+    # `items` lazily so that at most `max_in_flight` calls are pending.
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    if max_in_flight < 1:
+        raise ValueError("max_in_flight must be at least 1")
+    item_iter = enumerate(items)
+    pending = {}  # type: Dict[Future[R], int]
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        try:
+            while True:
+                for index, item in item_iter:
+                    pending[executor.submit(func, item)] = index
+                    if len(pending) >= max_in_flight:
+                        break
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+async def _amap_with_bounded_concurrency(
+    func: Callable[[T], Awaitable[R]], items: Iterable[T], max_in_flight: int
+) -> AsyncIterator[Tuple[int, R]]:
+    # The asyncio counterpart of _map_with_bounded_concurrency.
+    import asyncio
+
+    if max_in_flight < 1:
+        raise ValueError("max_in_flight must be at least 1")
+    item_iter = enumerate(items)
+    pending = {}  # type: Dict[asyncio.Future[R], int]
+    try:
+        while True:
+            for index, item in item_iter:
+                pending[asyncio.ensure_future(func(item))] = index
+                if len(pending) >= max_in_flight:
+                    break
+            if not pending:
+                return
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield pending.pop(task), task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _chunks(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    chunk = []  # type: List[T]
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class _BulkFlagUpdate:
+    # The running totals of Client.update_message_flags_in_bulk.
+
+    def __init__(self, progress: Optional[Callable[[int], None]]) -> None:
+        self.progress = progress
+        self.processed_count = 0
+        self.updated_count = 0
+        self.failed_messages = []  # type: List[int]
+        self.error = None  # type: Optional[str]
+
+    def add_batch(self, message_ids: List[int], response: Dict[str, Any]) -> None:
+        # A messages/flags response, which lists the messages changed.
+        if response["result"] == "success":
+            self.processed_count += len(message_ids)
+            self.updated_count += len(response.get("messages", []))
+        else:
+            self.failed_messages.extend(message_ids)
+            if self.error is None:
+                self.error = response.get("msg", "")
+        self.report_progress()
+
+    def add_narrow_batch(self, response: Dict[str, Any]) -> bool:
+        # A messages/flags/narrow response; returns whether any messages
+        # are left to update.
+        if response["result"] != "success":
+            self.error = response.get("msg", "")
+            return False
+        self.processed_count += response["processed_count"]
+        self.updated_count += response["updated_count"]
+        self.report_progress()
+        return not response["found_newest"] and response["last_processed_id"] is not None
+
+    def report_progress(self) -> None:
+        if self.progress is not None:
+            self.progress(self.processed_count)
+
+    def result(self) -> Dict[str, Any]:
+        return {
+            "result": "success" if self.error is None else "error",
+            "msg": self.error or "",
+            "processed_count": self.processed_count,
+            "updated_count": self.updated_count,
+            "failed_messages": self.failed_messages,
+        }
+
+
+def _flags_narrow_request(
+    op: str, flag: str, narrow: List[Any], anchor: Union[int, str], batch_size: int
+) -> Dict[str, Any]:
+    # One batch of Client.update_message_flags_in_bulk on servers with
+    # messages/flags/narrow (feature level 155); `anchor` is either
+    # "oldest" or the last message the previous batch processed.
+    return {
+        "op": op,
+        "flag": flag,
+        "narrow": narrow,
+        "anchor": anchor,
+        "include_anchor": anchor == "oldest",
+        "num_before": 0,
+        "num_after": batch_size,
+    }
+
+
+def event_dispatch_key(event: Dict[str, Any]) -> Hashable:
+    """
+    The default ordering key for concurrent event dispatch in
+    Client.call_on_each_event: events in the same stream topic or the
+    same private conversation share a key.  Events that can't be tied
+    to a conversation (e.g. reactions, presence) all share the key None.
+    """
+    if event["type"] == "message":
+        message = event["message"]
+        if message["type"] == "stream":
+            return ("stream", message["stream_id"], message["subject"].lower())
+        return ("private", tuple(sorted(user["id"] for user in message["display_recipient"])))
+    if event["type"] in ("update_message", "delete_message") and "stream_id" in event:
+        topic = event.get("orig_subject", event.get("topic", event.get("subject", "")))
+        return ("stream", event["stream_id"], topic.lower())
+    return None
+
+
+def _compact_event_callback(
+    callback: Callable[[Dict[str, Any]], R]
+) -> Callable[[Dict[str, Any]], R]:
+    from zulip.events import Event
+
+    def compact_callback(event: Dict[str, Any]) -> R:
+        # Events support the same item access as the dicts they replace.
+        return callback(Event(event))  # type: ignore[arg-type]
+
+    return compact_callback
+
+
+class _KeyedEventDispatcher:
+    # Runs a callback on a thread pool, such that events with the same
+    # key are handled one at a time in arrival order while different
+    # keys proceed in parallel.  submit() blocks once `max_pending`
+    # events are queued or running, which pushes back on the caller
+    # instead of buffering without bound.
+    #
+    # Edits and deletions go to the lane of the message they apply to,
+    # whatever key they would get on their own: e.g. a content-only
+    # update_message event carries no topic, so event_dispatch_key
+    # can't place it next to its message.  The lanes of the last
+    # MESSAGE_KEYS_SIZE messages seen are remembered for this.
+    MESSAGE_KEYS_SIZE = 10000
+
+    def __init__(
+        self,
+        callback: Callable[[Dict[str, Any]], None],
+        key: Callable[[Dict[str, Any]], Hashable],
+        workers: int,
+        max_pending: int,
+    ) -> None:
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.callback = callback
+        self.key = key
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.lanes = {}  # type: Dict[Hashable, Deque[Dict[str, Any]]]
+        self.message_keys = collections.OrderedDict()  # type: collections.OrderedDict[int, Hashable]
+        self.error = None  # type: Optional[BaseException]
+
+    def event_key(self, event: Dict[str, Any]) -> Hashable:
+        if event["type"] == "message":
+            message_ids = [event["message"]["id"]]
+        elif event["type"] in ("update_message", "delete_message"):
+            message_ids = event.get("message_ids") or [event["message_id"]]
+        else:
+            return self.key(event)
+        for message_id in message_ids:
+            if message_id in self.message_keys:
+                key = self.message_keys[message_id]
+                break
+        else:
+            key = self.key(event)
+        for message_id in message_ids:
+            self.message_keys[message_id] = key
+            self.message_keys.move_to_end(message_id)
+        while len(self.message_keys) > self.MESSAGE_KEYS_SIZE:
+            self.message_keys.popitem(last=False)
+        return key
+
+    def submit(self, event: Dict[str, Any]) -> None:
+        self.check()
+        key = self.event_key(event)
+        self.slots.acquire()
+        with self.lock:
+            lane = self.lanes.get(key)
+            if lane is not None:
+                lane.append(event)
+                return
+            self.lanes[key] = collections.deque([event])
+        self.executor.submit(self._drain, key)
+
+    def _drain(self, key: Hashable) -> None:
+        while True:
+            with self.lock:
+                lane = self.lanes[key]
+                if not lane or self.error is not None:
+                    del self.lanes[key]
+                    return
+                # The event stays in the lane while it runs, so that
+                # events submitted meanwhile queue up behind it.
+                event = lane[0]
+            try:
+                self.callback(event)
+            except BaseException as e:
+                logger.exception("Error in event callback")
+                with self.lock:
+                    if self.error is None:
+                        self.error = e
+            finally:
+                with self.lock:
+                    lane.popleft()
+                self.slots.release()
+
+    def check(self) -> None:
+        # Surface callback failures in the polling thread, matching
+        # the behavior of inline dispatch.
+        if self.error is not None:
+            raise self.error
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
+
+
+class _RateLimiter:
+    # Paces requests to stay within the server's rate limit, as
+    # advertised in the X-RateLimit-* headers of its responses: while
+    # the server says requests remain, they go out immediately; once
+    # none remain, callers wait until the limit resets rather than
+    # sending requests that would be rejected with a 429.  Requests
+    # still in flight count against what remains, so that concurrent
+    # callers (e.g. Client.send_messages) don't all overshoot together.
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.limit = None  # type: Optional[int]
+        self.remaining = None  # type: Optional[int]
+        self.reset_time = 0.0
+        self.in_flight = 0
+
+    def reserve(self) -> float:
+        """Returns 0 and counts a request as in flight if one may be
+        sent now; otherwise returns how long to wait before asking again."""
+        with self.lock:
+            now = time.time()
+            if self.remaining is not None and now >= self.reset_time:
+                # The limit has reset; until a response says otherwise,
+                # assume the whole of it is available again.
+                self.remaining = self.limit
+            if self.remaining is not None and self.remaining <= 0:
+                return max(self.reset_time - now, 0.01)
+            if self.remaining is not None:
+                self.remaining -= 1
+            self.in_flight += 1
+            return 0
+
+    def finish(self, headers: Optional[Mapping[str, str]]) -> None:
+        """Records the end of a request, and the limit state its response
+        reports (None if the request failed without a response)."""
+        with self.lock:
+            self.in_flight = max(self.in_flight - 1, 0)
+            if headers is None:
+                return
+            try:
+                limit = int(headers["X-RateLimit-Limit"])
+                remaining = int(headers["X-RateLimit-Remaining"])
+                reset_time = float(headers["X-RateLimit-Reset"])
+            except (KeyError, ValueError):
+                return
+            self.limit = limit
+            self.remaining = remaining - self.in_flight
+            self.reset_time = reset_time
+
+    def hit_limit(self, retry_after: float) -> None:
+        """Holds back all requests for `retry_after` seconds, after a 429."""
+        with self.lock:
+            self.remaining = 0
+            self.reset_time = max(self.reset_time, time.time() + retry_after)
+
+
+def _retry_after(headers: Mapping[str, str], json_result: Optional[Dict[str, Any]]) -> float:
+    # How long a 429 response asks us to wait; Zulip sends it both as a
+    # header and in the response body.
+    for value in (headers.get("Retry-After"), (json_result or {}).get("retry-after")):
+        try:
+            return float(value)  # type: ignore[arg-type] # None is caught below
+        except (TypeError, ValueError):
+            pass
+    return 1.0
+
+
+class RequestMetrics(NamedTuple):
+    """
+    What a Client's metrics_hook is told about each API request; see
+    zulip.metrics.MetricsCollector for a ready-made hook.
+    """
+
+    method: str
+    # The URL path below /api/v1/, with numeric IDs, emails and custom
+    # emoji names replaced by "{id}", "{email}" and "{emoji_name}" and
+    # the query string removed, e.g. "messages/{id}/reactions".
+    endpoint: str
+    # The status of the last response, or None if the request failed
+    # without one (e.g. a connection error).
+    status_code: Optional[int]
+    # Seconds from the start of the first attempt to the end of the
+    # last, including any time spent waiting between retries.
+    duration: float
+    retries: int
+    request_bytes: int
+    response_bytes: int
+    longpolling: bool
+
+
+def _endpoint_pattern(url: str) -> str:
+    path = url.split("?", 1)[0]
+    if path.startswith(API_VERSTRING):
+        path = path[len(API_VERSTRING) :]
+    # Only placeholders stand in for the path's variable parts, so that
+    # metrics get a bounded number of endpoints.
+    parts = path.split("/")
+    for i, part in enumerate(parts):
+        if part.isdigit():
+            parts[i] = "{id}"
+        elif "@" in part or "%40" in part:
+            parts[i] = "{email}"
+        elif i == 2 and parts[:2] == ["realm", "emoji"]:
+            parts[i] = "{emoji_name}"
+    return "/".join(parts)
+
+
+def _request_size(request: Dict[str, str], files: List[IO[Any]]) -> int:
+    # The size of the form-encoded parameters and of any uploaded
+    # files, leaving out multipart framing.
+    size = len(urllib.parse.urlencode(request))
+    for f in files:
+        try:
+            size += os.fstat(f.fileno()).st_size
+        except (AttributeError, OSError):
+            pass
+    return size
+
+
+# How long, in seconds, ResponseCache keeps responses of each endpoint
+# by default; endpoints not listed are never cached.
+DEFAULT_RESPONSE_CACHE_TTLS = {
+    "get_stream_id": 300.0,
+    "streams": 60.0,
+    "users": 60.0,
+    "users/me": 300.0,
+    "users/{id}": 60.0,
+    "realm/emoji": 300.0,
+    "server_settings": 3600.0,
+}  # type: Dict[str, float]
+
+# Endpoints whose responses describe another endpoint's resource, so
+# that e.g. renaming a stream also drops cached get_stream_id lookups.
+_RESOURCE_ALIASES = {
+    "get_stream_id": "streams",
+}
+
+
+def _endpoint_resource(endpoint: str) -> str:
+    resource = endpoint.split("/", 1)[0]
+    return _RESOURCE_ALIASES.get(resource, resource)
+
+
+# (URL, request parameters), and (expiry time, resource, response).
+_CacheKey = Tuple[str, str]
+_CacheEntry = Tuple[float, str, Dict[str, Any]]
+# A request's cache key, and its resource's write generation.
+_FlightKey = Tuple[_CacheKey, int]
+
+
+def _request_key(url: str, request: Mapping[str, Any]) -> _CacheKey:
+    return (url, json.dumps(request, sort_keys=True, default=str))
+
+
+class ResponseCache:
+    """
+    A size-bounded LRU cache of GET responses, each kept for its
+    endpoint's TTL; see Client's response_cache argument.  Safe to use
+    from several threads.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttls: Mapping[str, float] = DEFAULT_RESPONSE_CACHE_TTLS,
+    ) -> None:
+        self.max_entries = max_entries
+        # Keyed by endpoint pattern, e.g. "users/{id}"; see RequestMetrics.
+        self.ttls = dict(ttls)
+        self.lock = threading.Lock()
+        # Dicts keep insertion order, so the least recently used entry
+        # comes first.
+        self.entries = {}  # type: Dict[_CacheKey, _CacheEntry]
+        self.keys_by_resource = {}  # type: Dict[str, Set[_CacheKey]]
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, url: str, request: Mapping[str, Any]) -> _CacheKey:
+        return _request_key(url, request)
+
+    def ttl(self, url: str) -> Optional[float]:
+        return self.ttls.get(_endpoint_pattern(url))
+
+    def get(self, url: str, request: Mapping[str, Any]) -> Optional[Dict[str, Any]]:
+        """Returns a copy of the cached response, or None if there is none."""
+        import copy
+
+        key = self._key(url, request)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[0] < time.monotonic():
+                self.keys_by_resource[entry[1]].discard(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries[key] = entry
+            self.hits += 1
+        # Callers may modify the responses they get.
+        return copy.deepcopy(entry[2])
+
+    def put(self, url: str, request: Mapping[str, Any], response: Dict[str, Any]) -> None:
+        import copy
+
+        ttl = self.ttl(url)
+        if ttl is None or response.get("result") != "success":
+            return
+        key = self._key(url, request)
+        resource = _endpoint_resource(_endpoint_pattern(url))
+        response = copy.deepcopy(response)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.monotonic() + ttl, resource, response)
+            self.keys_by_resource.setdefault(resource, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                old_key = next(iter(self.entries))
+                old_resource = self.entries.pop(old_key)[1]
+                self.keys_by_resource[old_resource].discard(old_key)
+
+    def invalidate(self, endpoint: Optional[str] = None) -> None:
+        """
+        Drops the cached responses about the resource `endpoint` (a URL
+        path like "streams/12" or a pattern like "streams/{id}") refers
+        to, e.g. all cached streams and stream IDs for "streams/12";
+        with no endpoint, drops everything.  Client calls this after
+        every successful POST, PATCH or DELETE request.
+        """
+        with self.lock:
+            if endpoint is None:
+                self.entries.clear()
+                self.keys_by_resource.clear()
+                return
+            resource = _endpoint_resource(_endpoint_pattern(endpoint))
+            for key in self.keys_by_resource.pop(resource, ()):
+                self.entries.pop(key, None)
+
+
+class _InFlightRequest:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.waiters = 0
+        self.response = None  # type: Optional[Dict[str, Any]]
+        self.error = None  # type: Optional[BaseException]
+
+
+class _SingleFlight:
+    """
+    Lets concurrent identical requests share one HTTP request: while a
+    request is in flight, callers making the same request wait for it
+    and get a copy of its response (or its exception) instead of
+    making their own.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.in_flight = {}  # type: Dict[_FlightKey, _InFlightRequest]
+
+    def do(self, key: _FlightKey, make_request: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        import copy
+
+        with self.lock:
+            request = self.in_flight.get(key)
+            if request is None:
+                leader = True
+                request = self.in_flight[key] = _InFlightRequest()
+            else:
+                leader = False
+                request.waiters += 1
+
+        if not leader:
+            request.done.wait()
+            if request.error is not None:
+                raise request.error
+            assert request.response is not None
+            # Callers may modify the responses they get.
+            return copy.deepcopy(request.response)
+
+        response = None  # type: Optional[Dict[str, Any]]
+        try:
+            response = make_request()
+            return response
+        except BaseException as e:
+            request.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+                waiters = request.waiters
+            if waiters and response is not None:
+                # The caller may modify the response once we return.
+                request.response = copy.deepcopy(response)
+            request.done.set()
+
+
+class _AsyncInFlightRequest:
+    def __init__(self, task: "asyncio.Future[Dict[str, Any]]") -> None:
+        self.task = task
+        self.waiters = 0
+
+
+def _write_json_atomically(path: str, data: Any) -> None:
+    """Writes `data` as JSON to `path`, such that concurrent readers
+    (and a process restarted after a crash) never see a partially
+    written file."""
+    import tempfile
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
 class ZulipError(Exception):
     pass
 
@@ -371,6 +1142,54 @@ class UnrecoverableNetworkError(ZulipError):
     pass
 
 
+class Transport:
+    """
+    A pool of keep-alive HTTPS connections that many Clients can share,
+    e.g. all the bots run by one process: pass it as their `transport`
+    argument.  Otherwise every Client keeps its own pool, and pays its
+    own TLS handshakes.
+
+    The clients may use different credentials and sites; only the
+    connections are shared, and every request carries the credentials
+    and TLS settings of the client making it.  At most `pool_size`
+    connections are kept open to each server, and to at most
+    `max_hosts` servers; requests beyond that wait for a free
+    connection.  AsyncClient keeps its own pool, and ignores this.
+    """
+
+    def __init__(self, pool_size: int = 10, max_hosts: int = 10) -> None:
+        self.pool_size = pool_size
+        self.max_hosts = max_hosts
+        self.lock = threading.Lock()
+        self._session = None  # type: Optional[requests.Session]
+
+    @property
+    def session(self) -> "requests.Session":
+        with self.lock:
+            if self._session is None:
+                from http.cookiejar import DefaultCookiePolicy
+
+                import requests
+
+                session = requests.Session()
+                # Cookies set by a server for one client must not be sent
+                # with another client's requests.
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=self.max_hosts, pool_maxsize=self.pool_size, pool_block=True
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+            return self._session
+
+    def close(self) -> None:
+        with self.lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
 class Client:
     def __init__(
         self,
@@ -385,6 +1204,15 @@ class Client:
         insecure: Optional[bool] = None,
         client_cert: Optional[str] = None,
         client_cert_key: Optional[str] = None,
+        server_settings_cache: Optional[str] = None,
+        server_settings_cache_ttl: float = 3600.0,
+        max_retries: int = 10,
+        retry_delay_cap: float = 30.0,
+        retry_time_limit: Optional[float] = None,
+        metrics_hook: Optional[Callable[[RequestMetrics], None]] = None,
+        response_cache: Union[bool, ResponseCache] = False,
+        coalesce_requests: bool = False,
+        transport: Optional[Transport] = None,
     ) -> None:
         if client is None:
             client = _default_client()
@@ -407,6 +1235,8 @@ class Client:
             client_cert_key = os.environ.get("ZULIP_CERT_KEY")
         if cert_bundle is None:
             cert_bundle = os.environ.get("ZULIP_CERT_BUNDLE")
+        if server_settings_cache is None:
+            server_settings_cache = os.environ.get("ZULIP_SERVER_SETTINGS_CACHE")
         if insecure is None:
             # Be quite strict about what is accepted so that users don't
             # disable security unintentionally.
@@ -425,6 +1255,8 @@ class Client:
             config_file = get_default_config_filename()
 
         if config_file is not None and os.path.exists(config_file):
+            from configparser import ConfigParser
+
             config = ConfigParser()
             with open(config_file) as f:
                 config.read_file(f, config_file)
@@ -440,6 +1272,8 @@ class Client:
                 client_cert_key = config.get("api", "client_cert_key")
             if cert_bundle is None and config.has_option("api", "cert_bundle"):
                 cert_bundle = config.get("api", "cert_bundle")
+            if server_settings_cache is None and config.has_option("api", "server_settings_cache"):
+                server_settings_cache = config.get("api", "server_settings_cache")
             if insecure is None and config.has_option("api", "insecure"):
                 # Be quite strict about what is accepted so that users don't
                 # disable security unintentionally.
@@ -479,6 +1313,28 @@ class Client:
             self.base_url += "/api"
         self.base_url += "/"
         self.retry_on_errors = retry_on_errors
+        # How requests failing with a server or connection error are
+        # retried; see do_api_query.
+        self.max_retries = max_retries
+        self.retry_delay_cap = retry_delay_cap
+        self.retry_time_limit = retry_time_limit
+        self._rate_limiter = _RateLimiter()
+        # Called with a RequestMetrics after every API request.
+        self.metrics_hook = metrics_hook
+        # Opt-in, since callers might rely on seeing changes made by
+        # other clients immediately.
+        if response_cache is True:
+            response_cache = ResponseCache()
+        self.response_cache = response_cache or None  # type: Optional[ResponseCache]
+        # Concurrent identical GET requests share one HTTP request.
+        # Opt-in too, since a request may then get the response of one
+        # made before the caller's own last write.
+        self._single_flight = _SingleFlight() if coalesce_requests else None
+        # The number of successful writes to each resource (see
+        # _endpoint_resource), so that GET requests made before a write
+        # are neither joined by ones made after it nor cached.
+        self._write_generations = {}  # type: Dict[str, int]
+        self._write_lock = threading.Lock()
         self.client_name = client
 
         if insecure:
@@ -511,14 +1367,86 @@ class Client:
         self.client_cert = client_cert
         self.client_cert_key = client_cert_key
 
+        self.transport = transport
         self.session = None  # type: Optional[requests.Session]
+        # Passed with every request; used to apply the client's
+        # credentials to a session shared through a Transport.
+        self.session_request_kwargs = {}  # type: Dict[str, Any]
+        self.connection_pool_size = 0
 
         self.has_connected = False
 
-        server_settings = self.get_server_settings()
-        self.zulip_version: Optional[str] = server_settings.get("zulip_version")
-        self.feature_level: int = server_settings.get("zulip_feature_level", 0)
-        assert self.zulip_version is not None
+        # The server settings handshake costs a round trip, so it is
+        # only done once something actually needs the server's version.
+        if server_settings_cache is not None:
+            server_settings_cache = os.path.abspath(os.path.expanduser(server_settings_cache))
+        self.server_settings_cache = server_settings_cache
+        self.server_settings_cache_ttl = server_settings_cache_ttl
+        self._server_settings = None  # type: Optional[Dict[str, Any]]
+
+    @property
+    def server_settings(self) -> Dict[str, Any]:
+        if self._server_settings is None:
+            self.ensure_server_settings()
+        assert self._server_settings is not None
+        return self._server_settings
+
+    @property
+    def zulip_version(self) -> Optional[str]:
+        return self.server_settings.get("zulip_version")
+
+    @property
+    def feature_level(self) -> int:
+        return self.server_settings.get("zulip_feature_level", 0)
+
+    def ensure_server_settings(self) -> None:
+        if self._server_settings is not None:
+            return
+        server_settings = self._read_server_settings_cache()
+        if server_settings is None:
+            server_settings = self.get_server_settings()
+            assert server_settings.get("zulip_version") is not None
+            self._write_server_settings_cache(server_settings)
+        self._server_settings = server_settings
+
+    def _server_settings_cache_path(self) -> Optional[str]:
+        if self.server_settings_cache is None:
+            return None
+        import hashlib
+
+        site_hash = hashlib.sha256(self.base_url.encode()).hexdigest()[:16]
+        return os.path.join(self.server_settings_cache, f"server_settings_{site_hash}.json")
+
+    def _read_server_settings_cache(self) -> Optional[Dict[str, Any]]:
+        cache_path = self._server_settings_cache_path()
+        if cache_path is None:
+            return None
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached["base_url"] != self.base_url:
+                return None
+            if time.time() - cached["fetched_at"] > self.server_settings_cache_ttl:
+                return None
+            return cached["server_settings"]
+        except (OSError, ValueError, KeyError, TypeError):
+            # The cache is only an optimization; any problem reading
+            # it just means we ask the server again.
+            return None
+
+    def _write_server_settings_cache(self, server_settings: Dict[str, Any]) -> None:
+        cache_path = self._server_settings_cache_path()
+        if cache_path is None:
+            return
+        cached = {
+            "base_url": self.base_url,
+            "fetched_at": time.time(),
+            "server_settings": server_settings,
+        }
+        try:
+            _write_json_atomically(cache_path, cached)
+        except OSError:
+            logger.warning("Could not write server settings cache %s", cache_path)
 
     def ensure_session(self) -> None:
 
@@ -527,6 +1455,8 @@ class Client:
         if self.session:
             return
 
+        import requests
+
         # Build a client cert object for requests
         if self.client_cert_key is not None:
             assert self.client_cert is not None  # Otherwise ZulipError near end of __init__
@@ -537,6 +1467,17 @@ class Client:
         else:
             client_cert = self.client_cert
 
+        if self.transport is not None:
+            self.session = self.transport.session
+            self.session_request_kwargs = {
+                "auth": requests.auth.HTTPBasicAuth(self.email, self.api_key),
+                "verify": self.tls_verification,
+                "cert": client_cert,
+                "headers": {"User-agent": self.get_user_agent()},
+            }
+            self.connection_pool_size = self.transport.pool_size
+            return
+
         # Actually construct the session
         session = requests.Session()
         session.auth = requests.auth.HTTPBasicAuth(self.email, self.api_key)
@@ -544,31 +1485,40 @@ class Client:
         session.cert = client_cert
         session.headers.update({"User-agent": self.get_user_agent()})
         self.session = session
+        self.connection_pool_size = requests.adapters.DEFAULT_POOLSIZE
 
-    def get_user_agent(self) -> str:
-        vendor = ""
-        vendor_version = ""
-        try:
-            vendor = platform.system()
-            vendor_version = platform.release()
-        except OSError:
-            # If the calling process is handling SIGCHLD, platform.system() can
-            # fail with an IOError.  See http://bugs.python.org/issue9127
-            pass
+    def ensure_connection_pool_size(self, pool_size: int) -> None:
+        # requests keeps at most 10 idle connections per host by default;
+        # concurrent callers beyond that would each pay a new handshake.
+        self.ensure_session()
+        assert self.session is not None
+        if pool_size <= self.connection_pool_size or self.transport is not None:
+            # A Transport's pool size is shared, so it is the Transport's to set.
+            return
+        import requests
 
-        if vendor == "Linux":
-            vendor, vendor_version, dummy = distro.linux_distribution()
-        elif vendor == "Windows":
-            vendor_version = platform.win32_ver()[1]
-        elif vendor == "Darwin":
-            vendor_version = platform.mac_ver()[0]
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.connection_pool_size = pool_size
 
+    def get_user_agent(self) -> str:
+        vendor, vendor_version = _get_platform_version()
         return "{client_name} ({vendor}; {vendor_version})".format(
             client_name=self.client_name,
             vendor=vendor,
             vendor_version=vendor_version,
         )
 
+    def _retry_backoff(self, **kwargs: Any) -> RandomExponentialBackoff:
+        # Retries used to be silent; the delays are only logged as
+        # warnings for verbose clients.
+        return RandomExponentialBackoff(
+            delay_cap=self.retry_delay_cap,
+            log_level=logging.WARNING if self.verbose else logging.DEBUG,
+            **kwargs,
+        )
+
     def do_api_query(
         self,
         orig_request: Mapping[str, Any],
@@ -590,29 +1540,30 @@ class Client:
             # Otherwise, 15s should be plenty of time.
             request_timeout = 15.0 if not timeout else timeout
 
-        request = {}
+        request = marshal_request(orig_request)
         req_files = []
 
-        for (key, val) in orig_request.items():
-            if isinstance(val, str) or isinstance(val, str):
-                request[key] = val
-            else:
-                request[key] = json.dumps(val)
-
         for f in files:
             req_files.append((f.name, f))
 
         self.ensure_session()
         assert self.session is not None
+        import requests
 
         query_state = {
             "had_error_retry": False,
             "request": request,
-            "failures": 0,
+            "attempts": 0,
+            "rate_limited": 0,
         }  # type: Dict[str, Any]
+        # Randomized, so that many clients that lose the server at the
+        # same time don't all come back at the same time.
+        backoff = self._retry_backoff(
+            maximum_retries=self.max_retries, time_limit=self.retry_time_limit
+        )
 
         def error_retry(error_string: str) -> bool:
-            if not self.retry_on_errors or query_state["failures"] >= 10:
+            if not self.retry_on_errors or not backoff.keep_going():
                 return False
             if self.verbose:
                 if not query_state["had_error_retry"]:
@@ -628,9 +1579,9 @@ class Client:
                     sys.stdout.write(".")
                 sys.stdout.flush()
             query_state["request"]["dont_block"] = json.dumps(True)
-            time.sleep(1)
-            query_state["failures"] += 1
-            return True
+            backoff.fail()
+            # Don't retry if the sleep used up the rest of the time limit.
+            return backoff.time_remaining() != 0
 
         def end_error_retry(succeeded: bool) -> None:
             if query_state["had_error_retry"] and self.verbose:
@@ -639,82 +1590,159 @@ class Client:
                 else:
                     print("Failed!")
 
-        while True:
-            try:
-                if method == "GET":
-                    kwarg = "params"
-                else:
-                    kwarg = "data"
-
-                kwargs = {kwarg: query_state["request"]}
-
-                if files:
-                    kwargs["files"] = req_files
-
-                # Actually make the request!
-                res = self.session.request(
-                    method,
-                    urllib.parse.urljoin(self.base_url, url),
-                    timeout=request_timeout,
-                    **kwargs,
-                )
-
-                self.has_connected = True
-
-                # On 50x errors, try again after a short sleep
-                if str(res.status_code).startswith("5"):
-                    if error_retry(f" (server {res.status_code})"):
+        start_time = time.monotonic()
+        try:
+            while True:
+                try:
+                    if method == "GET":
+                        kwarg = "params"
+                    else:
+                        kwarg = "data"
+
+                    kwargs = {kwarg: query_state["request"]}
+
+                    if files:
+                        kwargs["files"] = req_files
+
+                    # Don't let a retry run past the time limit.
+                    attempt_timeout = request_timeout
+                    time_remaining = backoff.time_remaining()
+                    if time_remaining is not None and not longpolling:
+                        attempt_timeout = min(request_timeout, time_remaining)
+
+                    delay = self._rate_limiter.reserve()
+                    while delay > 0:
+                        time.sleep(delay)
+                        delay = self._rate_limiter.reserve()
+
+                    # Actually make the request!
+                    query_state["attempts"] += 1
+                    try:
+                        res = self.session.request(
+                            method,
+                            urllib.parse.urljoin(self.base_url, url),
+                            timeout=attempt_timeout,
+                            **self.session_request_kwargs,
+                            **kwargs,
+                        )
+                    except BaseException:
+                        self._rate_limiter.finish(None)
+                        raise
+                    self._rate_limiter.finish(res.headers)
+                    query_state["response"] = res
+
+                    self.has_connected = True
+
+                    # If we were rate-limited anyway (e.g. by requests from
+                    # another process), wait as long as the server asks.
+                    if res.status_code == 429 and self.retry_on_errors:
+                        try:
+                            json_result = get_json_codec().loads(res.content)
+                        except Exception:
+                            json_result = None
+                        retry_after = _retry_after(res.headers, json_result)
+                        self._rate_limiter.hit_limit(retry_after)
+                        # Give up after as many tries as for errors.
+                        query_state["rate_limited"] += 1
+                        time_remaining = backoff.time_remaining()
+                        if query_state["rate_limited"] <= self.max_retries and (
+                            time_remaining is None or retry_after < time_remaining
+                        ):
+                            continue
+
+                    # On 50x errors, try again after a short sleep
+                    if str(res.status_code).startswith("5"):
+                        if error_retry(f" (server {res.status_code})"):
+                            continue
+                        # Otherwise fall through and process the python-requests error normally
+                except (requests.exceptions.Timeout, requests.exceptions.SSLError) as e:
+                    # Timeouts are either a Timeout or an SSLError; we
+                    # want the later exception handlers to deal with any
+                    # non-timeout other SSLErrors
+                    if (
+                        isinstance(e, requests.exceptions.SSLError)
+                        and str(e) != "The read operation timed out"
+                    ):
+                        raise UnrecoverableNetworkError("SSL Error")
+                    if longpolling:
+                        # When longpolling, we expect the timeout to fire,
+                        # and the correct response is to just retry
+                        continue
+                    else:
+                        end_error_retry(False)
+                        raise
+                except requests.exceptions.ConnectionError:
+                    if not self.has_connected:
+                        # If we have never successfully connected to the server, don't
+                        # go into retry logic, because the most likely scenario here is
+                        # that somebody just hasn't started their server, or they passed
+                        # in an invalid site.
+                        raise UnrecoverableNetworkError("cannot connect to server " + self.base_url)
+
+                    if error_retry(""):
                         continue
-                    # Otherwise fall through and process the python-requests error normally
-            except (requests.exceptions.Timeout, requests.exceptions.SSLError) as e:
-                # Timeouts are either a Timeout or an SSLError; we
-                # want the later exception handlers to deal with any
-                # non-timeout other SSLErrors
-                if (
-                    isinstance(e, requests.exceptions.SSLError)
-                    and str(e) != "The read operation timed out"
-                ):
-                    raise UnrecoverableNetworkError("SSL Error")
-                if longpolling:
-                    # When longpolling, we expect the timeout to fire,
-                    # and the correct response is to just retry
-                    continue
-                else:
                     end_error_retry(False)
                     raise
-            except requests.exceptions.ConnectionError:
-                if not self.has_connected:
-                    # If we have never successfully connected to the server, don't
-                    # go into retry logic, because the most likely scenario here is
-                    # that somebody just hasn't started their server, or they passed
-                    # in an invalid site.
-                    raise UnrecoverableNetworkError("cannot connect to server " + self.base_url)
-
-                if error_retry(""):
-                    continue
+                except Exception:
+                    # We'll split this out into more cases as we encounter new bugs.
+                    raise
+
+                try:
+                    json_result = get_json_codec().loads(res.content)
+                except Exception:
+                    json_result = None
+
+                if json_result is not None:
+                    end_error_retry(True)
+                    return json_result
                 end_error_retry(False)
-                raise
-            except Exception:
-                # We'll split this out into more cases as we encounter new bugs.
-                raise
+                return {
+                    "msg": "Unexpected error from the server",
+                    "result": "http-error",
+                    "status_code": res.status_code,
+                }
+        finally:
+            if self.metrics_hook is not None:
+                response = query_state.get("response")
+                self._report_request_metrics(
+                    method,
+                    url,
+                    status_code=None if response is None else response.status_code,
+                    start_time=start_time,
+                    attempts=query_state["attempts"],
+                    request_bytes=_request_size(request, files),
+                    response_bytes=0 if response is None else len(response.content),
+                    longpolling=longpolling,
+                )
 
-            try:
-                if requests_json_is_function:
-                    json_result = res.json()
-                else:
-                    json_result = res.json
-            except Exception:
-                json_result = None
-
-            if json_result is not None:
-                end_error_retry(True)
-                return json_result
-            end_error_retry(False)
-            return {
-                "msg": "Unexpected error from the server",
-                "result": "http-error",
-                "status_code": res.status_code,
-            }
+    def _report_request_metrics(
+        self,
+        method: str,
+        url: str,
+        *,
+        status_code: Optional[int],
+        start_time: float,
+        attempts: int,
+        request_bytes: int,
+        response_bytes: int,
+        longpolling: bool,
+    ) -> None:
+        assert self.metrics_hook is not None
+        metrics = RequestMetrics(
+            method=method,
+            endpoint=_endpoint_pattern(url),
+            status_code=status_code,
+            duration=time.monotonic() - start_time,
+            retries=max(attempts - 1, 0),
+            request_bytes=request_bytes,
+            response_bytes=response_bytes,
+            longpolling=longpolling,
+        )
+        try:
+            self.metrics_hook(metrics)
+        except Exception:
+            # Instrumentation must never break the request itself.
+            logger.exception("Error in metrics hook")
 
     def call_endpoint(
         self,
@@ -732,26 +1760,224 @@ class Client:
             if v is not None:
                 marshalled_request[k] = v
         versioned_url = API_VERSTRING + (url if url is not None else "")
-        return self.do_api_query(
-            marshalled_request,
-            versioned_url,
-            method=method,
-            longpolling=longpolling,
-            files=files,
-            timeout=timeout,
-        )
+
+        cache = self.response_cache
+        if cache is not None and method == "GET" and not longpolling:
+            cached = cache.get(versioned_url, marshalled_request)
+            if cached is not None:
+                return cached
+
+        def make_request() -> Dict[str, Any]:
+            return self.do_api_query(
+                marshalled_request,
+                versioned_url,
+                method=method,
+                longpolling=longpolling,
+                files=files,
+                timeout=timeout,
+            )
+
+        generation = self._write_generation(versioned_url)
+        if self._single_flight is not None and method == "GET" and not longpolling:
+            key = (_request_key(versioned_url, marshalled_request), generation)
+            result = self._single_flight.do(key, make_request)
+        else:
+            result = make_request()
+        if not longpolling:
+            self._record_response(versioned_url, marshalled_request, method, generation, result)
+        return result
+
+    def _write_generation(self, url: str) -> int:
+        return self._write_generations.get(_endpoint_resource(_endpoint_pattern(url)), 0)
+
+    def _record_response(
+        self,
+        url: str,
+        request: Dict[str, Any],
+        method: str,
+        generation: int,
+        response: Dict[str, Any],
+    ) -> None:
+        # Caches GET responses, unless the resource was written to while
+        # the request was in flight, and invalidates the cache on writes.
+        resource = _endpoint_resource(_endpoint_pattern(url))
+        cache = self.response_cache
+        with self._write_lock:
+            current = self._write_generations.get(resource, 0)
+            if method == "GET":
+                if cache is not None and current == generation:
+                    cache.put(url, request, response)
+            elif response.get("result") == "success":
+                self._write_generations[resource] = current + 1
+                if cache is not None:
+                    cache.invalidate(url)
 
     def call_on_each_event(
         self,
         callback: Callable[[Dict[str, Any]], None],
         event_types: Optional[List[str]] = None,
         narrow: Optional[List[List[str]]] = None,
-        **kwargs: object,
+        *,
+        dispatch_workers: int = 0,
+        max_pending_events: int = 100,
+        dispatch_key: Callable[[Dict[str, Any]], Hashable] = event_dispatch_key,
+        resume_missed_messages: bool = False,
+        checkpoint_file: Optional[str] = None,
+        on_register: Optional[Callable[[Dict[str, Any]], None]] = None,
+        compact_events: bool = False,
+        **kwargs: Any,
     ) -> None:
+        """
+        Registers an event queue and calls `callback` on every event
+        received from it, forever. Other keyword arguments are passed to
+        register(). If given, `on_register` is called with the
+        register() response each time a queue is registered, before any
+        of its events are handled (e.g. RealmState.apply_register, to
+        seed state that the events then keep current).
+
+        By default the callback runs inline, so a slow callback delays
+        the next long-poll. With dispatch_workers > 0, events are handed
+        to that many worker threads instead: events with the same
+        dispatch_key (by default, the same stream topic or private
+        conversation; see event_dispatch_key) are still handled one at a
+        time and in order, and edits and deletions of a message are
+        handled in order after the message itself. At most
+        max_pending_events events are queued or running at once; beyond
+        that, polling waits for the workers to catch up. An exception
+        raised by the callback stops the loop and is re-raised here.
+
+        If the event queue expires (e.g. after a long network outage), a
+        new one is registered; events sent in between are lost. With
+        resume_missed_messages=True, the message events among them are
+        recovered instead: the messages sent after the last one seen are
+        fetched with get_messages and passed to the callback as
+        synthesized message events (with an "id" of -1) before any
+        events from the new queue, giving at-least-once delivery of
+        messages. Other event types are still lost.
+
+        With checkpoint_file set, the event queue's ID and the ID of the
+        last event handled are saved to that file after each batch of
+        events, and a restarted process picks up the saved queue where
+        it left off instead of registering a new one; a new queue is
+        only registered if the server no longer has the saved one
+        (combine with resume_missed_messages to recover the messages
+        sent in the meantime). Events are only checkpointed once the
+        callback has returned, except with dispatch_workers > 0, where
+        events still queued for the workers when the process dies are
+        lost. With on_register, the saved queue is never picked up,
+        since the register() response its events apply to is gone: a new
+        queue is registered for on_register to get the current state,
+        and only resume_missed_messages resumes from the saved position.
+
+        With compact_events=True, the callback is passed
+        zulip.events.Event objects (holding zulip.events.Message
+        objects) instead of dicts; they support the same item access but
+        take about half the memory, for callbacks that keep many events
+        around.
+        """
+        import requests
+
         if narrow is None:
             narrow = []
 
+        dispatcher = None
+        if dispatch_workers > 0:
+            dispatcher = _KeyedEventDispatcher(
+                callback, dispatch_key, dispatch_workers, max_pending_events
+            )
+            callback = dispatcher.submit
+        if compact_events:
+            # Before dispatch, so that the events queued for the workers
+            # are compact too.
+            callback = _compact_event_callback(callback)
+
+        # The newest message passed to the callback, and the messages
+        # fetched by the last backfill, which the new queue may repeat.
+        last_message_id = None  # type: Optional[int]
+        backfilled_message_ids = set()  # type: Set[int]
+
+        queue_id = None  # type: Optional[str]
+        last_event_id = -1
+        # A checkpoint is only reused by a loop watching the same events;
+        # round-trip through JSON so that it compares equal to the saved one.
+        checkpoint_key = json.loads(
+            json.dumps(
+                {
+                    "base_url": self.base_url,
+                    "email": self.email,
+                    "event_types": event_types,
+                    "narrow": narrow,
+                }
+            )
+        )
+        if checkpoint_file is not None:
+            checkpoint_file = os.path.abspath(os.path.expanduser(checkpoint_file))
+            try:
+                with open(checkpoint_file) as f:
+                    checkpoint = json.load(f)
+                if checkpoint["key"] == checkpoint_key:
+                    last_message_id = checkpoint["last_message_id"]
+                    # on_register needs the state that the saved queue's
+                    # events apply to, which can't be fetched again; so
+                    # it gets a new queue, with the current state.
+                    if on_register is None:
+                        queue_id = checkpoint["queue_id"]
+                        last_event_id = checkpoint["last_event_id"]
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, KeyError, TypeError):
+                logger.warning("Ignoring unreadable event queue checkpoint %s", checkpoint_file)
+
+        def save_checkpoint() -> None:
+            if checkpoint_file is None:
+                return
+            checkpoint = {
+                "key": checkpoint_key,
+                "queue_id": queue_id,
+                "last_event_id": last_event_id,
+                "last_message_id": last_message_id,
+            }
+            try:
+                _write_json_atomically(checkpoint_file, checkpoint)
+            except OSError:
+                logger.warning("Could not write event queue checkpoint %s", checkpoint_file)
+
+        def backfill_messages(after_id: int, through_id: int) -> Set[int]:
+            delivered = set()
+            anchor = after_id + 1
+            while anchor <= through_id:
+                res = self.get_messages(
+                    {
+                        "anchor": anchor,
+                        "num_before": 0,
+                        "num_after": 1000,
+                        "narrow": narrow,
+                        "apply_markdown": kwargs.get("apply_markdown", False),
+                        "client_gravatar": kwargs.get("client_gravatar", False),
+                    }
+                )
+                if res["result"] != "success":
+                    logger.warning("Could not fetch missed messages: %s", res.get("msg"))
+                    break
+                for message in res["messages"]:
+                    if message["id"] > through_id:
+                        # Newer messages are delivered by the new queue.
+                        break
+                    flags = message.pop("flags", [])
+                    callback({"type": "message", "id": -1, "message": message, "flags": flags})
+                    delivered.add(message["id"])
+                if res.get("found_newest") or not res["messages"]:
+                    break
+                anchor = res["messages"][-1]["id"] + 1
+            return delivered
+
+        # The loop never gives up, so only the delay cap applies; the
+        # randomized delays keep many clients polling the same server
+        # from all reconnecting at the same moment after it restarts.
+        backoff = self._retry_backoff()
+
         def do_register() -> Tuple[str, int]:
+            nonlocal last_message_id, backfilled_message_ids
 
             while True:
                 if event_types is None:
@@ -761,72 +1987,91 @@ class Client:
                 if "error" in res["result"]:
                     if self.verbose:
                         print("Server returned error:\n{}".format(res["msg"]))
-                    time.sleep(1)
-                else:
-                    return (res["queue_id"], res["last_event_id"])
-
-        queue_id = None
-        # Make long-polling requests with `get_events`. Once a request
-        # has received an answer, pass it to the callback and before
-        # making a new long-polling request.
-        while True:
-            if queue_id is None:
-                (queue_id, last_event_id) = do_register()
+                    backoff.fail()
+                    continue
+                backoff.succeed()
+                if on_register is not None:
+                    on_register(res)
 
-            try:
-                res = self.get_events(queue_id=queue_id, last_event_id=last_event_id)
-            except (
-                requests.exceptions.Timeout,
-                requests.exceptions.SSLError,
-                requests.exceptions.ConnectionError,
-            ):
-                if self.verbose:
-                    print(f"Connection error fetching events:\n{traceback.format_exc()}")
-                # TODO: Make this use our backoff library
-                time.sleep(1)
-                continue
-            except Exception:
-                print(f"Unexpected error:\n{traceback.format_exc()}")
-                # TODO: Make this use our backoff library
-                time.sleep(1)
-                continue
+                max_message_id = res.get("max_message_id")
+                if resume_missed_messages and max_message_id is not None:
+                    if last_message_id is not None and last_message_id < max_message_id:
+                        backfilled_message_ids = backfill_messages(last_message_id, max_message_id)
+                    last_message_id = max(last_message_id or 0, max_message_id)
+                return (res["queue_id"], res["last_event_id"])
 
-            if "error" in res["result"]:
-                if res["result"] == "http-error":
-                    if self.verbose:
-                        print("HTTP error fetching events -- probably a server restart")
-                else:
+        try:
+            # Make long-polling requests with `get_events`. Once a request
+            # has received an answer, pass it to the callback and before
+            # making a new long-polling request.
+            while True:
+                if queue_id is None:
+                    (queue_id, last_event_id) = do_register()
+                    save_checkpoint()
+
+                try:
+                    res = self.get_events(queue_id=queue_id, last_event_id=last_event_id)
+                except (
+                    requests.exceptions.Timeout,
+                    requests.exceptions.SSLError,
+                    requests.exceptions.ConnectionError,
+                ):
                     if self.verbose:
-                        print("Server returned error:\n{}".format(res["msg"]))
-                    # Eventually, we'll only want the
-                    # BAD_EVENT_QUEUE_ID check, but we check for the
-                    # old string to support legacy Zulip servers.  We
-                    # should remove that legacy check in 2019.
-                    if res.get("code") == "BAD_EVENT_QUEUE_ID" or res["msg"].startswith(
-                        "Bad event queue id:"
-                    ):
-                        # Our event queue went away, probably because
-                        # we were asleep or the server restarted
-                        # abnormally.  We may have missed some
-                        # events while the network was down or
-                        # something, but there's not really anything
-                        # we can do about it other than resuming
-                        # getting new ones.
-                        #
-                        # Reset queue_id to register a new event queue.
-                        queue_id = None
-                # Add a pause here to cover against potential bugs in this library
-                # causing a DoS attack against a server when getting errors.
-                # TODO: Make this back off exponentially.
-                time.sleep(1)
-                continue
+                        print(f"Connection error fetching events:\n{traceback.format_exc()}")
+                    backoff.fail()
+                    continue
+                except Exception:
+                    print(f"Unexpected error:\n{traceback.format_exc()}")
+                    backoff.fail()
+                    continue
 
-            for event in res["events"]:
-                last_event_id = max(last_event_id, int(event["id"]))
-                callback(event)
+                if "error" in res["result"]:
+                    if res["result"] == "http-error":
+                        if self.verbose:
+                            print("HTTP error fetching events -- probably a server restart")
+                    else:
+                        if self.verbose:
+                            print("Server returned error:\n{}".format(res["msg"]))
+                        # Eventually, we'll only want the
+                        # BAD_EVENT_QUEUE_ID check, but we check for the
+                        # old string to support legacy Zulip servers.  We
+                        # should remove that legacy check in 2019.
+                        if res.get("code") == "BAD_EVENT_QUEUE_ID" or res["msg"].startswith(
+                            "Bad event queue id:"
+                        ):
+                            # Our event queue went away, probably because
+                            # we were asleep or the server restarted
+                            # abnormally.  We may have missed some
+                            # events while the network was down or
+                            # something, but there's not really anything
+                            # we can do about it other than resuming
+                            # getting new ones.
+                            #
+                            # Reset queue_id to register a new event queue.
+                            queue_id = None
+                    # Add a pause here to cover against potential bugs in this library
+                    # causing a DoS attack against a server when getting errors.
+                    backoff.fail()
+                    continue
+                backoff.succeed()
+
+                for event in res["events"]:
+                    last_event_id = max(last_event_id, int(event["id"]))
+                    if resume_missed_messages and event["type"] == "message":
+                        message_id = event["message"]["id"]
+                        if message_id in backfilled_message_ids:
+                            continue
+                        last_message_id = max(last_message_id or 0, message_id)
+                    callback(event)
+                if res["events"]:
+                    save_checkpoint()
+        finally:
+            if dispatcher is not None:
+                dispatcher.shutdown()
+                dispatcher.check()
 
     def call_on_each_message(
-        self, callback: Callable[[Dict[str, Any]], None], **kwargs: object
+        self, callback: Callable[[Dict[str, Any]], None], **kwargs: Any
     ) -> None:
         def event_callback(event: Dict[str, Any]) -> None:
             if event["type"] == "message":
@@ -840,6 +2085,68 @@ class Client:
         """
         return self.call_endpoint(url="messages", method="GET", request=message_filters)
 
+    def iter_messages(
+        self,
+        narrow: Optional[List[Any]] = None,
+        anchor: Union[int, str, None] = None,
+        batch_size: int = 1000,
+        direction: Literal["older", "newer"] = "older",
+        prefetch: bool = True,
+        **request: Any,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the messages matching `narrow`, fetching them with
+        get_messages `batch_size` at a time, starting at `anchor` and
+        going in `direction`: newest first for "older", oldest first
+        for "newer".  The anchor is a message ID, "newest", "oldest" or
+        "first_unread", and defaults to the end of the history that
+        `direction` leads away from.  Other keyword arguments (e.g.
+        apply_markdown) are passed on to get_messages.
+
+        With prefetch, the next page is requested in the background
+        while the caller handles the current one.  Raises ZulipError if
+        a page can't be fetched.
+
+        Example usage:
+
+        >>> for message in client.iter_messages([["stream", "devel"]], direction="newer"):
+        ...     print(message["content"])
+        """
+        if direction not in ("older", "newer"):
+            raise ValueError(f"direction must be 'older' or 'newer', not {direction!r}")
+        if anchor is None:
+            anchor = "newest" if direction == "older" else "oldest"
+        if narrow is None:
+            narrow = []
+
+        def fetch(anchor: Union[int, str]) -> Dict[str, Any]:
+            assert narrow is not None
+            return self.get_messages(
+                _message_page_request(narrow, anchor, batch_size, direction, request)
+            )
+
+        executor = None
+        if prefetch:
+            from concurrent.futures import ThreadPoolExecutor
+
+            executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            page = fetch(anchor)
+            while True:
+                next_anchor = _next_message_anchor(page, direction)
+                next_page = None
+                if next_anchor is not None and executor is not None:
+                    next_page = executor.submit(fetch, next_anchor)
+                messages = page["messages"]
+                yield from (reversed(messages) if direction == "older" else messages)
+                if next_anchor is None:
+                    return
+                page = next_page.result() if next_page is not None else fetch(next_anchor)
+        finally:
+            if executor is not None:
+                # Don't wait for a prefetch the caller no longer needs.
+                executor.shutdown(wait=False)
+
     def check_messages_match_narrow(self, **request: Dict[str, Any]) -> Dict[str, Any]:
 
         """
@@ -867,6 +2174,39 @@ class Client:
             request=message_data,
         )
 
+    def send_messages(
+        self, messages: Iterable[Dict[str, Any]], max_in_flight: int = 8
+    ) -> List[Dict[str, Any]]:
+        """
+        Sends many messages over one pooled session, keeping up to
+        `max_in_flight` requests outstanding instead of waiting a full
+        round trip per message.  Messages to the same recipient may be
+        delivered out of order when max_in_flight > 1.
+
+        Returns the send_message responses in input order.
+
+        Example usage:
+
+        >>> client.send_messages([{'type': 'stream', 'to': 'devel', 'topic': 'logs', 'content': line}
+                                  for line in lines], max_in_flight=16)
+        [{'result': 'success', 'msg': '', 'id': 42}, ...]
+        """
+        results = {}  # type: Dict[int, Dict[str, Any]]
+        for index, result in self.iter_send_messages(messages, max_in_flight=max_in_flight):
+            results[index] = result
+        return [results[index] for index in range(len(results))]
+
+    def iter_send_messages(
+        self, messages: Iterable[Dict[str, Any]], max_in_flight: int = 8
+    ) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Like send_messages, but yields (index, response) pairs as the
+        sends complete.  `messages` is consumed lazily, so it may be an
+        arbitrarily long generator.
+        """
+        self.ensure_connection_pool_size(max_in_flight)
+        return _map_with_bounded_concurrency(self.send_message, messages, max_in_flight)
+
     def upload_file(self, file: IO[Any]) -> Dict[str, Any]:
         """
         See examples/upload-file for example usage.
@@ -892,17 +2232,103 @@ class Client:
             request=message_data,
         )
 
-    def delete_message(self, message_id: int) -> Dict[str, Any]:
-        """
-        See examples/delete-message for example usage.
+    def delete_message(self, message_id: int) -> Dict[str, Any]:
+        """
+        See examples/delete-message for example usage.
+        """
+        return self.call_endpoint(url=f"messages/{message_id}", method="DELETE")
+
+    def update_message_flags(self, update_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        See examples/update-flags for example usage.
+        """
+        return self.call_endpoint(url="messages/flags", method="POST", request=update_data)
+
+    def update_message_flags_in_bulk(
+        self,
+        op: Literal["add", "remove"],
+        flag: ModifiableMessageFlag,
+        *,
+        messages: Optional[Iterable[int]] = None,
+        narrow: Optional[List[Any]] = None,
+        batch_size: int = 1000,
+        max_in_flight: int = 4,
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Adds or removes a flag on any number of messages: those with the
+        IDs in `messages` (which may be a generator), or all those
+        matching `narrow`.  The work is split into requests of at most
+        `batch_size` messages, so that none of them times out, and up
+        to `max_in_flight` of these run at once.  If given, `progress`
+        is called with the number of messages processed so far after
+        each request.
+
+        Narrows are processed oldest message first.  Servers with
+        feature level 155 or later do this themselves, one batch at a
+        time; older ones only take lists of IDs, so the matching
+        messages are fetched first, with iter_messages.
+
+        Returns a summary like {'result': 'success', 'msg': '',
+        'processed_count': 5000, 'updated_count': 4890,
+        'failed_messages': []}.  A batch that fails doesn't stop the
+        others when updating by ID: the IDs it had are returned in
+        failed_messages, and 'result' is 'error'.
+
+        Example usage:
+
+        >>> client.update_message_flags_in_bulk("add", "read", narrow=[["stream", "logs"]])
+        {'result': 'success', 'msg': '', 'processed_count': 120000, ...}
         """
-        return self.call_endpoint(url=f"messages/{message_id}", method="DELETE")
+        if (messages is None) == (narrow is None):
+            raise TypeError("Pass either messages or narrow")
+        update = _BulkFlagUpdate(progress)
 
-    def update_message_flags(self, update_data: Dict[str, Any]) -> Dict[str, Any]:
+        if narrow is not None:
+            if self.feature_level >= 155:
+                anchor = "oldest"  # type: Union[int, str]
+                while True:
+                    response = self.call_endpoint(
+                        url="messages/flags/narrow",
+                        request=_flags_narrow_request(op, flag, narrow, anchor, batch_size),
+                    )
+                    if not update.add_narrow_batch(response):
+                        return update.result()
+                    anchor = response["last_processed_id"]
+            messages = (
+                message["id"]
+                for message in self.iter_messages(
+                    narrow,
+                    anchor="oldest",
+                    batch_size=batch_size,
+                    direction="newer",
+                    apply_markdown=False,
+                )
+            )
+        assert messages is not None
+
+        def update_batch(message_ids: List[int]) -> Tuple[List[int], Dict[str, Any]]:
+            request = {"messages": message_ids, "op": op, "flag": flag}
+            return (message_ids, self.update_message_flags(request))
+
+        self.ensure_connection_pool_size(max_in_flight)
+        for _, (message_ids, response) in _map_with_bounded_concurrency(
+            update_batch, _chunks(messages, batch_size), max_in_flight
+        ):
+            update.add_batch(message_ids, response)
+        return update.result()
+
+    def mark_narrow_as_read(self, narrow: List[Any], **kwargs: Any) -> Dict[str, Any]:
         """
-        See examples/update-flags for example usage.
+        Marks all the messages matching `narrow` as read, in batches;
+        see update_message_flags_in_bulk for the keyword arguments.
+
+        Example usage:
+
+        >>> client.mark_narrow_as_read([["stream", "alerts"], ["sender", "nagios-bot@example.com"]])
+        {'result': 'success', 'msg': '', 'processed_count': 3120, 'updated_count': 3120, ...}
         """
-        return self.call_endpoint(url="messages/flags", method="POST", request=update_data)
+        return self.update_message_flags_in_bulk("add", "read", narrow=narrow, **kwargs)
 
     def mark_all_as_read(self) -> Dict[str, Any]:
         """
@@ -1742,25 +3168,798 @@ class Client:
         )
 
 
+# Options of Client.call_on_each_event that AsyncClient's lacks.
+_SYNC_ONLY_EVENT_LOOP_OPTIONS = frozenset(
+    [
+        "dispatch_workers",
+        "max_pending_events",
+        "dispatch_key",
+        "resume_missed_messages",
+        "checkpoint_file",
+    ]
+)
+
+
+class AsyncClient(Client):
+    """
+    An asyncio variant of Client, backed by a pooled aiohttp session.
+
+    Every endpoint method of Client is available, but returns an
+    awaitable instead of the decoded response, so many requests can be
+    in flight at once without a thread per request.  Requires the
+    `aiohttp` package.
+
+    Example usage:
+
+    >>> async with zulip.AsyncClient(config_file="~/zuliprc") as client:
+    ...     await client.send_message({"type": "private", "to": [9], "content": "hi"})
+    {'result': 'success', 'msg': '', 'id': 42}
+    """
+
+    def __init__(self, *args: Any, max_connections: int = 100, **kwargs: Any) -> None:
+        self.max_connections = max_connections
+        self.async_session = None  # type: Optional[aiohttp.ClientSession]
+        self._in_flight_requests = {}  # type: Dict[_FlightKey, _AsyncInFlightRequest]
+        super().__init__(*args, **kwargs)
+
+    @property
+    def server_settings(self) -> Dict[str, Any]:
+        # Fetching server settings needs a running event loop, so the
+        # properties cannot fetch them lazily like Client does.
+        if self._server_settings is None:
+            raise ZulipError(
+                "Server settings not fetched yet; await client.ensure_server_settings() first."
+            )
+        return self._server_settings
+
+    async def ensure_server_settings(self) -> None:  # type: ignore[override] # Coroutine variant
+        if self._server_settings is not None:
+            return
+        server_settings = self._read_server_settings_cache()
+        if server_settings is None:
+            server_settings = await self.get_server_settings()
+            assert server_settings.get("zulip_version") is not None
+            self._write_server_settings_cache(server_settings)
+        self._server_settings = server_settings
+
+    async def ensure_async_session(self) -> "aiohttp.ClientSession":
+        if self.async_session is not None and not self.async_session.closed:
+            return self.async_session
+
+        import ssl
+
+        try:
+            import aiohttp
+        except ImportError:
+            raise ZulipError(
+                "zulip.AsyncClient requires the aiohttp package; run `pip install aiohttp`."
+            )
+
+        if self.tls_verification is False:
+            ssl_context = False  # type: Union[bool, ssl.SSLContext]
+        else:
+            cafile = self.tls_verification if isinstance(self.tls_verification, str) else None
+            ssl_context = ssl.create_default_context(cafile=cafile)
+            if self.client_cert is not None:
+                ssl_context.load_cert_chain(self.client_cert, self.client_cert_key)
+
+        credentials = base64.b64encode(f"{self.email}:{self.api_key}".encode()).decode()
+        connector = aiohttp.TCPConnector(limit=self.max_connections, ssl=ssl_context)
+        self.async_session = aiohttp.ClientSession(
+            connector=connector,
+            headers={
+                "Authorization": "Basic " + credentials,
+                "User-agent": self.get_user_agent(),
+            },
+        )
+        return self.async_session
+
+    async def close(self) -> None:
+        if self.async_session is not None:
+            await self.async_session.close()
+            self.async_session = None
+
+    async def __aenter__(self) -> "AsyncClient":
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.close()
+
+    async def do_api_query(  # type: ignore[override] # Coroutine variant of Client.do_api_query
+        self,
+        orig_request: Mapping[str, Any],
+        url: str,
+        method: str = "POST",
+        longpolling: bool = False,
+        files: Optional[List[IO[Any]]] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        import asyncio
+
+        import aiohttp
+
+        if files is None:
+            files = []
+
+        if longpolling:
+            request_timeout = 90.0
+        else:
+            request_timeout = 15.0 if not timeout else timeout
+
+        request = marshal_request(orig_request)
+        session = await self.ensure_async_session()
+        backoff = self._retry_backoff(
+            maximum_retries=self.max_retries, time_limit=self.retry_time_limit
+        )
+
+        async def error_retry(error_string: str) -> bool:
+            if not self.retry_on_errors or not backoff.keep_going():
+                return False
+            if self.verbose:
+                print(
+                    "zulip API({}): connection error{} -- retrying.".format(
+                        url.split(API_VERSTRING, 2)[0], error_string
+                    )
+                )
+            request["dont_block"] = json.dumps(True)
+            await asyncio.sleep(backoff.fail_without_sleeping())
+            return backoff.time_remaining() != 0
+
+        start_time = time.monotonic()
+        attempts = 0
+        rate_limited = 0
+        status_code = None  # type: Optional[int]
+        response_bytes = 0
+        try:
+            while True:
+                kwargs = {}  # type: Dict[str, Any]
+                if method == "GET":
+                    kwargs["params"] = request
+                elif files:
+                    form = aiohttp.FormData(request)
+                    for f in files:
+                        form.add_field(f.name, f, filename=os.path.basename(f.name))
+                    kwargs["data"] = form
+                else:
+                    kwargs["data"] = request
+
+                attempt_timeout = request_timeout
+                time_remaining = backoff.time_remaining()
+                if time_remaining is not None and not longpolling:
+                    attempt_timeout = min(request_timeout, time_remaining)
+
+                delay = self._rate_limiter.reserve()
+                while delay > 0:
+                    await asyncio.sleep(delay)
+                    delay = self._rate_limiter.reserve()
+
+                finished = False
+                attempts += 1
+                try:
+                    async with session.request(
+                        method,
+                        urllib.parse.urljoin(self.base_url, url),
+                        timeout=aiohttp.ClientTimeout(total=attempt_timeout),
+                        **kwargs,
+                    ) as res:
+                        self._rate_limiter.finish(res.headers)
+                        finished = True
+                        status_code = res.status
+                        self.has_connected = True
+
+                        if res.status == 429 and self.retry_on_errors:
+                            try:
+                                json_result = get_json_codec().loads(await res.read())
+                            except Exception:
+                                json_result = None
+                            retry_after = _retry_after(res.headers, json_result)
+                            self._rate_limiter.hit_limit(retry_after)
+                            rate_limited += 1
+                            time_remaining = backoff.time_remaining()
+                            if rate_limited <= self.max_retries and (
+                                time_remaining is None or retry_after < time_remaining
+                            ):
+                                continue
+
+                        # On 50x errors, try again after a short sleep
+                        if res.status >= 500 and await error_retry(f" (server {res.status})"):
+                            continue
+
+                        try:
+                            json_result = get_json_codec().loads(await res.read())
+                        except Exception:
+                            json_result = None
+                        if self.metrics_hook is not None:
+                            response_bytes = len(await res.read())
+                except asyncio.TimeoutError:
+                    if longpolling:
+                        # When longpolling, we expect the timeout to fire,
+                        # and the correct response is to just retry
+                        continue
+                    raise
+                except aiohttp.ClientSSLError:
+                    raise UnrecoverableNetworkError("SSL Error")
+                except aiohttp.ClientConnectionError:
+                    if not self.has_connected:
+                        raise UnrecoverableNetworkError("cannot connect to server " + self.base_url)
+                    if await error_retry(""):
+                        continue
+                    raise
+                finally:
+                    if not finished:
+                        self._rate_limiter.finish(None)
+
+                if json_result is not None:
+                    return json_result
+                return {
+                    "msg": "Unexpected error from the server",
+                    "result": "http-error",
+                    "status_code": res.status,
+                }
+        finally:
+            if self.metrics_hook is not None:
+                self._report_request_metrics(
+                    method,
+                    url,
+                    status_code=status_code,
+                    start_time=start_time,
+                    attempts=attempts,
+                    request_bytes=_request_size(request, files),
+                    response_bytes=response_bytes,
+                    longpolling=longpolling,
+                )
+
+    async def call_endpoint(  # type: ignore[override] # Coroutine variant of Client.call_endpoint
+        self,
+        url: Optional[str] = None,
+        method: str = "POST",
+        request: Optional[Dict[str, Any]] = None,
+        longpolling: bool = False,
+        files: Optional[List[IO[Any]]] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        if request is None:
+            request = dict()
+        marshalled_request = {k: v for (k, v) in request.items() if v is not None}
+        versioned_url = API_VERSTRING + (url if url is not None else "")
+
+        cache = self.response_cache
+        if cache is not None and method == "GET" and not longpolling:
+            cached = cache.get(versioned_url, marshalled_request)
+            if cached is not None:
+                return cached
+
+        def make_request() -> Awaitable[Dict[str, Any]]:
+            return self.do_api_query(
+                marshalled_request,
+                versioned_url,
+                method=method,
+                longpolling=longpolling,
+                files=files,
+                timeout=timeout,
+            )
+
+        generation = self._write_generation(versioned_url)
+        if self._single_flight is not None and method == "GET" and not longpolling:
+            key = (_request_key(versioned_url, marshalled_request), generation)
+            result = await self._coalesce_request(key, make_request)
+        else:
+            result = await make_request()
+        if not longpolling:
+            self._record_response(versioned_url, marshalled_request, method, generation, result)
+        return result
+
+    async def _coalesce_request(
+        self, key: _FlightKey, make_request: Callable[[], Awaitable[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        # The async counterpart of _SingleFlight.do.
+        import asyncio
+        import copy
+
+        request = self._in_flight_requests.get(key)
+        if request is not None:
+            request.waiters += 1
+            # Shielded, so that cancelling one caller doesn't cancel the
+            # request for the others.
+            return copy.deepcopy(await asyncio.shield(request.task))
+
+        request = _AsyncInFlightRequest(asyncio.ensure_future(make_request()))
+        self._in_flight_requests[key] = request
+        # Runs before any caller resumes, so no caller joins a finished
+        # request, and request.waiters is final once we resume.
+        request.task.add_done_callback(lambda task: self._in_flight_requests.pop(key, None))
+        response = await asyncio.shield(request.task)
+        if request.waiters:
+            # The others copy the response after we return it.
+            return copy.deepcopy(response)
+        return response
+
+    # The endpoints below are used by AsyncClient itself or are hot
+    # enough to deserve precise typing; every other endpoint is
+    # inherited from Client and returns the coroutine from call_endpoint.
+
+    async def get_server_settings(self) -> Dict[str, Any]:  # type: ignore[override] # Coroutine variant
+        return await self.call_endpoint(url="server_settings", method="GET")
+
+    async def register(  # type: ignore[override] # Coroutine variant of Client.register
+        self,
+        event_types: Optional[Iterable[str]] = None,
+        narrow: Optional[List[List[str]]] = None,
+        **kwargs: object,
+    ) -> Dict[str, Any]:
+        if narrow is None:
+            narrow = []
+        request = dict(event_types=event_types, narrow=narrow, **kwargs)
+        return await self.call_endpoint(url="register", request=request)
+
+    async def get_events(self, **request: Any) -> Dict[str, Any]:  # type: ignore[override] # Coroutine variant
+        return await self.call_endpoint(
+            url="events", method="GET", longpolling=True, request=request
+        )
+
+    async def get_messages(self, message_filters: Dict[str, Any]) -> Dict[str, Any]:  # type: ignore[override] # Coroutine variant
+        return await self.call_endpoint(url="messages", method="GET", request=message_filters)
+
+    async def iter_messages(  # type: ignore[override] # Async generator variant of Client.iter_messages
+        self,
+        narrow: Optional[List[Any]] = None,
+        anchor: Union[int, str, None] = None,
+        batch_size: int = 1000,
+        direction: Literal["older", "newer"] = "older",
+        prefetch: bool = True,
+        **request: Any,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        import asyncio
+
+        if direction not in ("older", "newer"):
+            raise ValueError(f"direction must be 'older' or 'newer', not {direction!r}")
+        if anchor is None:
+            anchor = "newest" if direction == "older" else "oldest"
+        if narrow is None:
+            narrow = []
+
+        async def fetch(anchor: Union[int, str]) -> Dict[str, Any]:
+            assert narrow is not None
+            return await self.get_messages(
+                _message_page_request(narrow, anchor, batch_size, direction, request)
+            )
+
+        next_page = None  # type: Optional[asyncio.Future[Dict[str, Any]]]
+        try:
+            page = await fetch(anchor)
+            while True:
+                next_anchor = _next_message_anchor(page, direction)
+                if next_anchor is not None and prefetch:
+                    next_page = asyncio.ensure_future(fetch(next_anchor))
+                messages = page["messages"]
+                for message in reversed(messages) if direction == "older" else messages:
+                    yield message
+                if next_anchor is None:
+                    return
+                if next_page is not None:
+                    page = await next_page
+                    next_page = None
+                else:
+                    page = await fetch(next_anchor)
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
+    async def send_message(self, message_data: Dict[str, Any]) -> Dict[str, Any]:  # type: ignore[override] # Coroutine variant
+        return await self.call_endpoint(url="messages", request=message_data)
+
+    async def send_messages(  # type: ignore[override] # Coroutine variant of Client.send_messages
+        self, messages: Iterable[Dict[str, Any]], max_in_flight: int = 8
+    ) -> List[Dict[str, Any]]:
+        results = {}  # type: Dict[int, Dict[str, Any]]
+        async for index, result in self.iter_send_messages(messages, max_in_flight=max_in_flight):
+            results[index] = result
+        return [results[index] for index in range(len(results))]
+
+    async def iter_send_messages(  # type: ignore[override] # Async generator variant
+        self, messages: Iterable[Dict[str, Any]], max_in_flight: int = 8
+    ) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        async for index, result in _amap_with_bounded_concurrency(
+            self.send_message, messages, max_in_flight
+        ):
+            yield index, result
+
+    async def update_message(self, message_data: Dict[str, Any]) -> Dict[str, Any]:  # type: ignore[override] # Coroutine variant
+        return await self.call_endpoint(
+            url="messages/%d" % (message_data["message_id"],),
+            method="PATCH",
+            request=message_data,
+        )
+
+    async def update_message_flags_in_bulk(  # type: ignore[override] # Coroutine variant
+        self,
+        op: Literal["add", "remove"],
+        flag: ModifiableMessageFlag,
+        *,
+        messages: Optional[Iterable[int]] = None,
+        narrow: Optional[List[Any]] = None,
+        batch_size: int = 1000,
+        max_in_flight: int = 4,
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> Dict[str, Any]:
+        if (messages is None) == (narrow is None):
+            raise TypeError("Pass either messages or narrow")
+        update = _BulkFlagUpdate(progress)
+
+        async def update_batch(message_ids: List[int]) -> Tuple[List[int], Dict[str, Any]]:
+            request = {"messages": message_ids, "op": op, "flag": flag}
+            return (message_ids, await self.call_endpoint(url="messages/flags", request=request))
+
+        if narrow is not None:
+            await self.ensure_server_settings()
+            if self.feature_level >= 155:
+                anchor = "oldest"  # type: Union[int, str]
+                while True:
+                    response = await self.call_endpoint(
+                        url="messages/flags/narrow",
+                        request=_flags_narrow_request(op, flag, narrow, anchor, batch_size),
+                    )
+                    if not update.add_narrow_batch(response):
+                        return update.result()
+                    anchor = response["last_processed_id"]
+            # The IDs come from an async generator here, so each batch
+            # is updated as soon as its messages have been fetched.
+            batch = []  # type: List[int]
+            async for message in self.iter_messages(
+                narrow,
+                anchor="oldest",
+                batch_size=batch_size,
+                direction="newer",
+                apply_markdown=False,
+            ):
+                batch.append(message["id"])
+                if len(batch) == batch_size:
+                    update.add_batch(*await update_batch(batch))
+                    batch = []
+            if batch:
+                update.add_batch(*await update_batch(batch))
+            return update.result()
+
+        assert messages is not None
+        async for _, (message_ids, response) in _amap_with_bounded_concurrency(
+            update_batch, _chunks(messages, batch_size), max_in_flight
+        ):
+            update.add_batch(message_ids, response)
+        return update.result()
+
+    async def get_stream_id(self, stream: str) -> Dict[str, Any]:  # type: ignore[override] # Coroutine variant
+        stream_encoded = urllib.parse.quote(stream, safe="")
+        return await self.call_endpoint(url=f"get_stream_id?stream={stream_encoded}", method="GET")
+
+    async def call_on_each_event(  # type: ignore[override] # Coroutine variant of Client.call_on_each_event
+        self,
+        callback: Callable[[Dict[str, Any]], Any],
+        event_types: Optional[List[str]] = None,
+        narrow: Optional[List[List[str]]] = None,
+        *,
+        on_register: Optional[Callable[[Dict[str, Any]], None]] = None,
+        compact_events: bool = False,
+        **kwargs: object,
+    ) -> None:
+        """
+        Like Client.call_on_each_event, but `callback` may also be a
+        coroutine function, in which case each call is awaited before
+        the next event is handled.  Client.call_on_each_event's
+        dispatch, resume and checkpoint options aren't supported.
+        """
+        unsupported = sorted(_SYNC_ONLY_EVENT_LOOP_OPTIONS.intersection(kwargs))
+        if unsupported:
+            # Rather than passing them on to register().
+            raise TypeError(
+                "AsyncClient.call_on_each_event() does not support {}".format(
+                    ", ".join(unsupported)
+                )
+            )
+
+        import asyncio
+        import inspect
+
+        import aiohttp
+
+        if narrow is None:
+            narrow = []
+        if compact_events:
+            callback = _compact_event_callback(callback)
+
+        backoff = self._retry_backoff()
+
+        async def do_register() -> Tuple[str, int]:
+            while True:
+                if event_types is None:
+                    res = await self.register(None, None, **kwargs)
+                else:
+                    res = await self.register(event_types, narrow, **kwargs)
+                if "error" in res["result"]:
+                    if self.verbose:
+                        print("Server returned error:\n{}".format(res["msg"]))
+                    await asyncio.sleep(backoff.fail_without_sleeping())
+                else:
+                    backoff.succeed()
+                    if on_register is not None:
+                        on_register(res)
+                    return (res["queue_id"], res["last_event_id"])
+
+        queue_id = None
+        while True:
+            if queue_id is None:
+                (queue_id, last_event_id) = await do_register()
+
+            try:
+                res = await self.get_events(queue_id=queue_id, last_event_id=last_event_id)
+            except (asyncio.TimeoutError, aiohttp.ClientError):
+                if self.verbose:
+                    print(f"Connection error fetching events:\n{traceback.format_exc()}")
+                await asyncio.sleep(backoff.fail_without_sleeping())
+                continue
+
+            if "error" in res["result"]:
+                if self.verbose:
+                    print("Server returned error:\n{}".format(res["msg"]))
+                if res.get("code") == "BAD_EVENT_QUEUE_ID":
+                    queue_id = None
+                await asyncio.sleep(backoff.fail_without_sleeping())
+                continue
+            backoff.succeed()
+
+            for event in res["events"]:
+                last_event_id = max(last_event_id, int(event["id"]))
+                result = callback(event)
+                if inspect.isawaitable(result):
+                    await result
+
+    async def call_on_each_message(  # type: ignore[override] # Coroutine variant of Client.call_on_each_message
+        self, callback: Callable[[Dict[str, Any]], Any], **kwargs: Any
+    ) -> None:
+        import inspect
+
+        async def event_callback(event: Dict[str, Any]) -> None:
+            if event["type"] == "message":
+                result = callback(event["message"])
+                if inspect.isawaitable(result):
+                    await result
+
+        await self.call_on_each_event(event_callback, ["message"], None, **kwargs)
+
+    async def update_user_by_id(self, user_id: int, **request: Any) -> Dict[str, Any]:  # type: ignore[override] # Coroutine variant
+        await self.ensure_server_settings()
+        return await super().update_user_by_id(user_id, **request)  # type: ignore[misc] # Returns a coroutine here
+
+    async def get_subscribers(self, **request: Any) -> Dict[str, Any]:  # type: ignore[override] # Coroutine variant
+        response = await self.get_stream_id(request["stream"])
+        if response["result"] == "error":
+            return response
+
+        stream_id = response["stream_id"]
+        return await self.call_endpoint(
+            url="streams/%d/members" % (stream_id,),
+            method="GET",
+            request=request,
+        )
+
+    async def move_topic(  # type: ignore[override] # Coroutine variant of Client.move_topic
+        self,
+        stream: str,
+        new_stream: str,
+        topic: str,
+        new_topic: Optional[str] = None,
+        message_id: Optional[int] = None,
+        propagate_mode: EditPropagateMode = "change_all",
+        notify_old_topic: bool = True,
+        notify_new_topic: bool = True,
+    ) -> Dict[str, Any]:
+        result = await self.get_stream_id(stream)
+        if result["result"] != "success":
+            return result
+        stream_id = result["stream_id"]
+
+        result = await self.get_stream_id(new_stream)
+        if result["result"] != "success":
+            return result
+        new_stream_id = result["stream_id"]
+
+        if message_id is None:
+            if propagate_mode != "change_all":
+                raise AttributeError(
+                    "A message_id must be provided if " 'propagate_mode isn\'t "change_all"'
+                )
+
+            result = await self.get_messages(
+                {
+                    "anchor": "newest",
+                    "narrow": [
+                        {"operator": "stream", "operand": stream_id},
+                        {"operator": "topic", "operand": topic},
+                    ],
+                    "num_before": 1,
+                    "num_after": 0,
+                }
+            )
+            if result["result"] != "success":
+                return result
+            if len(result["messages"]) <= 0:
+                return {"result": "error", "msg": f'No messages found in topic: "{topic}"'}
+            message_id = result["messages"][0]["id"]
+
+        request = {
+            "stream_id": new_stream_id,
+            "propagate_mode": propagate_mode,
+            "topic": new_topic,
+            "send_notification_to_old_thread": notify_old_topic,
+            "send_notification_to_new_thread": notify_new_topic,
+        }
+        return await self.call_endpoint(
+            url=f"messages/{message_id}",
+            method="PATCH",
+            request=request,
+        )
+
+
 class ZulipStream:
     """
-    A Zulip stream-like object
+    A Zulip stream-like object, e.g. for logging.StreamHandler.
+
+    Writes are buffered and sent together, as one message (or as few
+    as fit in `max_message_length` characters), once `flush_interval`
+    seconds have passed since the first unsent write or `buffer_size`
+    characters are waiting, whichever comes first, and on flush() and
+    close().  Output still unsent when the interpreter exits is sent
+    then.  logging.StreamHandler calls flush() after every record, so
+    use a ZulipStreamHandler to send log records in batches instead.
     """
 
-    def __init__(self, type: str, to: str, subject: str, **kwargs: Any) -> None:
+    def __init__(
+        self,
+        type: str,
+        to: str,
+        subject: str,
+        *,
+        flush_interval: Optional[float] = 1.0,
+        buffer_size: int = 4000,
+        max_message_length: int = 10000,
+        **kwargs: Any,
+    ) -> None:
         self.client = Client(**kwargs)
         self.type = type
         self.to = to
         self.subject = subject
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.max_message_length = max_message_length
+        self.closed = False
+        self._buffer = []  # type: List[str]
+        self._buffered = 0
+        self._lock = threading.Lock()
+        # Serializes sends, so that messages arrive in write order.
+        self._send_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flusher = None  # type: Optional[threading.Thread]
+        _open_zulip_streams.add(self)
 
     def write(self, content: str) -> None:
-        message = {"type": self.type, "to": self.to, "subject": self.subject, "content": content}
-        self.client.send_message(message)
+        if not content:
+            return
+        with self._lock:
+            if self.closed:
+                raise ValueError("write to closed ZulipStream")
+            self._buffer.append(content)
+            self._buffered += len(content)
+            full = self._buffered >= self.buffer_size
+            if not full and self.flush_interval is not None:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(
+                        target=self._flush_periodically, name="ZulipStream flusher", daemon=True
+                    )
+                    self._flusher.start()
+                elif len(self._buffer) == 1:
+                    self._wakeup.notify()
+        if full:
+            self._send_buffered()
+
+    def flush(self) -> None:
+        self._send_buffered()
+
+    def _send_buffered(self) -> None:
+        with self._send_lock:
+            with self._lock:
+                content = "".join(self._buffer)
+                self._buffer = []
+                self._buffered = 0
+            for chunk in _split_message_content(content, self.max_message_length):
+                message = {
+                    "type": self.type,
+                    "to": self.to,
+                    "subject": self.subject,
+                    "content": chunk,
+                }
+                try:
+                    result = self.client.send_message(message)
+                except Exception:
+                    logger.exception("Could not send ZulipStream output")
+                    continue
+                if result.get("result") != "success":
+                    logger.warning("Could not send ZulipStream output: %s", result.get("msg"))
+
+    def close(self) -> None:
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._wakeup.notify()
+            flusher = self._flusher
+        _open_zulip_streams.discard(self)
+        if flusher is not None:
+            flusher.join()
+        self._send_buffered()
+
+    def __enter__(self) -> "ZulipStream":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def _flush_periodically(self) -> None:
+        assert self.flush_interval is not None
+        while True:
+            with self._lock:
+                # Sleep until there is something to send, then give
+                # later writes flush_interval to join it.
+                while not self._buffer and not self.closed:
+                    self._wakeup.wait()
+                deadline = time.monotonic() + self.flush_interval
+                while self._buffer and not self.closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._wakeup.wait(remaining)
+                closed = self.closed
+            if closed:
+                # close() sends what is left.
+                return
+            self._send_buffered()
+
+
+class ZulipStreamHandler(logging.StreamHandler):  # type: ignore[type-arg] # Not subscriptable at runtime before Python 3.11
+    """
+    A logging.StreamHandler that leaves it to its ZulipStream when to
+    send, rather than flushing after every record, so that records
+    logged together are sent together.
+    """
 
     def flush(self) -> None:
         pass
 
 
+# Open ZulipStreams, whose unsent output is sent at exit.
+_open_zulip_streams = weakref.WeakSet()  # type: weakref.WeakSet[ZulipStream]
+
+
+@atexit.register
+def _close_zulip_streams() -> None:
+    for stream in list(_open_zulip_streams):
+        stream.close()
+
+
+def _split_message_content(content: str, max_length: int) -> Iterator[str]:
+    # Splits buffered output into messages of at most max_length
+    # characters, at line breaks where possible; whitespace-only
+    # output is dropped, since the server rejects empty messages.
+    while content:
+        if len(content) <= max_length:
+            chunk, content = content, ""
+        else:
+            cut = content.rfind("\n", 0, max_length) + 1
+            if cut == 0:
+                cut = max_length
+            chunk, content = content[:cut], content[cut:]
+        if chunk.strip():
+            yield chunk
+
+
 def hash_util_decode(string: str) -> str:
     """
     Returns a decoded string given a hash_util_encode() [present in zulip/zulip's zerver/lib/url_encoding.py] encoded string.
@@ -0,0 +1,236 @@
+"""
+A local SQLite mirror of the messages matching a narrow, for jobs that
+would otherwise download the same history through the API again and
+again:
+
+    from zulip.archive import MessageArchive
+
+    archive = MessageArchive(client, "devel.sqlite3", narrow=[["stream", "devel"]])
+    archive.sync()  # Fetch all messages not archived yet
+    rows = archive.connection.execute(
+        "SELECT sender_id, COUNT(*) FROM messages GROUP BY sender_id"
+    ).fetchall()
+
+sync() is resumable: it commits after each batch of messages and picks
+up after the newest message archived so far. follow() registers an event
+queue, syncs, and then keeps the archive current from the queue,
+applying new messages, edits, topic moves and deletions as they happen.
+Edits and deletions made while no follow() is running are not picked up
+by a later sync().
+
+Several narrows can be archived into the same database, each with its
+own sync cursor; the messages table is shared between them.
+"""
+
+import json
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from zulip import Client
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    type TEXT NOT NULL,
+    stream_id INTEGER,
+    topic TEXT COLLATE NOCASE,
+    sender_id INTEGER NOT NULL,
+    timestamp INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    -- The message object as returned by the API, as JSON.
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_stream_topic ON messages (stream_id, topic, id);
+CREATE INDEX IF NOT EXISTS messages_sender ON messages (sender_id, id);
+CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp);
+CREATE TABLE IF NOT EXISTS sync_cursors (
+    narrow TEXT PRIMARY KEY,
+    newest_message_id INTEGER NOT NULL
+);
+"""
+
+# The event types follow() needs.
+EVENT_TYPES = ["message", "update_message", "delete_message"]
+
+# Options of Client.call_on_each_event that follow() rejects.
+_UNSUPPORTED_FOLLOW_OPTIONS = frozenset(
+    ["dispatch_workers", "max_pending_events", "dispatch_key", "compact_events"]
+)
+
+
+class MessageArchive:
+    def __init__(self, client: Client, path: str, narrow: Optional[List[List[str]]] = None) -> None:
+        self.client = client
+        self.narrow = narrow if narrow is not None else []
+        self.narrow_key = json.dumps(self.narrow, sort_keys=True)
+        self.connection = sqlite3.connect(path)
+        # Let analytics jobs read the archive while it is being synced.
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def newest_message_id(self) -> Optional[int]:
+        """The sync cursor: the newest message archived for this narrow."""
+        row = self.connection.execute(
+            "SELECT newest_message_id FROM sync_cursors WHERE narrow = ?", (self.narrow_key,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def sync(self, batch_size: int = 1000) -> int:
+        """
+        Archives the messages sent since the newest one archived (all of
+        them, the first time), oldest first, and returns how many there
+        were.
+        """
+        newest_message_id = self.newest_message_id()
+        if newest_message_id is None:
+            anchor = "oldest"  # type: Union[int, str]
+        else:
+            anchor = newest_message_id + 1
+        messages = self.client.iter_messages(
+            self.narrow,
+            anchor=anchor,
+            batch_size=batch_size,
+            direction="newer",
+            apply_markdown=False,
+        )
+        count = 0
+        batch = []  # type: List[Dict[str, Any]]
+        for message in messages:
+            batch.append(message)
+            if len(batch) == batch_size:
+                self.add_messages(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            self.add_messages(batch)
+            count += len(batch)
+        return count
+
+    def add_messages(self, messages: Iterable[Dict[str, Any]]) -> None:
+        """Stores messages, and moves the sync cursor past them, in one transaction."""
+        rows = [self._message_row(message) for message in messages]
+        if not rows:
+            return
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            newest_message_id = max(row[0] for row in rows)
+            self.connection.execute(
+                "INSERT OR IGNORE INTO sync_cursors VALUES (?, ?)",
+                (self.narrow_key, newest_message_id),
+            )
+            self.connection.execute(
+                "UPDATE sync_cursors SET newest_message_id = MAX(newest_message_id, ?)"
+                " WHERE narrow = ?",
+                (newest_message_id, self.narrow_key),
+            )
+
+    def apply_event(self, event: Dict[str, Any]) -> None:
+        """Applies a message, update_message or delete_message event."""
+        if event["type"] == "message":
+            message = dict(event["message"])
+            message["flags"] = event.get("flags", [])
+            self.add_messages([message])
+        elif event["type"] == "update_message":
+            self._apply_update_message_event(event)
+        elif event["type"] == "delete_message":
+            message_ids = event.get("message_ids", [event.get("message_id")])
+            with self.connection:
+                self.connection.executemany(
+                    "DELETE FROM messages WHERE id = ?", [(i,) for i in message_ids]
+                )
+
+    def follow(self, **kwargs: Any) -> None:
+        """
+        Keeps the archive current from the event queue, forever, syncing
+        each time a queue is registered. Keyword arguments are passed to
+        call_on_each_event, except for its dispatch and compact_events
+        options.
+        """
+        unsupported = sorted(_UNSUPPORTED_FOLLOW_OPTIONS.intersection(kwargs))
+        if unsupported:
+            # The connection can only be used from the thread that made
+            # it, and events must be applied in order, as dicts.
+            raise TypeError(
+                "MessageArchive.follow() does not support {}".format(", ".join(unsupported))
+            )
+        on_register = kwargs.pop("on_register", None)
+
+        def sync_after_register(response: Dict[str, Any]) -> None:
+            # Syncing once the queue exists leaves no gap for messages
+            # to be lost in: those sent before it are fetched by sync(),
+            # and the rest arrive as events. A message fetched both
+            # ways is just stored again. This also catches up on the
+            # messages sent while the queue was being replaced (e.g.
+            # after a network outage).
+            self.sync()
+            if on_register is not None:
+                on_register(response)
+
+        self.client.call_on_each_event(
+            self.apply_event,
+            EVENT_TYPES,
+            self.narrow,
+            apply_markdown=False,
+            on_register=sync_after_register,
+            **kwargs,
+        )
+
+    def _message_row(self, message: Dict[str, Any]) -> Tuple[Any, ...]:
+        return (
+            message["id"],
+            message["type"],
+            message.get("stream_id"),
+            message.get("subject"),
+            message["sender_id"],
+            message["timestamp"],
+            message["content"],
+            json.dumps(message),
+        )
+
+    def _apply_update_message_event(self, event: Dict[str, Any]) -> None:
+        message_ids = event.get("message_ids", [event["message_id"]])
+        if "new_stream_id" in event:
+            stream = self._stream_name(event["new_stream_id"])
+        with self.connection:
+            for message_id in message_ids:
+                row = self.connection.execute(
+                    "SELECT message FROM messages WHERE id = ?", (message_id,)
+                ).fetchone()
+                if row is None:
+                    continue
+                message = json.loads(row[0])
+                # Only the edited message itself changes content; a topic
+                # or stream move applies to all of message_ids.
+                if "content" in event and message_id == event["message_id"]:
+                    message["content"] = event["content"]
+                    message["last_edit_timestamp"] = event.get("edit_timestamp")
+                if "subject" in event:
+                    message["subject"] = event["subject"]
+                if "new_stream_id" in event:
+                    message["stream_id"] = event["new_stream_id"]
+                    if stream is not None:
+                        message["display_recipient"] = stream
+                self.connection.execute(
+                    "UPDATE messages SET stream_id = ?, topic = ?, content = ?, message = ?"
+                    " WHERE id = ?",
+                    (
+                        message.get("stream_id"),
+                        message.get("subject"),
+                        message["content"],
+                        json.dumps(message),
+                        message_id,
+                    ),
+                )
+
+    def _stream_name(self, stream_id: int) -> Optional[str]:
+        # Any archived message in the stream knows its name.
+        row = self.connection.execute(
+            "SELECT message FROM messages WHERE stream_id = ? AND type = 'stream' LIMIT 1",
+            (stream_id,),
+        ).fetchone()
+        return None if row is None else json.loads(row[0])["display_recipient"]
@@ -1,16 +1,26 @@
 #!/usr/bin/env python3
+import functools
+import json
 import logging
+import os
 import sys
-from typing import Any, Dict, List
+import time
+from typing import IO, Any, Dict, Iterator, List, Optional, Set, Tuple
 
 import click
 
 import zulip
 
-logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+# stdout is reserved for output, like export's JSON lines.
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
 log = logging.getLogger("zulip-cli")
 
-client = zulip.Client(config_file="~/zuliprc")
+
+@functools.lru_cache(maxsize=None)
+def get_client() -> zulip.Client:
+    # Built on first use, so that `--help` and argument errors don't
+    # need a valid zuliprc.
+    return zulip.Client(config_file="~/zuliprc")
 
 
 @click.group()
@@ -89,10 +99,242 @@ def send_message(recipients: List[str], stream: str, subject: str, message: str)
         )
     else:
         log.info("Sending message to %s... " % message_data["to"])
-    response = client.send_message(message_data)
+    response = get_client().send_message(message_data)
     log_exit(response)
 
 
+def read_send_checkpoint(path: str) -> Tuple[int, Set[int]]:
+    # Returns the number of leading input lines that are done, and the
+    # line numbers after those that are done too.
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return 0, set()
+    return checkpoint["lines_done"], set(checkpoint["also_done"])
+
+
+def write_send_checkpoint(path: str, lines_done: int, also_done: Set[int]) -> None:
+    zulip._write_json_atomically(path, {"lines_done": lines_done, "also_done": sorted(also_done)})
+
+
+@cli.command()
+@click.argument("input", type=click.File("r"), default="-")
+@click.option(
+    "--workers",
+    "-w",
+    default=8,
+    show_default=True,
+    help="How many messages to send at once.",
+)
+@click.option(
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    help="Record progress in this file, and skip the messages it says were sent.",
+)
+@click.option(
+    "--failures",
+    type=click.File("a", lazy=True),
+    help="Append the messages that could not be sent to this file, with the errors.",
+)
+def send_bulk(
+    input: IO[str], workers: int, checkpoint: Optional[str], failures: Optional[IO[str]]
+) -> None:
+    """Sends the messages in a JSONL file (or stdin), one per line.
+
+    Each line is a send_message request, e.g. {"type": "stream", "to":
+    "devel", "topic": "builds", "content": "Build 42 passed"}.  Messages
+    are sent several at a time over one connection pool, so they may
+    arrive out of order.  With --checkpoint, rerunning an interrupted
+    command with the same input picks up where it stopped.  Messages
+    that fail are reported in the --failures file as {"line": ...,
+    "message": ..., "response": ...}, and make the command exit with
+    status 1; they count as done for the checkpoint.
+    """
+    if checkpoint is not None:
+        checkpoint = os.path.abspath(checkpoint)
+        lines_done, also_done = read_send_checkpoint(checkpoint)
+    else:
+        lines_done, also_done = 0, set()
+    # Lines sent by an earlier run.
+    skip_below, skip = lines_done, set(also_done)
+    # The line number and message of each message being sent, by its
+    # index among those sent.
+    in_flight = {}  # type: Dict[int, Tuple[int, Dict[str, Any]]]
+    sent = failed = 0
+
+    def report_failure(line_number: int, message: Any, response: Dict[str, Any]) -> None:
+        nonlocal failed
+        failed += 1
+        log.error("Line %d: %s", line_number + 1, response.get("msg"))
+        if failures is not None:
+            record = {"line": line_number + 1, "message": message, "response": response}
+            failures.write(json.dumps(record) + "\n")
+            failures.flush()
+
+    def mark_done(line_number: int) -> None:
+        nonlocal lines_done
+        also_done.add(line_number)
+        while lines_done in also_done:
+            also_done.remove(lines_done)
+            lines_done += 1
+
+    def messages() -> Iterator[Dict[str, Any]]:
+        index = 0
+        for line_number, line in enumerate(input):
+            if line_number < skip_below or line_number in skip or not line.strip():
+                continue
+            try:
+                message = json.loads(line)
+                if not isinstance(message, dict):
+                    raise ValueError("not a JSON object")
+            except ValueError as e:
+                report_failure(
+                    line_number, line.rstrip("\n"), {"result": "error", "msg": f"Invalid JSON: {e}"}
+                )
+                mark_done(line_number)
+                continue
+            in_flight[index] = (line_number, message)
+            index += 1
+            yield message
+
+    client = get_client()
+    last_saved = time.monotonic()
+    try:
+        for index, response in client.iter_send_messages(messages(), max_in_flight=workers):
+            line_number, message = in_flight.pop(index)
+            if response.get("result") == "success":
+                sent += 1
+            else:
+                report_failure(line_number, message, response)
+            mark_done(line_number)
+            if checkpoint is not None and time.monotonic() - last_saved >= 1:
+                write_send_checkpoint(checkpoint, lines_done, also_done)
+                last_saved = time.monotonic()
+    finally:
+        if checkpoint is not None:
+            write_send_checkpoint(checkpoint, lines_done, also_done)
+        log.info("Sent %d messages, %d failed", sent, failed)
+    exit_on_result("success" if failed == 0 else "error")
+
+
+def read_export_checkpoint(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+@cli.command()
+@click.option(
+    "--narrow",
+    default="[]",
+    show_default=True,
+    help='The messages to export, as a JSON narrow, e.g. \'[["stream", "devel"]]\'.',
+)
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False, allow_dash=True),
+    default="-",
+    help="Write the messages to this file instead of stdout.",
+)
+@click.option(
+    "--fields",
+    help="Only export these message fields, e.g. id,sender_email,timestamp,content.",
+)
+@click.option(
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    help="Record progress in this file, and continue after the last message it records.",
+)
+@click.option("--batch-size", default=1000, show_default=True, help="Messages per request.")
+@click.option(
+    "--rendered",
+    is_flag=True,
+    help="Export the messages' rendered HTML instead of their Markdown source.",
+)
+def export(
+    narrow: str,
+    output: str,
+    fields: Optional[str],
+    checkpoint: Optional[str],
+    batch_size: int,
+    rendered: bool,
+) -> None:
+    """Exports the messages matching a narrow as JSON lines, oldest first.
+
+    Messages are written as they are fetched (the next batch is fetched
+    while the current one is written), so memory use doesn't grow with
+    the export.  With --checkpoint, rerunning an interrupted export
+    continues after the last message written; when exporting to a file,
+    the file is first truncated to where the checkpoint was saved, so
+    no message is written twice.
+    """
+    try:
+        narrow_terms = json.loads(narrow)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--narrow")
+    field_names = [field.strip() for field in fields.split(",")] if fields else None
+    dumps = zulip.get_json_codec().dumps
+
+    state = None
+    if checkpoint is not None:
+        checkpoint = os.path.abspath(checkpoint)
+        state = read_export_checkpoint(checkpoint)
+        if state is not None and state["narrow"] != narrow_terms:
+            raise click.UsageError(f"{checkpoint} is a checkpoint of another narrow")
+    last_message_id = state["last_message_id"] if state is not None else None
+    exported = state["exported"] if state is not None else 0
+
+    if output == "-":
+        out = sys.stdout
+    elif state is not None and state["output_offset"] is not None:
+        out = open(output, "r+")
+        out.seek(state["output_offset"])
+        out.truncate()
+    else:
+        out = open(output, "a" if state is not None else "w")
+
+    def save_checkpoint() -> None:
+        if checkpoint is None:
+            return
+        out.flush()
+        zulip._write_json_atomically(
+            checkpoint,
+            {
+                "narrow": narrow_terms,
+                "last_message_id": last_message_id,
+                "exported": exported,
+                "output_offset": out.tell() if out is not sys.stdout else None,
+            },
+        )
+
+    messages = get_client().iter_messages(
+        narrow_terms,
+        anchor="oldest" if last_message_id is None else last_message_id + 1,
+        batch_size=batch_size,
+        direction="newer",
+        apply_markdown=rendered,
+    )
+    try:
+        for message in messages:
+            message_id = message["id"]
+            if field_names is not None:
+                message = {field: message[field] for field in field_names if field in message}
+            out.write(dumps(message) + "\n")
+            last_message_id = message_id
+            exported += 1
+            if exported % batch_size == 0:
+                save_checkpoint()
+    finally:
+        save_checkpoint()
+        if out is not sys.stdout:
+            out.close()
+        click.echo(f"Exported {exported} messages", err=True)
+
+
 @cli.command()
 def upload_file() -> None:
     """Upload a single file and get the corresponding URI."""
@@ -108,7 +350,7 @@ def update_message(message_id: int, message: str) -> None:
         "message_id": message_id,
         "content": message,
     }
-    response = client.update_message(request)
+    response = get_client().update_message(request)
     log_exit(response)
 
 
@@ -116,7 +358,7 @@ def update_message(message_id: int, message: str) -> None:
 @click.argument("message_id", type=int)
 def delete_message(message_id: int) -> None:
     """Permanently delete a message."""
-    response = client.delete_message(message_id)
+    response = get_client().delete_message(message_id)
     log_exit(response)
 
 
@@ -135,7 +377,7 @@ def add_reaction(message_id: int, emoji_name: str) -> None:
         "emoji_name": emoji_name,
     }
 
-    response = client.add_reaction(request)
+    response = get_client().add_reaction(request)
     log_exit(response)
 
 
@@ -149,7 +391,7 @@ def remove_reaction(message_id: int, emoji_name: str) -> None:
         "emoji_name": emoji_name,
     }
 
-    response = client.remove_reaction(request)
+    response = get_client().remove_reaction(request)
     log_exit(response)
 
 
@@ -165,7 +407,7 @@ def get_message_history(message_id: int) -> None:
     """Fetch the message edit history of a previously edited message.
     Note that edit history may be disabled in some organizations; see https://zulip.com/help/view-a-messages-edit-history.
     """
-    response = client.get_message_history(message_id)
+    response = get_client().get_message_history(message_id)
     log_exit(response)
 
 
@@ -176,7 +418,7 @@ def get_message_history(message_id: int) -> None:
 @cli.command()
 def mark_all_as_read() -> None:
     """Marks all of the current user's unread messages as read."""
-    response = client.mark_all_as_read()
+    response = get_client().mark_all_as_read()
     log_exit(response)
 
 
@@ -186,7 +428,7 @@ def mark_all_as_read() -> None:
 @cli.command()
 def get_subscriptions() -> None:
     """Get all streams that the user is subscribed to."""
-    response = client.get_subscriptions()
+    response = get_client().get_subscriptions()
     log_exit(response)
 
 
@@ -0,0 +1,213 @@
+"""
+Compact, read-mostly stand-ins for the event and message dicts that
+call_on_each_event passes to its callback, for consumers that hold on
+to many of them (e.g. buffering a long catch-up):
+
+    def handle_event(event):
+        if event.type == "message":
+            buffer.append(event.message)  # or event["message"]
+
+    client.call_on_each_event(handle_event, ["message"], compact_events=True)
+
+Event and Message keep the common fields in __slots__ rather than a
+per-object dict, share one copy of strings that repeat from message to
+message (sender names, topics, ...), and keep the bulky fields
+(content, reactions, display_recipient, ...) JSON-encoded until one of
+them is first read.  They support the same item access as the dicts
+they replace, so existing callbacks keep working; to_dict() returns a
+plain dict, e.g. to serialize one.
+"""
+
+import sys
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    Iterator,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from zulip import get_json_codec
+
+
+class _CompactMapping(MutableMapping[str, Any]):
+    __slots__ = ("_extra",)
+
+    # The keys stored in slots of the same name, in iteration order;
+    # subclasses declare them as annotated attributes.
+    _fields = ()  # type: Tuple[str, ...]
+    _field_set = frozenset()  # type: FrozenSet[str]
+    # Those of them whose string values should be interned.
+    _interned_fields = frozenset()  # type: FrozenSet[str]
+    # Those of them that are decoded on first use.
+    _lazy_fields = frozenset()  # type: FrozenSet[str]
+
+    def __init_subclass__(cls) -> None:
+        cls._field_set = frozenset(cls._fields)
+
+    def __init__(self, data: Mapping[str, Any]) -> None:
+        extra = None  # type: Optional[Dict[str, Any]]
+        for key, value in data.items():
+            if key in self._field_set:
+                if key in self._interned_fields and isinstance(value, str):
+                    value = sys.intern(value)
+                setattr(self, key, value)
+            else:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+        self._extra = extra
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in self._field_set:
+            if key in self._lazy_fields:
+                self._materialize()
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key in self._field_set:
+            if key in self._lazy_fields:
+                self._materialize()
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        else:
+            if self._extra is None:
+                raise KeyError(key)
+            del self._extra[key]
+
+    def __iter__(self) -> Iterator[str]:
+        self._materialize()
+        for key in self._fields:
+            if hasattr(self, key):
+                yield key
+        if self._extra is not None:
+            yield from list(self._extra)
+
+    def __len__(self) -> int:
+        return sum(1 for key in self)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            key: value.to_dict() if isinstance(value, _CompactMapping) else value
+            for key, value in self.items()
+        }
+
+    def _materialize(self) -> None:
+        pass
+
+
+class Message(_CompactMapping):
+    id: int
+    type: str
+    sender_id: int
+    sender_email: str
+    sender_full_name: str
+    sender_realm_str: str
+    recipient_id: int
+    stream_id: int
+    subject: str
+    timestamp: int
+    last_edit_timestamp: int
+    client: str
+    avatar_url: Optional[str]
+    content_type: str
+    is_me_message: bool
+    flags: List[str]
+    # The fields below are decoded on first use.
+    content: str
+    rendered_content: str
+    display_recipient: Union[str, List[Dict[str, Any]]]
+    reactions: List[Dict[str, Any]]
+    submessages: List[Dict[str, Any]]
+    topic_links: List[Dict[str, str]]
+    edit_history: List[Dict[str, Any]]
+
+    _fields = tuple(__annotations__)
+    _interned_fields = frozenset(
+        [
+            "type",
+            "sender_email",
+            "sender_full_name",
+            "sender_realm_str",
+            "subject",
+            "client",
+            "avatar_url",
+            "content_type",
+        ]
+    )
+    _lazy_fields = frozenset(_fields[_fields.index("content") :])
+
+    __slots__ = _fields + ("_encoded",)
+
+    def __init__(self, data: Mapping[str, Any]) -> None:
+        lazy = {}  # type: Dict[str, Any]
+        rest = {}  # type: Dict[str, Any]
+        for key, value in data.items():
+            if key in self._lazy_fields:
+                lazy[key] = value
+            else:
+                rest[key] = value
+        super().__init__(rest)
+        # As bytes, which take a byte per character even when the
+        # content isn't ASCII.
+        self._encoded = None  # type: Optional[bytes]
+        if lazy:
+            self._encoded = get_json_codec().dumps(lazy).encode()
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for unset slots; decode the lazy fields on the
+        # first read of one of them.
+        if name in self._lazy_fields and self._encoded is not None:
+            self._materialize()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def _materialize(self) -> None:
+        encoded = self._encoded
+        if encoded is not None:
+            self._encoded = None
+            for key, value in get_json_codec().loads(encoded).items():
+                setattr(self, key, value)
+
+
+class Event(_CompactMapping):
+    id: int
+    type: str
+    op: str
+    message: Message
+    flags: List[str]
+
+    _fields = tuple(__annotations__)
+    _interned_fields = frozenset(["type", "op"])
+
+    __slots__ = _fields
+
+    def __init__(self, data: Mapping[str, Any]) -> None:
+        message = data.get("message")
+        if isinstance(message, dict):
+            data = dict(data, message=Message(message))
+        super().__init__(data)
@@ -0,0 +1,134 @@
+"""
+A metrics hook for zulip.Client that aggregates request metrics and
+exports them in the Prometheus text format:
+
+    from zulip.metrics import MetricsCollector
+
+    metrics = MetricsCollector()
+    client = zulip.Client(config_file="~/zuliprc", metrics_hook=metrics)
+    ...
+    print(metrics.prometheus_text())
+"""
+
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+from zulip import RequestMetrics
+
+# Upper bounds, in seconds, of the request latency histogram buckets.
+# The largest covers a long-polling request, which the server holds
+# open for up to about a minute.
+DEFAULT_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 90.0)
+
+
+class _EndpointStats:
+    def __init__(self, bucket_count: int) -> None:
+        self.status_counts = {}  # type: Dict[str, int]
+        self.bucket_counts = [0] * bucket_count
+        self.duration_sum = 0.0
+        self.count = 0
+        self.retries = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+
+class MetricsCollector:
+    """
+    Collects the RequestMetrics of every request made by the clients
+    it is passed to as metrics_hook, per method and endpoint.  Safe to
+    share between clients and threads.
+    """
+
+    def __init__(self, latency_buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> None:
+        self.latency_buckets = sorted(latency_buckets)
+        self.lock = threading.Lock()
+        self.endpoints = {}  # type: Dict[Tuple[str, str], _EndpointStats]
+
+    def __call__(self, metrics: RequestMetrics) -> None:
+        status = "none" if metrics.status_code is None else str(metrics.status_code)
+        with self.lock:
+            key = (metrics.method, metrics.endpoint)
+            stats = self.endpoints.get(key)
+            if stats is None:
+                stats = self.endpoints[key] = _EndpointStats(len(self.latency_buckets))
+            stats.status_counts[status] = stats.status_counts.get(status, 0) + 1
+            for i, bound in enumerate(self.latency_buckets):
+                if metrics.duration <= bound:
+                    stats.bucket_counts[i] += 1
+            stats.duration_sum += metrics.duration
+            stats.count += 1
+            stats.retries += metrics.retries
+            stats.request_bytes += metrics.request_bytes
+            stats.response_bytes += metrics.response_bytes
+
+    def reset(self) -> None:
+        with self.lock:
+            self.endpoints = {}
+
+    def prometheus_text(self) -> str:
+        """The collected metrics, in the Prometheus text exposition format."""
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+            lines = []  # type: List[str]
+
+            def family(name: str, metric_type: str, help_text: str) -> None:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+
+            family(
+                "zulip_client_requests_total",
+                "counter",
+                "API requests, by the status code of the final response.",
+            )
+            for (method, endpoint), stats in endpoints:
+                for status, count in sorted(stats.status_counts.items()):
+                    labels = _labels(method=method, endpoint=endpoint, status=status)
+                    lines.append(f"zulip_client_requests_total{labels} {count}")
+
+            family(
+                "zulip_client_request_duration_seconds",
+                "histogram",
+                "Time taken by API requests, including retries.",
+            )
+            for (method, endpoint), stats in endpoints:
+                name = "zulip_client_request_duration_seconds"
+                for bound, count in zip(self.latency_buckets, stats.bucket_counts):
+                    labels = _labels(method=method, endpoint=endpoint, le=_format_float(bound))
+                    lines.append(f"{name}_bucket{labels} {count}")
+                labels = _labels(method=method, endpoint=endpoint, le="+Inf")
+                lines.append(f"{name}_bucket{labels} {stats.count}")
+                labels = _labels(method=method, endpoint=endpoint)
+                lines.append(f"{name}_sum{labels} {_format_float(stats.duration_sum)}")
+                lines.append(f"{name}_count{labels} {stats.count}")
+
+            for name, attribute, help_text in [
+                ("zulip_client_request_retries_total", "retries", "Retried API request attempts."),
+                (
+                    "zulip_client_request_bytes_total",
+                    "request_bytes",
+                    "Bytes of request data sent.",
+                ),
+                (
+                    "zulip_client_response_bytes_total",
+                    "response_bytes",
+                    "Bytes of response data received.",
+                ),
+            ]:
+                family(name, "counter", help_text)
+                for (method, endpoint), stats in endpoints:
+                    labels = _labels(method=method, endpoint=endpoint)
+                    lines.append(f"{name}{labels} {getattr(stats, attribute)}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(**labels: str) -> str:
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_float(value: float) -> str:
+    return repr(float(value))
@@ -0,0 +1,212 @@
+"""
+A local copy of a realm's users and streams, and of the subscribers
+of the streams the client can see, kept current from the event queue:
+
+    from zulip.realm_state import RealmState
+
+    state = RealmState()
+
+    def handle_event(event):
+        state.apply_event(event)
+        ...
+
+    client.call_on_each_event(
+        handle_event,
+        event_types=["message", *RealmState.event_types],
+        include_subscribers=True,
+        on_register=state.apply_register,
+    )
+
+Lookups (user ID by email, stream ID by name, subscribers by stream ID,
+...) are then answered from memory instead of with API requests.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+
+class RealmState:
+    # The event types needed to keep a RealmState current; pass these
+    # to register (or call_on_each_event), together with any others.
+    event_types = ["realm_user", "stream", "subscription"]
+
+    def __init__(self) -> None:
+        self._reset()
+
+    def _reset(self) -> None:
+        self.users = {}  # type: Dict[int, Dict[str, Any]]
+        self.streams = {}  # type: Dict[int, Dict[str, Any]]
+        # The client's own subscriptions, by stream ID.
+        self.subscriptions = {}  # type: Dict[int, Dict[str, Any]]
+        self._user_ids_by_email = {}  # type: Dict[str, int]
+        self._stream_ids_by_name = {}  # type: Dict[str, int]
+        self._subscribers = {}  # type: Dict[int, Set[int]]
+        # The client's own user ID; other subscribers learn of its
+        # unsubscribing from peer_remove events, but it doesn't.
+        self._own_user_id = None  # type: Optional[int]
+
+    def apply_register(self, response: Dict[str, Any]) -> None:
+        """
+        Replaces the state with the one in a register response.  Pass
+        include_subscribers=True to register to know the subscribers
+        of streams.
+        """
+        self._reset()
+        self._own_user_id = response.get("user_id")
+        for user in response.get("realm_users", []) + response.get("realm_non_active_users", []):
+            self._add_user(user)
+        for stream in response.get("streams", []):
+            self._add_stream(stream)
+        for subscription in response.get("subscriptions", []):
+            self._add_subscription(subscription)
+        for key in ("unsubscribed", "never_subscribed"):
+            for stream in response.get(key, []):
+                self._add_stream(stream, replace=False)
+
+    def apply_event(self, event: Dict[str, Any]) -> None:
+        """Applies an event to the state; events of other types are ignored."""
+        if event["type"] == "realm_user":
+            self._apply_realm_user_event(event)
+        elif event["type"] == "stream":
+            self._apply_stream_event(event)
+        elif event["type"] == "subscription":
+            self._apply_subscription_event(event)
+
+    def user_id(self, email: str) -> Optional[int]:
+        return self._user_ids_by_email.get(email.lower())
+
+    def user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return self.users.get(user_id)
+
+    def user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        user_id = self.user_id(email)
+        return None if user_id is None else self.users.get(user_id)
+
+    def stream_id(self, name: str) -> Optional[int]:
+        # Stream names are case-insensitive.
+        return self._stream_ids_by_name.get(name.lower())
+
+    def stream(self, stream_id: int) -> Optional[Dict[str, Any]]:
+        return self.streams.get(stream_id)
+
+    def subscribers(self, stream_id: int) -> Set[int]:
+        """The IDs of the stream's subscribers, if known."""
+        return self._subscribers.get(stream_id, set())
+
+    def is_subscribed(self, stream_id: int) -> bool:
+        return stream_id in self.subscriptions
+
+    def _add_user(self, user: Dict[str, Any]) -> None:
+        self.users[user["user_id"]] = user
+        self._user_ids_by_email[user["email"].lower()] = user["user_id"]
+
+    def _add_stream(self, stream: Dict[str, Any], replace: bool = True) -> None:
+        # Subscription objects also describe the stream, and may list its
+        # subscribers; they only stand in for streams we know nothing of.
+        stream = dict(stream)
+        subscribers = stream.pop("subscribers", None)
+        if subscribers is not None:
+            self._subscribers[stream["stream_id"]] = set(subscribers)
+        old_stream = self.streams.get(stream["stream_id"])
+        if old_stream is not None and not replace:
+            return
+        if old_stream is not None:
+            self._stream_ids_by_name.pop(old_stream["name"].lower(), None)
+        self.streams[stream["stream_id"]] = stream
+        self._stream_ids_by_name[stream["name"].lower()] = stream["stream_id"]
+
+    def _add_subscription(self, subscription: Dict[str, Any]) -> None:
+        self._add_stream(subscription, replace=False)
+        subscription = dict(subscription)
+        subscription.pop("subscribers", None)
+        self.subscriptions[subscription["stream_id"]] = subscription
+
+    def _remove_stream(self, stream_id: int) -> None:
+        stream = self.streams.pop(stream_id, None)
+        if stream is not None:
+            self._stream_ids_by_name.pop(stream["name"].lower(), None)
+        self.subscriptions.pop(stream_id, None)
+        self._subscribers.pop(stream_id, None)
+
+    def _apply_realm_user_event(self, event: Dict[str, Any]) -> None:
+        person = event["person"]
+        user_id = person["user_id"]
+        if event["op"] == "add":
+            self._add_user(person)
+        elif event["op"] == "remove":
+            # Sent by older servers when a user is deactivated.
+            user = self.users.get(user_id)
+            if user is not None:
+                user["is_active"] = False
+        elif event["op"] == "update":
+            user = self.users.get(user_id)
+            if user is None:
+                return
+            new_email = person.get("new_email")
+            if new_email is not None:
+                self._user_ids_by_email.pop(user["email"].lower(), None)
+                self._user_ids_by_email[new_email.lower()] = user_id
+                user["email"] = new_email
+            custom_profile_field = person.get("custom_profile_field")
+            if custom_profile_field is not None:
+                profile_data = user.setdefault("profile_data", {})
+                field = dict(custom_profile_field)
+                profile_data[str(field.pop("id"))] = field
+            for key, value in person.items():
+                if key not in ("user_id", "new_email", "custom_profile_field"):
+                    user[key] = value
+
+    def _apply_stream_event(self, event: Dict[str, Any]) -> None:
+        if event["op"] == "create":
+            for stream in event["streams"]:
+                self._add_stream(stream)
+        elif event["op"] == "delete":
+            for stream in event["streams"]:
+                self._remove_stream(stream["stream_id"])
+        elif event["op"] == "update":
+            stream = self.streams.get(event["stream_id"])
+            if stream is None:
+                return
+            if event["property"] == "name":
+                self._stream_ids_by_name.pop(stream["name"].lower(), None)
+                self._stream_ids_by_name[event["value"].lower()] = event["stream_id"]
+            stream[event["property"]] = event["value"]
+            subscription = self.subscriptions.get(event["stream_id"])
+            if subscription is not None:
+                subscription[event["property"]] = event["value"]
+
+    def _apply_subscription_event(self, event: Dict[str, Any]) -> None:
+        op = event["op"]
+        if op == "add":
+            for subscription in event["subscriptions"]:
+                self._add_subscription(subscription)
+        elif op == "remove":
+            for subscription in event["subscriptions"]:
+                self.subscriptions.pop(subscription["stream_id"], None)
+                subscribers = self._subscribers.get(subscription["stream_id"])
+                if subscribers is not None:
+                    subscribers.discard(self._own_user_id)
+        elif op == "update":
+            subscription = self.subscriptions.get(event["stream_id"])
+            if subscription is not None:
+                subscription[event["property"]] = event["value"]
+        elif op in ("peer_add", "peer_remove"):
+            for stream_id in self._peer_event_stream_ids(event):
+                subscribers = self._subscribers.setdefault(stream_id, set())
+                user_ids = event.get("user_ids", [event.get("user_id")])
+                if op == "peer_add":
+                    subscribers.update(user_ids)
+                else:
+                    subscribers.difference_update(user_ids)
+
+    def _peer_event_stream_ids(self, event: Dict[str, Any]) -> Iterable[int]:
+        # Servers before Zulip 4.0 send a single stream, or stream names.
+        if "stream_ids" in event:
+            return event["stream_ids"]
+        if "stream_id" in event:
+            return [event["stream_id"]]
+        stream_ids = []  # type: List[int]
+        for name in event.get("subscriptions", []):
+            stream_id = self.stream_id(name)
+            if stream_id is not None:
+                stream_ids.append(stream_id)
+        return stream_ids
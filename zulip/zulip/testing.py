@@ -0,0 +1,856 @@
+"""
+An in-memory stand-in for a Zulip server, for exercising clients, bots
+and bridges (and measuring their throughput) without a real server:
+
+    from zulip.testing import FakeServer
+
+    with FakeServer(latency=0.005) as server:
+        client = server.make_client()
+        client.send_message({"type": "stream", "to": "devel", "topic": "ci", "content": "Hi"})
+        assert server.messages[-1]["content"] == "Hi"
+
+FakeServer listens on a local port and implements the endpoints that
+clients lean on most: register, the events long-poll, messages (send,
+fetch, edit, delete and flags), user_uploads, bot_storage, users/me and
+server_settings, with Zulip's response formats and error codes.
+Everything lives in memory; message content isn't rendered as
+Markdown, and the only permission checks are on who can see and edit
+which messages.  Other endpoints return 404.
+
+Latency and errors can be injected, either at random for every
+request (`latency`, `error_rate`) or for the next few (`fail_next()`),
+to see how the code under test copes with a slow or flaky server.
+send_message() and push_event() add messages and events on the
+server's side, e.g. to feed a bot.
+"""
+
+import base64
+import collections
+import html
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import (
+    Any,
+    Callable,
+    Counter,
+    Deque,
+    Dict,
+    List,
+    Match,
+    Optional,
+    Pattern,
+    Set,
+    Tuple,
+    Union,
+)
+
+from zulip import Client
+
+API_PREFIX = "/api/v1/"
+
+_MISSING = object()
+
+
+class _APIError(Exception):
+    def __init__(self, msg: str, code: str = "BAD_REQUEST", status: int = 400) -> None:
+        super().__init__(msg)
+        self.msg = msg
+        self.code = code
+        self.status = status
+
+
+class _EventQueue:
+    def __init__(
+        self, queue_id: str, user: Dict[str, Any], event_types: Optional[List[str]], narrow: Any
+    ) -> None:
+        self.queue_id = queue_id
+        self.user = user
+        self.event_types = event_types
+        self.narrow = narrow
+        self.events = collections.deque()  # type: Deque[Dict[str, Any]]
+        self.next_event_id = 0
+
+    def wants(self, event_type: str) -> bool:
+        return self.event_types is None or event_type in self.event_types
+
+    def push(self, event: Dict[str, Any]) -> None:
+        event = dict(event, id=self.next_event_id)
+        self.next_event_id += 1
+        self.events.append(event)
+
+
+_Route = Tuple[str, Pattern[str], Callable[..., Dict[str, Any]]]
+
+
+class FakeServer:
+    """
+    A fake Zulip server with one realm, whose users start out as a
+    single bot with the given credentials; see the module docstring.
+
+    `latency` seconds are added to every request (or the result of
+    calling it with the method and endpoint, e.g. "GET messages"), and
+    a fraction `error_rate` of requests fail with `error_status`.  The
+    events endpoint sends a heartbeat after `heartbeat_interval` seconds
+    without events, as Zulip does.
+    """
+
+    def __init__(
+        self,
+        email: str = "bot@example.com",
+        api_key: str = "fake-api-key",
+        full_name: str = "Test Bot",
+        *,
+        latency: Union[float, Callable[[str], float]] = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        heartbeat_interval: float = 45.0,
+        zulip_feature_level: int = 185,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.email = email
+        self.api_key = api_key
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.heartbeat_interval = heartbeat_interval
+        self.zulip_feature_level = zulip_feature_level
+        self.random = random.Random(seed)
+
+        self.users = {}  # type: Dict[str, Dict[str, Any]]
+        self.streams = {}  # type: Dict[str, int]
+        self.messages = []  # type: List[Dict[str, Any]]
+        # user_id -> message_id -> flags
+        self.message_flags = collections.defaultdict(dict)  # type: Dict[int, Dict[int, Set[str]]]
+        self.storage = collections.defaultdict(dict)  # type: Dict[int, Dict[str, str]]
+        self.uploads = {}  # type: Dict[str, bytes]
+        self.queues = {}  # type: Dict[str, _EventQueue]
+        # Added to every register response, e.g. realm_users.
+        self.register_state = {}  # type: Dict[str, Any]
+        # How many requests each endpoint got, by e.g. "GET messages".
+        self.request_counts = collections.Counter()  # type: Counter[str]
+        self._failures = []  # type: List[Tuple[Optional[str], int]]
+        self._next_queue_id = 0
+        self._closing = False
+        # Guards all of the above, and signals new events.
+        self._lock = threading.Condition()
+        self._httpd = None  # type: Optional[ThreadingHTTPServer]
+
+        self.add_user(email, full_name, api_key=api_key, is_bot=True)
+        self._routes = [
+            ("GET", re.compile(r"server_settings"), self._get_server_settings),
+            ("GET", re.compile(r"users/me"), self._get_profile),
+            ("POST", re.compile(r"register"), self._register),
+            ("GET", re.compile(r"events"), self._get_events),
+            ("DELETE", re.compile(r"events"), self._deregister),
+            ("POST", re.compile(r"messages"), self._send_message),
+            ("GET", re.compile(r"messages"), self._get_messages),
+            ("POST", re.compile(r"messages/flags"), self._update_flags),
+            ("POST", re.compile(r"messages/flags/narrow"), self._update_flags_for_narrow),
+            ("PATCH", re.compile(r"messages/(\d+)"), self._update_message),
+            ("DELETE", re.compile(r"messages/(\d+)"), self._delete_message),
+            ("POST", re.compile(r"user_uploads"), self._upload_file),
+            ("GET", re.compile(r"bot_storage"), self._get_storage),
+            ("PUT", re.compile(r"bot_storage"), self._update_storage),
+            ("DELETE", re.compile(r"bot_storage"), self._remove_storage),
+        ]  # type: List[_Route]
+
+    @property
+    def url(self) -> str:
+        assert self._httpd is not None, "FakeServer is not running"
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    def start(self) -> None:
+        self._httpd = _HTTPServer(("127.0.0.1", 0), _RequestHandler, self)
+        threading.Thread(target=self._httpd.serve_forever, name="FakeServer", daemon=True).start()
+
+    def stop(self) -> None:
+        with self._lock:
+            self._closing = True
+            self._lock.notify_all()
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+
+    def __enter__(self) -> "FakeServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+    def make_client(self, **kwargs: Any) -> Client:
+        """A Client for the bot, configured with this server."""
+        return Client(email=self.email, api_key=self.api_key, site=self.url, **kwargs)
+
+    def add_user(
+        self,
+        email: str,
+        full_name: str,
+        *,
+        api_key: Optional[str] = None,
+        is_bot: bool = False,
+    ) -> Dict[str, Any]:
+        with self._lock:
+            user = {
+                "user_id": len(self.users) + 1,
+                "email": email,
+                "full_name": full_name,
+                "is_bot": is_bot,
+                "api_key": api_key or f"{email}-api-key",
+            }
+            self.users[email] = user
+            return user
+
+    def fail_next(self, count: int = 1, status: int = 500, endpoint: Optional[str] = None) -> None:
+        """
+        Makes the next `count` requests (to `endpoint`, e.g. "POST
+        messages", if given) fail with `status`.
+        """
+        with self._lock:
+            self._failures.extend([(endpoint, status)] * count)
+
+    def send_message(self, message: Dict[str, Any], sender: Optional[str] = None) -> int:
+        """
+        Sends a message as `sender` (by default the bot), as if through
+        the API, and returns its ID.
+        """
+        with self._lock:
+            return self._add_message(self.users[sender or self.email], message)
+
+    def push_event(self, event: Dict[str, Any], queue_id: Optional[str] = None) -> None:
+        """Adds an event to one event queue, or all that want its type."""
+        with self._lock:
+            queues = [self.queues[queue_id]] if queue_id is not None else self.queues.values()
+            for queue in queues:
+                if queue.wants(event["type"]):
+                    queue.push(event)
+            self._lock.notify_all()
+
+    def handle(
+        self,
+        method: str,
+        path: str,
+        params: Dict[str, str],
+        files: List[Tuple[str, bytes]],
+        auth: Optional[str],
+    ) -> Tuple[int, Dict[str, Any]]:
+        endpoint = path[len(API_PREFIX) :].strip("/")
+        name = f"{method} {endpoint}"
+        with self._lock:
+            self.request_counts[name] += 1
+            status = self._injected_failure(name)
+
+        latency = self.latency(name) if callable(self.latency) else self.latency
+        if latency:
+            time.sleep(latency)
+        if status is not None:
+            result = {
+                "result": "error",
+                "msg": "Injected failure",
+                "code": "BAD_REQUEST",
+            }  # type: Dict[str, Any]
+            if status == 429:
+                result.update(code="RATE_LIMIT_HIT", msg="API usage exceeded rate limit")
+                result["retry-after"] = 0.0
+            return status, result
+
+        try:
+            for route_method, pattern, handler in self._routes:
+                match = pattern.fullmatch(endpoint)
+                if route_method == method and match is not None:
+                    break
+            else:
+                raise _APIError("Endpoint not found", status=404)
+            user = None
+            if endpoint != "server_settings":
+                user = self._authenticate(auth)
+            with self._lock:
+                result = handler(user, params, match, files)
+        except _APIError as e:
+            return e.status, {"result": "error", "msg": e.msg, "code": e.code}
+        return 200, dict({"result": "success", "msg": ""}, **result)
+
+    def _injected_failure(self, name: str) -> Optional[int]:
+        for i, (endpoint, status) in enumerate(self._failures):
+            if endpoint is None or endpoint == name:
+                del self._failures[i]
+                return status
+        if self.error_rate and self.random.random() < self.error_rate:
+            return self.error_status
+        return None
+
+    def _authenticate(self, auth: Optional[str]) -> Dict[str, Any]:
+        if auth is None or not auth.startswith("Basic "):
+            raise _APIError("Missing authorization header", "UNAUTHORIZED", 401)
+        email, _, api_key = base64.b64decode(auth[len("Basic ") :]).decode().partition(":")
+        user = self.users.get(email)
+        if user is None or user["api_key"] != api_key:
+            raise _APIError("Invalid API key", "UNAUTHORIZED", 401)
+        return user
+
+    # Endpoints.  These run with the lock held, and take the requesting
+    # user, the request parameters, the endpoint's regex match and the
+    # uploaded files' names and contents.
+
+    def _get_server_settings(self, *args: Any) -> Dict[str, Any]:
+        return {
+            "zulip_version": "7.0",
+            "zulip_feature_level": self.zulip_feature_level,
+            "zulip_merge_base": "7.0",
+            "push_notifications_enabled": False,
+            "realm_uri": self.url,
+            "realm_name": "Fake Realm",
+            "authentication_methods": {"password": True},
+        }
+
+    def _get_profile(self, user: Dict[str, Any], *args: Any) -> Dict[str, Any]:
+        profile = {key: value for key, value in user.items() if key != "api_key"}
+        profile.update(is_admin=False, is_owner=False, is_guest=False, role=400)
+        return profile
+
+    def _register(self, user: Dict[str, Any], params: Dict[str, str], *args: Any) -> Dict[str, Any]:
+        event_types = _json_param(params, "event_types", None)
+        narrow = _parse_narrow(_json_param(params, "narrow", []))
+        queue_id = f"{int(time.time())}:{self._next_queue_id}"
+        self._next_queue_id += 1
+        self.queues[queue_id] = _EventQueue(queue_id, user, event_types, narrow)
+        return dict(
+            self.register_state,
+            queue_id=queue_id,
+            last_event_id=-1,
+            max_message_id=self.messages[-1]["id"] if self.messages else -1,
+            zulip_version="7.0",
+            zulip_feature_level=self.zulip_feature_level,
+            zulip_merge_base="7.0",
+        )
+
+    def _event_queue(self, user: Dict[str, Any], params: Dict[str, str]) -> _EventQueue:
+        queue_id = params.get("queue_id", "")
+        queue = self.queues.get(queue_id)
+        if queue is None or queue.user is not user:
+            raise _APIError(f"Bad event queue ID: {queue_id}", "BAD_EVENT_QUEUE_ID")
+        return queue
+
+    def _get_events(
+        self, user: Dict[str, Any], params: Dict[str, str], *args: Any
+    ) -> Dict[str, Any]:
+        queue = self._event_queue(user, params)
+        last_event_id = _json_param(params, "last_event_id", -1)
+        while queue.events and queue.events[0]["id"] <= last_event_id:
+            queue.events.popleft()
+        if not queue.events and not _json_param(params, "dont_block", False):
+            deadline = time.monotonic() + self.heartbeat_interval
+            while not queue.events and not self._closing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queue.push({"type": "heartbeat"})
+                    break
+                self._lock.wait(remaining)
+            if self.queues.get(queue.queue_id) is not queue:
+                raise _APIError(f"Bad event queue ID: {queue.queue_id}", "BAD_EVENT_QUEUE_ID")
+        return {"events": list(queue.events), "queue_id": queue.queue_id}
+
+    def _deregister(
+        self, user: Dict[str, Any], params: Dict[str, str], *args: Any
+    ) -> Dict[str, Any]:
+        del self.queues[self._event_queue(user, params).queue_id]
+        self._lock.notify_all()
+        return {}
+
+    def _send_message(
+        self, user: Dict[str, Any], params: Dict[str, str], *args: Any
+    ) -> Dict[str, Any]:
+        message = dict(params)
+        message["to"] = _json_param(params, "to", _MISSING, strict=False)
+        return {"id": self._add_message(user, message)}
+
+    def _get_messages(
+        self, user: Dict[str, Any], params: Dict[str, str], *args: Any
+    ) -> Dict[str, Any]:
+        anchor = params.get("anchor", "newest")
+        messages, found = self._select_messages(
+            user,
+            _parse_narrow(_json_param(params, "narrow", [])),
+            anchor,
+            _json_param(params, "num_before", _MISSING),
+            _json_param(params, "num_after", _MISSING),
+            _json_param(params, "include_anchor", True),
+        )
+        apply_markdown = _json_param(params, "apply_markdown", True)
+        return dict(
+            found,
+            anchor=anchor,
+            history_limited=False,
+            messages=[self._render(user, message, apply_markdown) for message in messages],
+        )
+
+    def _update_flags(
+        self, user: Dict[str, Any], params: Dict[str, str], *args: Any
+    ) -> Dict[str, Any]:
+        messages = [
+            self._message(user, message_id) for message_id in _json_param(params, "messages")
+        ]
+        return {"messages": self._set_flag(user, messages, params)}
+
+    def _update_flags_for_narrow(
+        self, user: Dict[str, Any], params: Dict[str, str], *args: Any
+    ) -> Dict[str, Any]:
+        messages, found = self._select_messages(
+            user,
+            _parse_narrow(_json_param(params, "narrow", [])),
+            params.get("anchor", _MISSING),
+            _json_param(params, "num_before", _MISSING),
+            _json_param(params, "num_after", _MISSING),
+            _json_param(params, "include_anchor", True),
+        )
+        updated = self._set_flag(user, messages, params)
+        return {
+            "processed_count": len(messages),
+            "updated_count": len(updated),
+            "first_processed_id": messages[0]["id"] if messages else None,
+            "last_processed_id": messages[-1]["id"] if messages else None,
+            "found_oldest": found["found_oldest"],
+            "found_newest": found["found_newest"],
+        }
+
+    def _update_message(
+        self, user: Dict[str, Any], params: Dict[str, str], match: Match[str], *args: Any
+    ) -> Dict[str, Any]:
+        message = self._message(user, int(match.group(1)))
+        event = {
+            "type": "update_message",
+            "user_id": user["user_id"],
+            "message_id": message["id"],
+            "message_ids": [message["id"]],
+            "edit_timestamp": int(time.time()),
+            "rendering_only": False,
+            "flags": [],
+        }
+        if "content" in params:
+            if message["sender_id"] != user["user_id"]:
+                raise _APIError("You don't have permission to edit this message")
+            event.update(orig_content=message["content"], content=params["content"])
+            event["rendered_content"] = _render_content(params["content"])
+            message["content"] = params["content"]
+        topic = params.get("topic", params.get("subject"))
+        if topic is not None and message["type"] == "stream":
+            event.update(
+                stream_id=message["stream_id"],
+                orig_subject=message["subject"],
+                subject=topic,
+                propagate_mode=params.get("propagate_mode", "change_one"),
+            )
+            message["subject"] = topic
+        message["last_edit_timestamp"] = event["edit_timestamp"]
+        self._notify(message, event)
+        return {}
+
+    def _delete_message(
+        self, user: Dict[str, Any], params: Dict[str, str], match: Match[str], *args: Any
+    ) -> Dict[str, Any]:
+        message = self._message(user, int(match.group(1)))
+        event = {"type": "delete_message", "message_ids": [message["id"]]}
+        event["message_type"] = message["type"]
+        if message["type"] == "stream":
+            event.update(stream_id=message["stream_id"], topic=message["subject"])
+        self._notify(message, event)
+        self.messages.remove(message)
+        return {}
+
+    def _upload_file(
+        self,
+        user: Dict[str, Any],
+        params: Dict[str, str],
+        match: Match[str],
+        files: List[Tuple[str, bytes]],
+    ) -> Dict[str, Any]:
+        if len(files) != 1:
+            raise _APIError("You must specify a file to upload")
+        [(filename, content)] = files
+        uri = f"/user_uploads/1/{len(self.uploads):02x}/{urllib.parse.quote(filename)}"
+        self.uploads[uri] = content
+        return {"uri": uri, "url": uri}
+
+    def _get_storage(
+        self, user: Dict[str, Any], params: Dict[str, str], *args: Any
+    ) -> Dict[str, Any]:
+        storage = self.storage[user["user_id"]]
+        keys = _json_param(params, "keys", None)
+        if keys is None:
+            return {"storage": dict(storage)}
+        for key in keys:
+            if key not in storage:
+                raise _APIError(f"Key does not exist: {key}")
+        return {"storage": {key: storage[key] for key in keys}}
+
+    def _update_storage(
+        self, user: Dict[str, Any], params: Dict[str, str], *args: Any
+    ) -> Dict[str, Any]:
+        entries = _json_param(params, "storage")
+        if not all(isinstance(value, str) for value in entries.values()):
+            raise _APIError("Value type is <class 'int'>, but should be str.")
+        self.storage[user["user_id"]].update(entries)
+        return {}
+
+    def _remove_storage(
+        self, user: Dict[str, Any], params: Dict[str, str], *args: Any
+    ) -> Dict[str, Any]:
+        storage = self.storage[user["user_id"]]
+        keys = _json_param(params, "keys", None)
+        for key in keys if keys is not None else list(storage):
+            if storage.pop(key, None) is None:
+                raise _APIError(f"Key does not exist: {key}")
+        return {}
+
+    # Messages.
+
+    def _add_message(self, sender: Dict[str, Any], request: Dict[str, Any]) -> int:
+        content = request.get("content", "")
+        if not content.strip():
+            raise _APIError("Message must not be empty")
+        to = request.get("to", _MISSING)
+        if to is _MISSING:
+            raise _APIError("Missing 'to' argument")
+        message_id = self.messages[-1]["id"] + 1 if self.messages else 1
+        message = {
+            "id": message_id,
+            "type": request.get("type", "stream"),
+            "sender_id": sender["user_id"],
+            "sender_email": sender["email"],
+            "sender_full_name": sender["full_name"],
+            "sender_realm_str": "zulip",
+            "avatar_url": None,
+            "client": "API",
+            "timestamp": int(time.time()),
+            "content": content,
+            "is_me_message": content.startswith("/me "),
+            "reactions": [],
+            "submessages": [],
+            "topic_links": [],
+        }  # type: Dict[str, Any]
+        if message["type"] == "stream":
+            if isinstance(to, list):
+                to = to[0]
+            stream_name = to if isinstance(to, str) else self._stream_name(to)
+            message["stream_id"] = self.streams.setdefault(stream_name, len(self.streams) + 1)
+            message["recipient_id"] = 1000 + message["stream_id"]
+            message["display_recipient"] = stream_name
+            message["subject"] = request.get("topic", request.get("subject", "(no topic)"))
+            recipients = list(self.users.values())
+        elif message["type"] in ("private", "direct"):
+            message["type"] = "private"
+            if isinstance(to, str):
+                to = to.split(",")
+            elif not isinstance(to, list):
+                to = [to]
+            recipients = [sender] + [self._user(r) for r in to]
+            recipients = sorted(
+                {r["user_id"]: r for r in recipients}.values(), key=lambda r: r["user_id"]
+            )
+            message["recipient_id"] = 2000 + sum(r["user_id"] for r in recipients)
+            message["display_recipient"] = [
+                {
+                    "id": r["user_id"],
+                    "email": r["email"],
+                    "full_name": r["full_name"],
+                    "is_mirror_dummy": False,
+                }
+                for r in recipients
+            ]
+            message["subject"] = ""
+        else:
+            raise _APIError("Invalid message type")
+        self.messages.append(message)
+
+        for recipient in recipients:
+            flags = set()  # type: Set[str]
+            if recipient is sender:
+                flags.add("read")
+            elif f"@**{recipient['full_name']}**" in content:
+                flags.add("mentioned")
+            self.message_flags[recipient["user_id"]][message_id] = flags
+        for queue in self.queues.values():
+            if queue.wants("message") and self._visible(queue.user, message, queue.narrow):
+                queue.push(
+                    {
+                        "type": "message",
+                        "message": self._render(queue.user, message, True),
+                        "flags": sorted(self._flags(queue.user, message)),
+                    }
+                )
+        self._lock.notify_all()
+        return message_id
+
+    def _stream_name(self, stream_id: int) -> str:
+        for name, id in self.streams.items():
+            if id == stream_id:
+                return name
+        raise _APIError(f"Invalid stream ID {stream_id}", "STREAM_DOES_NOT_EXIST")
+
+    def _user(self, key: Union[str, int]) -> Dict[str, Any]:
+        for user in self.users.values():
+            if key in (user["email"], user["user_id"]):
+                return user
+        raise _APIError(f"Invalid email '{key}'")
+
+    def _message(self, user: Dict[str, Any], message_id: int) -> Dict[str, Any]:
+        for message in self.messages:
+            if message["id"] == message_id and self._visible(user, message, []):
+                return message
+        raise _APIError("Invalid message(s)")
+
+    def _flags(self, user: Dict[str, Any], message: Dict[str, Any]) -> Set[str]:
+        return self.message_flags[user["user_id"]].setdefault(message["id"], set())
+
+    def _render(
+        self, user: Dict[str, Any], message: Dict[str, Any], apply_markdown: bool
+    ) -> Dict[str, Any]:
+        message = dict(message, flags=sorted(self._flags(user, message)))
+        if apply_markdown:
+            message.update(content=_render_content(message["content"]), content_type="text/html")
+        else:
+            message["content_type"] = "text/x-markdown"
+        return message
+
+    def _set_flag(
+        self, user: Dict[str, Any], messages: List[Dict[str, Any]], params: Dict[str, str]
+    ) -> List[int]:
+        op, flag = params.get("op"), params.get("flag")
+        if op not in ("add", "remove") or not flag:
+            raise _APIError("Invalid op or flag")
+        updated = []
+        for message in messages:
+            flags = self._flags(user, message)
+            if op == "add" and flag not in flags:
+                flags.add(flag)
+                updated.append(message["id"])
+            elif op == "remove" and flag in flags:
+                flags.remove(flag)
+                updated.append(message["id"])
+        if updated:
+            event = {
+                "type": "update_message_flags",
+                "op": op,
+                "flag": flag,
+                "messages": updated,
+                "all": False,
+            }  # type: Dict[str, Any]
+            for queue in self.queues.values():
+                if queue.user is user and queue.wants(event["type"]):
+                    queue.push(event)
+            self._lock.notify_all()
+        return updated
+
+    def _notify(self, message: Dict[str, Any], event: Dict[str, Any]) -> None:
+        for queue in self.queues.values():
+            if queue.wants(event["type"]) and self._visible(queue.user, message, []):
+                queue.push(event)
+        self._lock.notify_all()
+
+    def _visible(
+        self, user: Dict[str, Any], message: Dict[str, Any], narrow: List[Tuple[str, Any, bool]]
+    ) -> bool:
+        if message["type"] == "private" and user["user_id"] not in {
+            r["id"] for r in message["display_recipient"]
+        }:
+            return False
+        return all(self._matches(user, message, *term) for term in narrow)
+
+    def _matches(
+        self,
+        user: Dict[str, Any],
+        message: Dict[str, Any],
+        operator: str,
+        operand: Any,
+        negated: bool,
+    ) -> bool:
+        if operator in ("stream", "channel"):
+            result = message["type"] == "stream" and operand in (
+                message["display_recipient"],
+                message["stream_id"],
+            )
+        elif operator in ("topic", "subject"):
+            result = message["subject"].lower() == str(operand).lower()
+        elif operator == "sender":
+            result = operand in (message["sender_email"], message["sender_id"])
+        elif operator == "id":
+            result = message["id"] == int(operand)
+        elif operator == "search":
+            result = str(operand).lower() in message["content"].lower()
+        elif operator in ("pm-with", "dm"):
+            if isinstance(operand, str):
+                operand = operand.split(",")
+            others = {self._user(key)["user_id"] for key in operand} - {user["user_id"]}
+            result = message["type"] == "private" and others == {
+                r["id"] for r in message["display_recipient"]
+            } - {user["user_id"]}
+        elif operator == "is" and operand in ("private", "dm"):
+            result = message["type"] == "private"
+        elif operator == "is" and operand in ("unread", "starred", "mentioned"):
+            flag = "read" if operand == "unread" else operand
+            result = (flag in self._flags(user, message)) != (operand == "unread")
+        else:
+            raise _APIError(f"Invalid narrow operator: {operator} {operand}")
+        return result != negated
+
+    def _select_messages(
+        self,
+        user: Dict[str, Any],
+        narrow: List[Tuple[str, Any, bool]],
+        anchor: Any,
+        num_before: Any,
+        num_after: Any,
+        include_anchor: bool,
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, bool]]:
+        # The messages Zulip's GET /messages would return, oldest first,
+        # and its found_anchor, found_oldest and found_newest.
+        if anchor is _MISSING or num_before is _MISSING or num_after is _MISSING:
+            raise _APIError("Missing 'anchor', 'num_before' or 'num_after' argument")
+        matching = [message for message in self.messages if self._visible(user, message, narrow)]
+        if anchor == "newest":
+            anchor_id = matching[-1]["id"] if matching else 0
+        elif anchor == "oldest":
+            anchor_id = 0
+        elif anchor == "first_unread":
+            unread = [m for m in matching if "read" not in self._flags(user, m)]
+            anchor_id = unread[0]["id"] if unread else matching[-1]["id"] if matching else 0
+        else:
+            try:
+                anchor_id = int(anchor)
+            except ValueError:
+                raise _APIError(f"Invalid anchor: {anchor}") from None
+        before = [m for m in matching if m["id"] < anchor_id]
+        at = [m for m in matching if m["id"] == anchor_id]
+        after = [m for m in matching if m["id"] > anchor_id]
+        selected = before[max(len(before) - num_before, 0) :] if num_before else []
+        if include_anchor:
+            selected += at
+        selected += after[:num_after]
+        found = {
+            "found_anchor": bool(at),
+            "found_oldest": len(before) <= num_before,
+            "found_newest": len(after) <= num_after,
+        }
+        return selected, found
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], handler: Any, fake_server: FakeServer) -> None:
+        super().__init__(address, handler)
+        self.fake_server = fake_server
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    # Keeps connections open between requests, as Zulip does.
+    protocol_version = "HTTP/1.1"
+    # The headers and body go out in separate writes; don't hold the
+    # body back until the headers are acknowledged.
+    disable_nagle_algorithm = True
+    server: _HTTPServer
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+    def respond(self) -> None:
+        method = self.command
+        parsed = urllib.parse.urlparse(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        content_type = self.headers.get("Content-Type", "")
+
+        if method == "GET" and parsed.path.startswith("/user_uploads/"):
+            self.send_upload(parsed.path)
+            return
+        if not parsed.path.startswith(API_PREFIX):
+            self.send_json(404, {"result": "error", "msg": "Not found", "code": "BAD_REQUEST"})
+            return
+
+        params = dict(urllib.parse.parse_qsl(parsed.query, keep_blank_values=True))
+        files = []  # type: List[Tuple[str, bytes]]
+        if content_type.startswith("multipart/form-data"):
+            files = _parse_multipart(content_type, body)
+        elif body:
+            params.update(urllib.parse.parse_qsl(body.decode(), keep_blank_values=True))
+        status, result = self.server.fake_server.handle(
+            method, parsed.path, params, files, self.headers.get("Authorization")
+        )
+        self.send_json(status, result)
+
+    def send_json(self, status: int, result: Dict[str, Any]) -> None:
+        payload = json.dumps(result).encode()
+        self.send_response(status)
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_upload(self, path: str) -> None:
+        fake_server = self.server.fake_server
+        with fake_server._lock:
+            content = fake_server.uploads.get(path)
+        if content is None:
+            self.send_json(404, {"result": "error", "msg": "Not found", "code": "BAD_REQUEST"})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = respond
+
+
+def _json_param(
+    params: Dict[str, str], name: str, default: Any = _MISSING, strict: bool = True
+) -> Any:
+    # Parameters other than strings arrive JSON-encoded.  With strict
+    # unset, values that aren't valid JSON are taken as strings (e.g.
+    # the `to` of stream messages).
+    if name not in params:
+        if default is _MISSING:
+            raise _APIError(f"Missing '{name}' argument")
+        return default
+    try:
+        return json.loads(params[name])
+    except ValueError:
+        if not strict:
+            return params[name]
+        raise _APIError(f'Argument "{name}" is not valid JSON.') from None
+
+
+def _parse_multipart(content_type: str, body: bytes) -> List[Tuple[str, bytes]]:
+    from email.parser import BytesParser
+    from email.policy import HTTP
+
+    headers = f"Content-Type: {content_type}\r\n\r\n".encode()
+    parsed = BytesParser(policy=HTTP).parsebytes(headers + body)
+    files = []  # type: List[Tuple[str, bytes]]
+    for part in parsed.iter_parts():
+        content = part.get_payload(decode=True)
+        assert isinstance(content, bytes)
+        files.append((part.get_filename() or "file", content))
+    return files
+
+
+def _parse_narrow(narrow: List[Any]) -> List[Tuple[str, Any, bool]]:
+    terms = []
+    for term in narrow:
+        if isinstance(term, dict):
+            terms.append((term["operator"], term["operand"], term.get("negated", False)))
+        else:
+            operator, operand = term
+            terms.append((operator, operand, False))
+    return terms
+
+
+def _render_content(content: str) -> str:
+    return "<p>" + html.escape(content) + "</p>"
@@ -1,3 +1,4 @@
+import _thread
 import configparser
 import json
 import logging
@@ -5,6 +6,7 @@ import os
 import re
 import signal
 import sys
+import threading
 import time
 from contextlib import contextmanager
 from typing import IO, Any, Dict, Iterator, List, Optional, Set
@@ -22,6 +24,17 @@ class StateHandlerError(Exception):
     pass
 
 
+# Bots only respond to private messages and to messages mentioning
+# them, so only those are requested from the server; an event queue
+# narrow can't express "or", so each gets its own queue.  Private
+# messages that mention the bot match both, and are only handled from
+# the first.
+BOT_MESSAGE_NARROWS = [
+    [["is", "private"]],
+    [["is", "mentioned"]],
+]
+
+
 def exit_gracefully(signum: int, frame: Optional[Any]) -> None:
     sys.exit(0)
 
@@ -137,6 +150,9 @@ class CachedStorage:
 class StateHandler:
     def __init__(self, client: Client) -> None:
         self._client = client
+        # Stored values always go through json, whichever codec is in
+        # use: orjson would turn integers wider than 64 bits into floats
+        # and reject NaN and Infinity, which json.dumps writes.
         self.marshal = lambda obj: json.dumps(obj)
         self.demarshal = lambda obj: json.loads(obj)
         self.state_: Dict[str, Any] = dict()
@@ -504,12 +520,49 @@ def run_message_handler_for_bot(
         if is_private_message or is_mentioned:
             message_handler.handle_message(message=message, bot_handler=restricted_client)
 
-    signal.signal(signal.SIGINT, exit_gracefully)
+    # Set when a queue watched from another thread fails.
+    queue_failed = threading.Event()
+
+    def handle_sigint(signum: int, frame: Optional[Any]) -> None:
+        if queue_failed.is_set():
+            # Exit non-zero, so that a supervisor restarts the bot.
+            sys.exit(1)
+        exit_gracefully(signum, frame)
+
+    signal.signal(signal.SIGINT, handle_sigint)
 
     logging.info("starting message handling...")
 
+    # Keeps bot handlers, which needn't be thread-safe, from running
+    # concurrently.
+    handler_lock = threading.Lock()
+
     def event_callback(event: Dict[str, Any]) -> None:
         if event["type"] == "message":
-            handle_message(event["message"], event["flags"])
+            with handler_lock:
+                handle_message(event["message"], event["flags"])
 
-    client.call_on_each_event(event_callback, ["message"])
+    def mention_event_callback(event: Dict[str, Any]) -> None:
+        # Private messages, including those that mention the bot, are
+        # handled from the first queue.
+        if event["type"] == "message" and event["message"]["type"] != "private":
+            event_callback(event)
+
+    def watch_narrow(narrow: List[List[str]]) -> None:
+        try:
+            client.call_on_each_event(mention_event_callback, ["message"], narrow)
+        except BaseException:
+            logging.exception("Stopped handling messages matching %s", narrow)
+            # Take the whole bot down, as an error on the main thread would.
+            queue_failed.set()
+            main_thread_id = threading.main_thread().ident
+            if hasattr(signal, "pthread_kill") and main_thread_id is not None:
+                # Unlike interrupt_main(), a real signal also interrupts
+                # the main thread's long-poll.
+                signal.pthread_kill(main_thread_id, signal.SIGINT)
+            else:
+                _thread.interrupt_main()
+
+    for narrow in BOT_MESSAGE_NARROWS[1:]:
+        threading.Thread(target=watch_narrow, args=(narrow,), daemon=True).start()
+    client.call_on_each_event(event_callback, ["message"], BOT_MESSAGE_NARROWS[0])
@@ -1,7 +1,12 @@
 import io
+import math
+import signal
+import threading
+import time
 from unittest import TestCase
 from unittest.mock import ANY, MagicMock, create_autospec, patch
 
+from zulip import ZulipError
 from zulip_bots.lib import (
     ExternalBotHandler,
     StateHandler,
@@ -81,6 +86,15 @@ class LibTest(TestCase):
         val = state_handler.get("key")
         self.assertEqual(val, [1, 2, 3])
 
+    def test_state_handler_round_trips_any_json(self):
+        client = FakeClient()
+        state_handler = StateHandler(client)
+        state_handler.put("big", 2**70 + 1)
+        state_handler.put("nan", float("nan"))
+        state_handler = StateHandler(client)
+        self.assertEqual(state_handler.get("big"), 2**70 + 1)
+        self.assertTrue(math.isnan(state_handler.get("nan")))
+
     def test_state_handler_by_mock(self):
         client = MagicMock()
 
@@ -170,21 +184,41 @@ class LibTest(TestCase):
             mock_bot_handler = create_autospec(FakeBotHandler)
             mock_lib_module.handler_class.return_value = mock_bot_handler
 
+            narrows = []
+            mentions_done = threading.Event()
+
             def call_on_each_event_mock(self, callback, event_types=None, narrow=None):
+                narrows.append(narrow)
+
                 def test_message(message, flags):
                     event = {"message": message, "flags": flags, "type": "message"}
                     callback(event)
 
                 # In the following test, expected_message is the dict that we expect
                 # to be passed to the bot's handle_message function.
-                original_message = {"content": "@**Alice** bar", "type": "stream"}
+                original_message = {"id": 1, "content": "@**Alice** bar", "type": "stream"}
                 expected_message = {
+                    "id": 1,
                     "type": "stream",
                     "content": "bar",
                     "full_content": "@**Alice** bar",
                 }
-                test_message(original_message, {"mentioned"})
-                mock_bot_handler.handle_message.assert_called_with(
+                private_message = {
+                    "id": 2,
+                    "content": "@**Alice** hi",
+                    "type": "private",
+                    "sender_id": "bob",
+                    "display_recipient": [{"email": "alice@example.com"}],
+                }
+                if narrow == [["is", "mentioned"]]:
+                    test_message(original_message, {"mentioned"})
+                    # Private messages are handled from the other queue.
+                    test_message(dict(private_message), {"mentioned"})
+                    mentions_done.set()
+                else:
+                    mentions_done.wait(5)
+                    test_message(dict(private_message), {"mentioned"})
+                mock_bot_handler.handle_message.assert_any_call(
                     message=expected_message, bot_handler=ANY
                 )
 
@@ -199,6 +233,40 @@ class LibTest(TestCase):
                 bot_name="testbot",
                 bot_source="bot code location",
             )
+            self.assertTrue(mentions_done.is_set())
+            self.assertEqual(mock_bot_handler.handle_message.call_count, 2)
+            self.assertEqual(
+                mock_bot_handler.handle_message.call_args.kwargs["message"]["full_content"],
+                "@**Alice** hi",
+            )
+            self.assertEqual(sorted(narrows), [[["is", "mentioned"]], [["is", "private"]]])
+
+    def test_failed_queue_exits_non_zero(self):
+        self.addCleanup(signal.signal, signal.SIGINT, signal.getsignal(signal.SIGINT))
+        with patch("zulip_bots.lib.Client", new=FakeClient) as fake_client:
+            mock_lib_module = MagicMock()
+            mock_lib_module.__file__ = "foo"
+            mock_lib_module.handler_class.return_value = create_autospec(FakeBotHandler)
+
+            def call_on_each_event_mock(self, callback, event_types=None, narrow=None):
+                if narrow == [["is", "mentioned"]]:
+                    raise ZulipError("queue lost")
+                # Poll until interrupted.
+                time.sleep(5)
+
+            fake_client.call_on_each_event = call_on_each_event_mock.__get__(
+                fake_client, fake_client.__class__
+            )
+            with self.assertRaises(SystemExit) as exit, self.assertLogs(level="ERROR"):
+                run_message_handler_for_bot(
+                    lib_module=mock_lib_module,
+                    quiet=True,
+                    config_file=None,
+                    bot_config_file=None,
+                    bot_name="testbot",
+                    bot_source="bot code location",
+                )
+            self.assertEqual(exit.exception.code, 1)
 
     def test_upload_file(self):
         client, handler = self._create_client_and_handler_for_file_upload()
@@ -160,6 +160,26 @@ class BotServerTests(BotServerTestCase):
         assert opts.bot_config_file is None
         assert opts.hostname == "127.0.0.1"
         assert opts.port == 5002
+        assert opts.pool_size == 10
+
+    @mock.patch("zulip_bots.lib.ExternalBotHandler")
+    def test_bots_share_a_connection_pool(self, mock_ExternalBotHandler: mock.Mock) -> None:
+        available_bots = ["helloworld", "help"]
+        bots_config = {
+            bot: {
+                "email": f"{bot}-bot@zulip.com",
+                "key": "123456789qwertyuiop",
+                "site": "http://localhost",
+                "token": "abcd1234",
+            }
+            for bot in available_bots
+        }
+        bots_lib_modules = server.load_lib_modules(available_bots)
+        server.load_bot_handlers(available_bots, bots_lib_modules, bots_config)
+        clients = [call[0][0] for call in mock_ExternalBotHandler.call_args_list]
+        assert len(clients) == 2
+        assert clients[0].transport is not None
+        assert clients[0].transport is clients[1].transport
 
     def test_read_config_from_env_vars(self) -> None:
         # We use an OrderedDict so that the order of the entries in
@@ -49,4 +49,12 @@ def parse_args() -> argparse.Namespace:
         type=int,
         help="Port on which you want to run the Botserver. (default: %(default)d)",
     )
+    parser.add_argument(
+        "--pool-size",
+        action="store",
+        default=10,
+        type=int,
+        help="Maximum number of connections to each Zulip server, shared by all the bots. "
+        "(default: %(default)d)",
+    )
     return parser.parse_args()
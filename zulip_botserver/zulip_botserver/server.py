@@ -14,7 +14,7 @@ from typing import Any, Dict, List, Optional
 from flask import Flask, request
 from werkzeug.exceptions import BadRequest, Unauthorized
 
-from zulip import Client
+from zulip import Client, Transport, get_json_codec
 from zulip_bots import lib
 from zulip_bots.finder import import_module_from_source, import_module_from_zulip_bot_registry
 from zulip_botserver.input_parameters import parse_args
@@ -141,13 +141,19 @@ def load_bot_handlers(
     bot_lib_modules: Dict[str, ModuleType],
     bots_config: Dict[str, Dict[str, str]],
     third_party_bot_conf: Optional[configparser.ConfigParser] = None,
+    transport: Optional[Transport] = None,
 ) -> Dict[str, lib.ExternalBotHandler]:
+    # All the bots share one connection pool, rather than each keeping
+    # connections (and doing TLS handshakes) of its own.
+    if transport is None:
+        transport = Transport()
     bot_handlers = {}
     for bot in available_bots:
         client = Client(
             email=bots_config[bot]["email"],
             api_key=bots_config[bot]["key"],
             site=bots_config[bot]["site"],
+            transport=transport,
         )
         bot_dir = os.path.join(os.path.dirname(os.path.abspath(bot_lib_modules[bot].__file__)))
         bot_handler = lib.ExternalBotHandler(
@@ -178,8 +184,11 @@ bots_config = {}  # type: Dict[str, Dict[str, str]]
 
 @app.route("/", methods=["POST"])
 def handle_bot() -> str:
-    event = request.get_json(force=True)
-    assert event is not None
+    json_codec = get_json_codec()
+    try:
+        event = json_codec.loads(request.get_data())
+    except ValueError:
+        raise BadRequest("Failed to decode JSON object")
     for bot_name, config in bots_config.items():
         if config["email"] == event["bot_email"]:
             bot = bot_name
@@ -210,11 +219,11 @@ def handle_bot() -> str:
         # In that case, the message shall not be handled.
         message["content"] = lib.extract_query_without_mention(message=message, client=bot_handler)
         if message["content"] is None:
-            return json.dumps(dict(response_not_required=True))
+            return json_codec.dumps(dict(response_not_required=True))
 
     if is_private_message or is_mentioned:
         message_handler.handle_message(message=message, bot_handler=bot_handler)
-    return json.dumps(dict(response_not_required=True))
+    return json_codec.dumps(dict(response_not_required=True))
 
 
 def main() -> None:
@@ -246,7 +255,11 @@ def main() -> None:
         parse_config_file(options.bot_config_file) if options.bot_config_file is not None else None
     )
     bot_handlers = load_bot_handlers(
-        available_bots, bots_lib_modules, bots_config, third_party_bot_conf
+        available_bots,
+        bots_lib_modules,
+        bots_config,
+        third_party_bot_conf,
+        Transport(pool_size=options.pool_size),
     )
     message_handlers = init_message_handlers(available_bots, bots_lib_modules, bot_handlers)
     app.config["BOTS_LIB_MODULES"] = bots_lib_modules